@@ -93,6 +93,50 @@ variable "sqs_visibility_timeout" {
   default     = 300
 }
 
+variable "processor_record_concurrency" {
+  description = "Number of SQS records processed in parallel within one weather processor invocation"
+  type        = number
+  default     = 4
+}
+
+variable "authorizer_quota_tiers" {
+  description = "Per-principal request quotas of the authorizer (requests per second and burst), keyed by tier"
+  type        = map(object({ rate = number, burst = number }))
+  default = {
+    standard = { rate = 1, burst = 60 }
+  }
+}
+
+variable "authorizer_result_ttl_seconds" {
+  description = "API Gateway cache of authorizer decisions, quotas are only counted for requests that reach the authorizer"
+  type        = number
+  default     = 0
+}
+
+variable "compaction_schedule" {
+  description = "Schedule of the daily Parquet compaction (UTC)"
+  type        = string
+  default     = "cron(30 1 * * ? *)"
+}
+
+variable "subscription_schedule" {
+  description = "How often the scheduler notifies the scheduled subscriptions that are due"
+  type        = string
+  default     = "rate(5 minutes)"
+}
+
+variable "schedule_max_cities" {
+  description = "Cities fetched per scheduler run, the subscriptions of further cities wait for the next run"
+  type        = number
+  default     = 50
+}
+
+variable "notification_cooldown_seconds" {
+  description = "Minimum seconds between two notifications of a recipient for a city"
+  type        = number
+  default     = 900
+}
+
 variable "log_retention_days" {
   description = "CloudWatch log retention in days"
   type        = number
@@ -133,6 +177,21 @@ locals {
       timeout     = 10
       memory_size = 128
     }
+    weather_compactor = {
+      name        = "${local.name_prefix}-weather-compactor"
+      handler     = "lambda_function.lambda_handler"
+      runtime     = "python3.13"
+      timeout     = 900
+      memory_size = 1024
+    }
+    # Same package as the weather fetcher, with the scheduler entry point
+    weather_scheduler = {
+      name        = "${local.name_prefix}-weather-scheduler"
+      handler     = "lambda_function.schedule_handler"
+      runtime     = "python3.13"
+      timeout     = 300
+      memory_size = var.lambda_memory_size
+    }
   }
 }
 
@@ -203,6 +262,20 @@ resource "aws_s3_bucket_lifecycle_configuration" "weather_bucket_lifecycle" {
       days_after_initiation = 7
     }
   }
+
+  # Claim-check payloads are only needed while their SQS message can still be delivered
+  rule {
+    id     = "weather_raw_payloads"
+    status = "Enabled"
+
+    filter {
+      prefix = "weather-raw/"
+    }
+
+    expiration {
+      days = 15
+    }
+  }
 }
 
 resource "aws_s3_bucket_public_access_block" "weather_bucket_pab" {
@@ -369,12 +442,35 @@ resource "aws_iam_role_policy" "lambda_execution_policy" {
         ]
         Resource = aws_sns_topic.weather_notifications.arn
       },
+      {
+        # SMS are published straight to phone numbers, which are not ARNs
+        Effect      = "Allow"
+        Action      = "sns:Publish"
+        NotResource = "arn:aws:sns:*:*:*"
+      },
       {
         Effect = "Allow"
         Action = [
           "secretsmanager:GetSecretValue"
         ]
         Resource = aws_secretsmanager_secret.weather_api_key.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem",
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:Query",
+          "dynamodb:Scan"
+        ]
+        Resource = [
+          aws_dynamodb_table.subscriptions.arn,
+          aws_dynamodb_table.alert_rules.arn,
+          aws_dynamodb_table.notification_state.arn,
+          aws_dynamodb_table.authorizer_quotas.arn
+        ]
       }
     ]
   })
@@ -488,15 +584,34 @@ resource "aws_lambda_function" "weather_functions" {
         AWS_REGION_NAME = data.aws_region.current.name
         LOG_LEVEL       = "INFO"
       },
-      each.key == "weather_fetcher" ? {
+      contains(["weather_fetcher", "weather_scheduler"], each.key) ? {
         WEATHER_API_SECRET_NAME = aws_secretsmanager_secret.weather_api_key.name
         SQS_QUEUE_URL           = aws_sqs_queue.weather_queue.id
         S3_BUCKET_NAME          = aws_s3_bucket.weather_bucket.bucket
         WEATHER_API_URL         = "https://api.openweathermap.org/data/2.5/weather"
       } : {},
       each.key == "weather_processor" ? {
+        S3_BUCKET_NAME          = aws_s3_bucket.weather_bucket.bucket
+        SNS_TOPIC_ARN           = aws_sns_topic.weather_notifications.arn
+        RECORD_CONCURRENCY      = tostring(var.processor_record_concurrency)
+        ALERT_RULES_STORE       = "dynamodb://${aws_dynamodb_table.alert_rules.name}"
+        NOTIFICATION_MODE       = "both"
+        ALERT_STATE_STORE       = "dynamodb://${aws_dynamodb_table.notification_state.name}"
+        CHANGE_DETECTION        = "true"
+        CHANGE_STATE_STORE      = "dynamodb://${aws_dynamodb_table.notification_state.name}"
+        CHANGE_COOLDOWN_SECONDS = tostring(var.notification_cooldown_seconds)
+      } : {},
+      each.key == "authorizer" ? {
+        QUOTA_TIERS = jsonencode(var.authorizer_quota_tiers)
+        QUOTA_STORE = "dynamodb://${aws_dynamodb_table.authorizer_quotas.name}"
+      } : {},
+      each.key == "weather_compactor" ? {
         S3_BUCKET_NAME = aws_s3_bucket.weather_bucket.bucket
-        SNS_TOPIC_ARN  = aws_sns_topic.weather_notifications.arn
+        PARQUET_PREFIX = "weather-parquet"
+      } : {},
+      each.key == "weather_scheduler" ? {
+        SUBSCRIPTION_STORE  = "dynamodb://${aws_dynamodb_table.subscriptions.name}"
+        SCHEDULE_MAX_CITIES = tostring(var.schedule_max_cities)
       } : {}
     )
   }
@@ -546,9 +661,151 @@ resource "aws_lambda_event_source_mapping" "weather_processor_sqs" {
   function_name    = aws_lambda_function.weather_functions["weather_processor"].arn
   batch_size       = 10
 
+  # Let the processor report failed messages individually instead of retrying the whole batch
+  function_response_types = ["ReportBatchItemFailures"]
+
   depends_on = [aws_iam_role_policy.lambda_execution_policy]
 }
 
+###########################################
+# DAILY PARQUET COMPACTION
+###########################################
+
+resource "aws_cloudwatch_event_rule" "weather_compaction" {
+  name                = "${local.name_prefix}-weather-compaction"
+  description         = "Compact the previous day of weather data into Parquet"
+  schedule_expression = var.compaction_schedule
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "weather_compaction" {
+  rule = aws_cloudwatch_event_rule.weather_compaction.name
+  arn  = aws_lambda_function.weather_functions["weather_compactor"].arn
+}
+
+resource "aws_lambda_permission" "events_lambda_compactor" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.weather_functions["weather_compactor"].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.weather_compaction.arn
+}
+
+###########################################
+# SCHEDULED SUBSCRIPTIONS
+###########################################
+
+resource "aws_dynamodb_table" "subscriptions" {
+  name         = "${local.name_prefix}-subscriptions"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "subscription_id"
+
+  attribute {
+    name = "subscription_id"
+    type = "S"
+  }
+
+  tags = merge(local.common_tags, {
+    Name = "Scheduled Subscriptions"
+    Type = "Storage"
+  })
+}
+
+resource "aws_cloudwatch_event_rule" "weather_schedule" {
+  name                = "${local.name_prefix}-weather-schedule"
+  description         = "Notify the scheduled subscriptions that are due"
+  schedule_expression = var.subscription_schedule
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "weather_schedule" {
+  rule = aws_cloudwatch_event_rule.weather_schedule.name
+  arn  = aws_lambda_function.weather_functions["weather_scheduler"].arn
+}
+
+resource "aws_lambda_permission" "events_lambda_scheduler" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.weather_functions["weather_scheduler"].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.weather_schedule.arn
+}
+
+###########################################
+# ALERT RULES AND NOTIFICATION STATE
+###########################################
+
+resource "aws_dynamodb_table" "alert_rules" {
+  name         = "${local.name_prefix}-alert-rules"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "city_key"
+  range_key    = "rule_id"
+
+  attribute {
+    name = "city_key"
+    type = "S"
+  }
+
+  attribute {
+    name = "rule_id"
+    type = "S"
+  }
+
+  tags = merge(local.common_tags, {
+    Name = "Alert Rules"
+    Type = "Storage"
+  })
+}
+
+resource "aws_dynamodb_table" "notification_state" {
+  name         = "${local.name_prefix}-notification-state"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = merge(local.common_tags, {
+    Name = "Notification State"
+    Type = "Storage"
+  })
+}
+
+###########################################
+# AUTHORIZER QUOTAS
+###########################################
+
+# Token buckets shared by every authorizer container, so a quota is not multiplied by the container count
+resource "aws_dynamodb_table" "authorizer_quotas" {
+  name         = "${local.name_prefix}-authorizer-quotas"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = merge(local.common_tags, {
+    Name = "Authorizer Quotas"
+    Type = "Storage"
+  })
+}
+
 ###########################################
 # API GATEWAY
 ###########################################
@@ -575,7 +832,17 @@ resource "aws_api_gateway_authorizer" "weather_authorizer" {
   authorizer_credentials           = aws_iam_role.api_gateway_invocation_role.arn
   type                             = "REQUEST"
   identity_source                  = "method.request.header.Authorization"
-  authorizer_result_ttl_in_seconds = 300
+  authorizer_result_ttl_in_seconds = var.authorizer_result_ttl_seconds
+}
+
+# Callers denied by the authorizer learn why, e.g. {"reason": "quota_exceeded", "retryAfter": "2"}
+resource "aws_api_gateway_gateway_response" "access_denied" {
+  rest_api_id   = aws_api_gateway_rest_api.weather_api.id
+  response_type = "ACCESS_DENIED"
+
+  response_templates = {
+    "application/json" = "{\"message\": $context.error.messageString, \"reason\": \"$context.authorizer.reason\", \"retryAfter\": \"$context.authorizer.retryAfter\"}"
+  }
 }
 
 # API Gateway resources and methods
@@ -626,6 +893,27 @@ resource "aws_api_gateway_method_response" "weather_200" {
   }
 }
 
+# Error responses of the Weather Fetcher, 429 and 503 tell the client when to retry
+resource "aws_api_gateway_method_response" "weather_errors" {
+  for_each    = toset(["429", "500", "503"])
+  rest_api_id = aws_api_gateway_rest_api.weather_api.id
+  resource_id = aws_api_gateway_resource.weather_resource.id
+  http_method = aws_api_gateway_method.weather_post.http_method
+  status_code = each.value
+
+  depends_on = [
+    aws_api_gateway_integration.weather_post_integration
+  ]
+
+  response_parameters = {
+    "method.response.header.Retry-After" = false
+  }
+
+  response_models = {
+    "application/json" = "Error"
+  }
+}
+
 resource "aws_api_gateway_integration_response" "weather_200" {
   rest_api_id       = aws_api_gateway_rest_api.weather_api.id
   resource_id       = aws_api_gateway_resource.weather_resource.id
@@ -633,10 +921,24 @@ resource "aws_api_gateway_integration_response" "weather_200" {
   status_code       = aws_api_gateway_method_response.weather_200.status_code
   selection_pattern = "" # empty means match 200
   depends_on = [
-    aws_api_gateway_integration.weather_post_integration
+    aws_api_gateway_integration.weather_post_integration,
+    aws_api_gateway_method_response.weather_errors
   ]
+  # The Weather Fetcher returns errors as {"statusCode", "headers", "body"}, the integration is not a
+  # proxy one so their status and Retry-After header are set here instead of being returned with a 200
   response_templates = {
-    "application/json" = ""
+    "application/json" = <<-EOT
+      #set($response = $input.path('$'))
+      #if("$!response.statusCode" != "")
+      #set($context.responseOverride.status = $response.statusCode)
+      #if("$!response.headers.get('Retry-After')" != "")
+      #set($context.responseOverride.header.Retry-After = $response.headers.get('Retry-After'))
+      #end
+      $response.body
+      #else
+      $input.json('$')
+      #end
+    EOT
   }
 }
 
@@ -672,6 +974,8 @@ resource "aws_api_gateway_deployment" "weather_deployment" {
     aws_api_gateway_integration.weather_post_integration,
     aws_api_gateway_integration_response.weather_200,
     aws_api_gateway_method_response.weather_200,
+    aws_api_gateway_method_response.weather_errors,
+    aws_api_gateway_gateway_response.access_denied,
   ]
 
   rest_api_id = aws_api_gateway_rest_api.weather_api.id
@@ -683,6 +987,8 @@ resource "aws_api_gateway_deployment" "weather_deployment" {
       aws_api_gateway_integration.weather_post_integration.id,
       aws_api_gateway_integration_response.weather_200,
       aws_api_gateway_method_response.weather_200,
+      aws_api_gateway_method_response.weather_errors,
+      aws_api_gateway_gateway_response.access_denied,
     ]))
   }
 
@@ -0,0 +1,240 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    from ..common.cache import LRUCache
+except ImportError:
+    from common.cache import LRUCache
+
+logger = logging.getLogger()
+
+SUPPORTED_ALGORITHMS = ('RS256', 'ES256')
+
+
+class InvalidTokenError(Exception):
+    """
+    The token is malformed, its signature does not verify or its claims are not acceptable
+    """
+
+
+def base64url_decode(value):
+    if isinstance(value, str):
+        value = value.encode('ascii')
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
+
+
+def _int_from_base64url(value):
+    return int.from_bytes(base64url_decode(value), 'big')
+
+
+def public_key_from_jwk(jwk):
+    """
+    Public key object of an RSA or P-256 EC JSON Web Key
+    """
+    # cryptography is only loaded once a JWKS is read, authorizers without JWKS_URL never pay for it
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if jwk.get('kty') == 'RSA':
+        return rsa.RSAPublicNumbers(_int_from_base64url(jwk['e']), _int_from_base64url(jwk['n'])).public_key()
+    if jwk.get('kty') == 'EC' and jwk.get('crv') == 'P-256':
+        return ec.EllipticCurvePublicNumbers(
+            _int_from_base64url(jwk['x']),
+            _int_from_base64url(jwk['y']),
+            ec.SECP256R1()
+        ).public_key()
+    raise ValueError(f"Unsupported JWK type {jwk.get('kty')}")
+
+
+def read_jwks(source, timeout=5):
+    """
+    JWKS document of an https:// URL, or of a local file standing in for it
+    """
+    if source.startswith('https://') or source.startswith('http://'):
+        import urllib.request
+
+        with urllib.request.urlopen(source, timeout=timeout) as response:
+            return json.loads(response.read())
+    path = source[len('file://'):] if source.startswith('file://') else source
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+class JWKSCache:
+    """
+    Signing keys of a JWKS document, fetched once and kept for `ttl_seconds`. An unknown key id
+    triggers a refresh so rotated keys are picked up, at most once per `min_refresh_seconds`.
+    """
+
+    def __init__(self, source, ttl_seconds=3600, min_refresh_seconds=60, loader=read_jwks, clock=time.monotonic):
+        self.source = source
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._loader = loader
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._expires_at = None
+        self._refreshed_at = None
+        self.fetches = 0
+
+    def key(self, kid):
+        keys = self._current_keys()
+        if kid in keys:
+            return keys[kid]
+        with self._lock:
+            if self._refreshed_at is None or self._clock() - self._refreshed_at >= self.min_refresh_seconds:
+                logger.info(f"Unknown key id {kid}, refreshing the JWKS")
+                self._refresh()
+            return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._expires_at = None
+            self._refreshed_at = None
+            self.fetches = 0
+
+    def _current_keys(self):
+        if self._expires_at is not None and self._expires_at > self._clock():
+            return self._keys
+        with self._lock:
+            if self._expires_at is None or self._expires_at <= self._clock():
+                self._refresh()
+            return self._keys
+
+    def _refresh(self):
+        document = self._loader(self.source)
+        keys = {}
+        for jwk in document.get('keys', []):
+            if jwk.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[jwk.get('kid')] = (jwk.get('alg'), public_key_from_jwk(jwk))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Ignoring JWK {jwk.get('kid')}: {str(e)}")
+        self._keys = keys
+        self._expires_at = self._clock() + self.ttl_seconds
+        self._refreshed_at = self._clock()
+        self.fetches += 1
+
+
+class JWTVerifier:
+    """
+    Verifies RS256/ES256 JWTs against a JWKS. Verified claims are cached by token hash until the token
+    expires, so a repeated token costs one hash and one cache lookup.
+    """
+
+    def __init__(self, jwks, issuer=None, audience=None, leeway_seconds=0, max_cached_tokens=10000, clock=time.time):
+        self.jwks = jwks
+        self.issuer = issuer
+        self.audience = audience
+        self.leeway_seconds = leeway_seconds
+        self._clock = clock
+        self._claims = LRUCache(max_entries=max_cached_tokens, ttl_seconds=0, clock=clock)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Verifier configured by JWKS_URL (an https:// URL or a local JWKS file), None when JWTs are not used
+        """
+        source = os.environ.get('JWKS_URL')
+        if not source:
+            return None
+        return cls(
+            JWKSCache(
+                source,
+                ttl_seconds=int(os.environ.get('JWKS_CACHE_TTL', '3600')),
+                min_refresh_seconds=int(os.environ.get('JWKS_MIN_REFRESH_SECONDS', '60'))
+            ),
+            issuer=os.environ.get('JWT_ISSUER'),
+            audience=os.environ.get('JWT_AUDIENCE'),
+            leeway_seconds=int(os.environ.get('JWT_LEEWAY_SECONDS', '0')),
+            max_cached_tokens=int(os.environ.get('JWT_CLAIMS_CACHE_SIZE', '10000'))
+        )
+
+    def verify(self, token):
+        """
+        Claims of a valid token, raises InvalidTokenError otherwise
+        """
+        cache_key = hashlib.sha256(token.encode('utf-8')).digest()
+        claims = self._claims.get(cache_key)
+        if claims is not None:
+            return claims
+
+        claims = self._verify(token)
+        self._claims.put(cache_key, claims, ttl_seconds=claims['exp'] + self.leeway_seconds - self._clock())
+        return claims
+
+    def clear(self):
+        self._claims.clear()
+
+    def stats(self):
+        return self._claims.stats()
+
+    def _verify(self, token):
+        try:
+            encoded_header, encoded_payload, encoded_signature = token.split('.')
+            header = json.loads(base64url_decode(encoded_header))
+            claims = json.loads(base64url_decode(encoded_payload))
+            signature = base64url_decode(encoded_signature)
+        except (ValueError, TypeError) as e:
+            raise InvalidTokenError(f"Malformed token: {str(e)}")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidTokenError('Malformed token')
+
+        algorithm = header.get('alg')
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise InvalidTokenError(f"Unsupported algorithm {algorithm}")
+        entry = self.jwks.key(header.get('kid'))
+        if entry is None:
+            raise InvalidTokenError(f"Unknown key id {header.get('kid')}")
+        key_algorithm, public_key = entry
+        if key_algorithm and key_algorithm != algorithm:
+            raise InvalidTokenError(f"Key {header.get('kid')} is not a {algorithm} key")
+
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+        from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+        signing_input = f"{encoded_header}.{encoded_payload}".encode('ascii')
+        try:
+            if algorithm == 'RS256' and isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(signature, signing_input, padding.PKCS1v15(), hashes.SHA256())
+            elif algorithm == 'ES256' and isinstance(public_key, ec.EllipticCurvePublicKey) and len(signature) == 64:
+                # JWS carries the raw r || s pair, cryptography expects a DER signature
+                der_signature = encode_dss_signature(
+                    int.from_bytes(signature[:32], 'big'),
+                    int.from_bytes(signature[32:], 'big')
+                )
+                public_key.verify(der_signature, signing_input, ec.ECDSA(hashes.SHA256()))
+            else:
+                raise InvalidTokenError(f"Key {header.get('kid')} cannot verify {algorithm}")
+        except InvalidSignature:
+            raise InvalidTokenError('Invalid signature')
+
+        self._check_claims(claims)
+        return claims
+
+    def _check_claims(self, claims):
+        now = self._clock()
+        if not isinstance(claims.get('exp'), (int, float)):
+            raise InvalidTokenError('Token has no expiry')
+        if claims['exp'] + self.leeway_seconds <= now:
+            raise InvalidTokenError('Token has expired')
+        if isinstance(claims.get('nbf'), (int, float)) and claims['nbf'] - self.leeway_seconds > now:
+            raise InvalidTokenError('Token is not valid yet')
+        if not claims.get('sub'):
+            raise InvalidTokenError('Token has no subject')
+        if self.issuer is not None and claims.get('iss') != self.issuer:
+            raise InvalidTokenError(f"Unexpected issuer {claims.get('iss')}")
+        if self.audience is not None:
+            audience = claims.get('aud')
+            audiences = audience if isinstance(audience, list) else [audience]
+            if self.audience not in audiences:
+                raise InvalidTokenError(f"Unexpected audience {audience}")
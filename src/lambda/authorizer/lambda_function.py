@@ -1,60 +1,61 @@
 import os
 import logging
 
+try:
+    from ..common.cache import LRUCache
+    from .jwt_verifier import InvalidTokenError, JWTVerifier
+    from .quota import QuotaLimiter
+    from .token_store import TokenStore, token_fingerprint, token_from_header
+except ImportError:
+    from common.cache import LRUCache
+    from jwt_verifier import InvalidTokenError, JWTVerifier
+    from quota import QuotaLimiter
+    from token_store import TokenStore, token_fingerprint, token_from_header
+
 log_level_name = os.environ.get('LOG_LEVEL', 'INFO')
 log_level = getattr(logging, log_level_name.upper(), logging.INFO)
 logger = logging.getLogger()
 logger.setLevel(log_level)
 
+# Valid tokens, loaded once per container from AUTH_TOKENS_FILE / AUTH_TOKENS
+token_store = TokenStore.from_environment()
+
+# JWT verification against the JWKS of JWKS_URL, None when only API tokens are accepted
+jwt_verifier = JWTVerifier.from_environment()
+
+# Per-principal request quota of QUOTA_TIERS, None when callers are not throttled
+quota_limiter = QuotaLimiter.from_environment()
+
+# Authorizer responses per (principal, effect, method ARN), they never change for a container
+policy_cache = LRUCache(
+    max_entries=int(os.environ.get('POLICY_CACHE_MAX_ENTRIES', '1024')),
+    ttl_seconds=float('inf')
+)
+
 def lambda_handler(event, context):
     """
     Custom API Gateway Authorizer Lambda
     """
 
-    # Get the authorization token from the event
-    token = event.get('headers', {}).get('Authorization')
     method_arn = event.get('methodArn', '')
-    logger.info(f"Authorization header: {token}")
-
-    # Simple token validation (replace with your actual auth logic)
-    # In production, you might validate JWT tokens, API keys, etc.
-    valid_tokens = [
-        'Bearer valid-JWT-001',
-        'Bearer valid-JWT-002'
-    ]
-
     try:
-        # Validate the token
-        if token in valid_tokens:
-            effect = 'Allow'
-            principal_id = 'user123'  # Could extract from token
-        else:
-            effect = 'Deny'
-            principal_id = 'unauthorized'
-
-        # Build the policy document
-        policy_document = {
-            'Version': '2012-10-17',
-            'Statement': [
-                {
-                    'Action': 'execute-api:Invoke',
-                    'Effect': effect,
-                    'Resource': method_arn
-                }
-            ]
-        }
+        # Get the authorization token from the event, the raw header is never logged
+        headers = event.get('headers') or {}
+        header = headers.get('Authorization') or headers.get('authorization')
+        token = token_from_header(header)
+        principal_id = authenticate(token)
+        logger.debug(f"Authorization token {token_fingerprint(token)} valid: {principal_id is not None}")
 
-        # Return the authorization response
-        auth_response = {
-            'principalId': principal_id,
-            'policyDocument': policy_document,
-            'context': {
-                'userId': principal_id,
-                'tokenValid': str(effect == 'Allow').lower()
-            }
-        }
+        if principal_id is None:
+            return auth_response('unauthorized', 'Deny', method_arn)
 
-        return auth_response
+        # Throttled callers are stopped here, before any downstream work is started
+        if quota_limiter is not None:
+            decision = quota_limiter.check(principal_id)
+            if not decision.allowed:
+                logger.info(f"Principal {principal_id} exceeded the {decision.tier} quota")
+                return quota_exceeded_response(principal_id, method_arn, decision)
+        return auth_response(principal_id, 'Allow', method_arn)
 
     except Exception as e:
         logger.error(f"Authorization error: {str(e)}")
@@ -72,3 +73,52 @@ def lambda_handler(event, context):
                 ]
             }
         }
+
+# Principal of a token: the subject of a verified JWT or the owner of an API token, None when the token is not valid
+def authenticate(token):
+    if not token:
+        return None
+    if jwt_verifier is not None and token.count('.') == 2:
+        try:
+            return jwt_verifier.verify(token)['sub']
+        except InvalidTokenError as e:
+            logger.info(f"Rejected token {token_fingerprint(token)}: {str(e)}")
+            return None
+    return token_store.principal(token)
+
+# Authorizer response with its policy document, built once per principal, effect and method ARN
+def auth_response(principal_id, effect, method_arn):
+    cache_key = (principal_id, effect, method_arn)
+    response = policy_cache.get(cache_key)
+    if response is None:
+        response = {
+            'principalId': principal_id,
+            'policyDocument': {
+                'Version': '2012-10-17',
+                'Statement': [
+                    {
+                        'Action': 'execute-api:Invoke',
+                        'Effect': effect,
+                        'Resource': method_arn
+                    }
+                ]
+            },
+            'context': {
+                'userId': principal_id,
+                'tokenValid': str(effect == 'Allow').lower()
+            }
+        }
+        policy_cache.put(cache_key, response)
+    return response
+
+# Deny response of a caller over its quota, the reason and retry delay are passed to the gateway response
+def quota_exceeded_response(principal_id, method_arn, decision):
+    response = dict(auth_response(principal_id, 'Deny', method_arn))
+    response['context'] = {
+        'userId': principal_id,
+        'tokenValid': 'true',
+        'reason': 'quota_exceeded',
+        'quotaTier': decision.tier,
+        'retryAfter': str(max(1, int(decision.retry_after + 0.999)))
+    }
+    return response
@@ -0,0 +1,214 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger()
+
+# Sustained requests per second and burst size of a quota tier, a rate of None means unlimited and
+# a rate of 0 a fixed allowance of `burst` requests that never refills while the principal keeps calling
+QuotaTier = namedtuple('QuotaTier', ['rate', 'burst'])
+
+# Outcome of a quota check, retry_after is in seconds
+QuotaDecision = namedtuple('QuotaDecision', ['allowed', 'tier', 'remaining', 'retry_after'])
+
+DEFAULT_TIERS = {'standard': QuotaTier(rate=1.0, burst=60)}
+
+# Quota state is dropped once a bucket would be full again anyway
+IDLE_BUCKET_TTL_SECONDS = 3600
+
+
+def refill(tokens, updated_at, tier, now):
+    return min(float(tier.burst), tokens + max(0.0, now - updated_at) * max(tier.rate, 0.0))
+
+
+def take(tokens, tier, cost):
+    """
+    Returns (allowed, tokens left, seconds until `cost` tokens are available)
+    """
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    if tier.rate <= 0:
+        # Nothing refills, the allowance only comes back once the idle bucket expires
+        return False, tokens, float(IDLE_BUCKET_TTL_SECONDS)
+    return False, tokens, (cost - tokens) / tier.rate
+
+
+class MemoryQuotaCounter:
+    """
+    Token buckets kept by the warm container, quotas are per container
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, tier, cost=1):
+        with self._lock:
+            now = self._clock()
+            tokens, updated_at = self._buckets.get(key, (float(tier.burst), now))
+            if now - updated_at >= IDLE_BUCKET_TTL_SECONDS:
+                tokens = float(tier.burst)
+            allowed, tokens, retry_after = take(refill(tokens, updated_at, tier, now), tier, cost)
+            self._buckets[key] = (tokens, now)
+        return allowed, tokens, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class StoreQuotaCounter:
+    """
+    Token buckets kept in a KeyValueStore, e.g. a FileStore standing in for the shared store locally.
+    Updates are read-modify-write, so concurrent callers of one principal may overspend slightly.
+    """
+
+    def __init__(self, store, clock=time.time):
+        self.store = store
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def consume(self, key, tier, cost=1):
+        with self._lock:
+            now = self._clock()
+            state = self.store.get(f"quota:{key}") or {'tokens': tier.burst, 'updated_at': now}
+            allowed, tokens, retry_after = take(refill(state['tokens'], state['updated_at'], tier, now), tier, cost)
+            self.store.put(f"quota:{key}", {'tokens': tokens, 'updated_at': now}, ttl_seconds=IDLE_BUCKET_TTL_SECONDS)
+        return allowed, tokens, retry_after
+
+
+class DynamoDBQuotaCounter:
+    """
+    Token buckets shared by every container in a DynamoDB table with a 'key' partition key and
+    'expires_at' as TTL attribute. Conditional writes keep concurrent updates of a bucket consistent.
+    """
+
+    def __init__(self, table_name, max_attempts=3, clock=time.time):
+        # aws_clients loads boto3, only authorizers keeping their buckets in DynamoDB import it
+        try:
+            from ..common import aws_clients
+        except ImportError:
+            from common import aws_clients
+        self.table_name = table_name
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._aws_clients = aws_clients
+
+    def consume(self, key, tier, cost=1):
+        dynamodb = self._aws_clients.client('dynamodb')
+        item_key = {'key': {'S': f"quota:{key}"}}
+        for _ in range(self.max_attempts):
+            item = dynamodb.get_item(TableName=self.table_name, Key=item_key, ConsistentRead=True).get('Item')
+            now = self._clock()
+            if item is None:
+                tokens, updated_at = float(tier.burst), now
+                condition = {'ConditionExpression': 'attribute_not_exists(#key)', 'ExpressionAttributeNames': {'#key': 'key'}}
+            else:
+                tokens, updated_at = float(item['tokens']['N']), float(item['updated_at']['N'])
+                condition = {
+                    'ConditionExpression': 'updated_at = :updated_at',
+                    'ExpressionAttributeValues': {':updated_at': item['updated_at']}
+                }
+            allowed, tokens, retry_after = take(refill(tokens, updated_at, tier, now), tier, cost)
+            try:
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item=dict(item_key, **{
+                        'tokens': {'N': repr(tokens)},
+                        'updated_at': {'N': repr(now)},
+                        'expires_at': {'N': str(int(now + IDLE_BUCKET_TTL_SECONDS))}
+                    }),
+                    **condition
+                )
+                return allowed, tokens, retry_after
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                # Another container updated the bucket in between, read it again
+                continue
+        raise RuntimeError(f"Quota bucket {key} is updated too often to be consumed")
+
+
+def quota_counter_from_url(url):
+    """
+    Counter backend of a URL such as memory://, file:///tmp/quota or dynamodb://table-name, in memory by default
+    """
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return MemoryQuotaCounter()
+    if parsed.scheme == 'file':
+        # common.stores imports aws_clients and with it boto3, which a file store never uses
+        try:
+            from ..common.stores import FileStore
+        except ImportError:
+            from common.stores import FileStore
+        return StoreQuotaCounter(FileStore(parsed.netloc + parsed.path))
+    if parsed.scheme == 'dynamodb':
+        return DynamoDBQuotaCounter(parsed.netloc)
+    raise ValueError(f"Unsupported quota store URL: {url}")
+
+
+def parse_tiers(text):
+    """
+    Tiers of a JSON object such as {"standard": {"rate": 1, "burst": 60}, "internal": {"rate": null}}
+    """
+    tiers = {}
+    for name, limits in json.loads(text).items():
+        rate = limits.get('rate')
+        tiers[name] = QuotaTier(
+            rate=float(rate) if rate is not None else None,
+            burst=int(limits.get('burst', max(1, math.ceil(rate or 1))))
+        )
+    return tiers
+
+
+class QuotaLimiter:
+    """
+    Per-principal token-bucket quota, limits depend on the tier of the principal
+    """
+
+    def __init__(self, tiers=None, counter=None, principal_tiers=None, default_tier='standard'):
+        self.tiers = tiers or DEFAULT_TIERS
+        self.counter = counter or MemoryQuotaCounter()
+        self.principal_tiers = principal_tiers or {}
+        self.default_tier = default_tier
+        if default_tier not in self.tiers:
+            raise ValueError(f"Unknown default quota tier {default_tier}")
+        self.throttled = 0
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Limiter configured by QUOTA_TIERS, None when quotas are not enabled
+        """
+        if not os.environ.get('QUOTA_TIERS'):
+            return None
+        return cls(
+            tiers=parse_tiers(os.environ['QUOTA_TIERS']),
+            counter=quota_counter_from_url(os.environ.get('QUOTA_STORE')),
+            principal_tiers=json.loads(os.environ.get('QUOTA_PRINCIPAL_TIERS', '{}')),
+            default_tier=os.environ.get('QUOTA_DEFAULT_TIER', 'standard')
+        )
+
+    def tier_of(self, principal):
+        name = self.principal_tiers.get(principal, self.default_tier)
+        return name if name in self.tiers else self.default_tier
+
+    def check(self, principal, cost=1):
+        tier_name = self.tier_of(principal)
+        tier = self.tiers[tier_name]
+        if tier.rate is None:
+            return QuotaDecision(True, tier_name, None, 0.0)
+        try:
+            allowed, remaining, retry_after = self.counter.consume(principal, tier, cost)
+        except Exception as e:
+            # An unavailable counter must not lock every caller out
+            logger.warning(f"Quota check failed for {principal}, allowing the request: {str(e)}")
+            return QuotaDecision(True, tier_name, None, 0.0)
+        if not allowed:
+            self.throttled += 1
+        return QuotaDecision(allowed, tier_name, int(remaining), retry_after)
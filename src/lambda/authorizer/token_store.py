@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+# Tokens accepted when no token file or AUTH_TOKENS is configured
+DEFAULT_TOKENS = {
+    'valid-JWT-001': 'user123',
+    'valid-JWT-002': 'user123'
+}
+
+DEFAULT_PRINCIPAL = 'user123'
+
+DIGEST_PREFIX = 'sha256:'
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+def token_fingerprint(token):
+    """
+    Short, non-reversible identifier of a token that is safe to log
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:8] if token else 'none'
+
+
+def token_from_header(header):
+    """
+    Token of an Authorization header using the Bearer scheme, None for any other header
+    """
+    if not header:
+        return None
+    parts = header.split(None, 1)
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return None
+    return parts[1].strip() or None
+
+
+class TokenStore:
+    """
+    API tokens of the container, kept as SHA-256 digests only. A lookup costs one hash and one dict
+    access whatever the number of tokens.
+    """
+
+    def __init__(self, tokens=None):
+        self._principals = {}
+        for token, principal in (tokens or {}).items():
+            self.add(token, principal)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Tokens of AUTH_TOKENS_FILE and AUTH_TOKENS, or the default tokens when neither is set
+        """
+        store = cls()
+        tokens_file = os.environ.get('AUTH_TOKENS_FILE')
+        if tokens_file:
+            with open(tokens_file, encoding='utf-8') as file:
+                store.load(file.read())
+        if os.environ.get('AUTH_TOKENS'):
+            store.load(os.environ['AUTH_TOKENS'].replace(',', '\n'))
+        if not tokens_file and not os.environ.get('AUTH_TOKENS'):
+            for token, principal in DEFAULT_TOKENS.items():
+                store.add(token, principal)
+        logger.info(f"Loaded {len(store)} API tokens")
+        return store
+
+    def load(self, text):
+        """
+        Add tokens from a JSON object {token: principal} or from lines of `token [principal]`,
+        where a token written as sha256:<hex digest> keeps the plain token out of the file
+        """
+        text = text.strip()
+        if text.startswith('{'):
+            entries = json.loads(text).items()
+        else:
+            entries = []
+            for line in text.splitlines():
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                entries.append((parts[0], parts[1].strip() if len(parts) > 1 else DEFAULT_PRINCIPAL))
+        for token, principal in entries:
+            self.add(token, principal)
+
+    def add(self, token, principal=DEFAULT_PRINCIPAL):
+        if token.startswith(DIGEST_PREFIX):
+            digest = bytes.fromhex(token[len(DIGEST_PREFIX):])
+        else:
+            digest = token_digest(token)
+        self._principals[digest] = principal
+
+    def principal(self, token):
+        """
+        Principal of a valid token, None otherwise
+        """
+        if not token:
+            return None
+        # Hashing first is the timing defence: the lookup compares digests, whose timing says nothing
+        # about how much of a guessed token is right
+        return self._principals.get(token_digest(token))
+
+    def __len__(self):
+        return len(self._principals)
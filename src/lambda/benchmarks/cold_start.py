@@ -0,0 +1,353 @@
+"""
+Cold-start profile of the Lambda functions. Each function is packaged the way the deploy workflow
+does it, then measured in fresh interpreters: a `python -X importtime` breakdown of the init phase,
+and the import, first (cold) and second (warm) invocation latencies against a local endpoint that
+answers for the Weather API and for the AWS services.
+
+Run from src/lambda:
+    python -m benchmarks.cold_start --runs 5 --output cold-start.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose presence after init tells whether a heavy dependency is still loaded eagerly
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'urllib3', 'cryptography')
+
+ACCOUNT_ID = '123456789012'
+REGION = 'ap-southeast-2'
+
+WEATHER_DATA = {
+    'coord': {'lon': 151.2073, 'lat': -33.8679},
+    'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}],
+    'main': {'temp': 295.15, 'feels_like': 295.0, 'humidity': 60, 'pressure': 1015},
+    'wind': {'speed': 4.1, 'deg': 120},
+    'dt': 1714569600,
+    'sys': {'country': 'AU'},
+    'id': 2147714,
+    'name': 'Sydney'
+}
+
+
+def fetcher_event(city_name):
+    return {'city_name': city_name, 'country_code': 'AU', 'notification_type': 'email', 'email': 'user@example.com'}
+
+
+def processor_event(city_name):
+    # The original message format, so the event does not depend on the code being measured
+    body = {
+        'status_code': 200,
+        'notification_type': 'email',
+        'email': 'user@example.com',
+        'phone_number': '',
+        'city_name': city_name,
+        'country_code': 'AU',
+        'data': dict(WEATHER_DATA, name=city_name),
+        'response_time_ms': 120,
+        'cache_status': 'miss'
+    }
+    return {'Records': [{'messageId': f"message-{city_name}", 'body': json.dumps(body)}]}
+
+
+def authorizer_event(token):
+    return {
+        'type': 'REQUEST',
+        'methodArn': f"arn:aws:execute-api:{REGION}:{ACCOUNT_ID}:api/prod/POST/weather",
+        'headers': {'Authorization': f"Bearer {token}"}
+    }
+
+
+# Function measured, extra environment, and the events of the cold and the warm invocation
+SCENARIOS = {
+    'weather_fetcher': ('weather_fetcher', {}, fetcher_event('Sydney'), fetcher_event('Melbourne')),
+    'weather_fetcher_urllib3': (
+        'weather_fetcher', {'HTTP_CLIENT': 'urllib3'}, fetcher_event('Sydney'), fetcher_event('Melbourne')
+    ),
+    'weather_processor': ('weather_processor', {}, processor_event('Sydney'), processor_event('Melbourne')),
+    'authorizer': ('authorizer', {}, authorizer_event('valid-JWT-001'), authorizer_event('valid-JWT-002'))
+}
+
+# Runs in the fresh interpreter: times the import of the handler module and two invocations
+INVOKE_PROBE = """
+import json, sys, time
+events, heavy_modules = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+started = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+loaded_after_import = [name for name in heavy_modules if name in sys.modules]
+lambda_function.lambda_handler(events[0], None)
+first = time.perf_counter()
+lambda_function.lambda_handler(events[1], None)
+second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_invocation_ms': (first - imported) * 1000,
+    'warm_invocation_ms': (second - first) * 1000,
+    'loaded_after_import': loaded_after_import,
+    'loaded_after_invocation': [name for name in heavy_modules if name in sys.modules]
+}))
+"""
+
+IMPORT_PROBE = """
+import json, sys
+import lambda_function
+print(json.dumps([name for name in json.loads(sys.argv[1]) if name in sys.modules]))
+"""
+
+
+class FakeEndpointHandler(BaseHTTPRequestHandler):
+    """
+    Canned answers for the calls made by the functions: the Weather API, Secrets Manager, SQS
+    (JSON protocol), S3 (path-style REST) and SNS (query protocol)
+    """
+
+    # HTTP/1.1 keeps connections alive and answers the Expect: 100-continue sent with S3 uploads
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, without TCP_NODELAY every answer waits for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/weather':
+            return self.reply(200, json.dumps(WEATHER_DATA).encode('utf-8'), 'application/json')
+        self.reply(404, b'')
+
+    def do_PUT(self):
+        self.read_body()
+        self.send_response(200)
+        self.send_header('ETag', '"fake"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.read_body()
+        target = self.headers.get('X-Amz-Target', '')
+        if target == 'secretsmanager.GetSecretValue':
+            request = json.loads(body)
+            return self.reply_json({'Name': request['SecretId'], 'SecretString': 'fake-api-key'})
+        if target == 'AmazonSQS.SendMessage':
+            request = json.loads(body)
+            return self.reply_json({'MessageId': 'fake', 'MD5OfMessageBody': md5(request['MessageBody'])})
+        if target == 'AmazonSQS.SendMessageBatch':
+            request = json.loads(body)
+            return self.reply_json({'Successful': [
+                {'Id': entry['Id'], 'MessageId': 'fake', 'MD5OfMessageBody': md5(entry['MessageBody'])}
+                for entry in request['Entries']
+            ], 'Failed': []})
+        action = parse_qs(body.decode('utf-8')).get('Action', [''])[0]
+        results = {
+            'Publish': '<MessageId>fake</MessageId>',
+            'PublishBatch': '<Successful/><Failed/>',
+            'Subscribe': '<SubscriptionArn>pending confirmation</SubscriptionArn>',
+            'ListSubscriptionsByTopic': '<Subscriptions/>'
+        }
+        if action in results:
+            xml = (
+                f'<{action}Response xmlns="http://sns.amazonaws.com/doc/2010-03-31/">'
+                f'<{action}Result>{results[action]}</{action}Result>'
+                f'<ResponseMetadata><RequestId>fake</RequestId></ResponseMetadata></{action}Response>'
+            )
+            return self.reply(200, xml.encode('utf-8'), 'text/xml')
+        self.reply(400, b'')
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def reply_json(self, document):
+        self.reply(200, json.dumps(document).encode('utf-8'), 'application/x-amz-json-1.0')
+
+    def reply(self, status, body, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def md5(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def build_package(function, target):
+    """
+    Lay out a function like its deployment package: its modules plus the shared ones under common/
+    """
+    source = os.path.join(LAMBDA_ROOT, function)
+    os.makedirs(os.path.join(target, 'common'))
+    for name in os.listdir(source):
+        if name.endswith('.py') and name != '__init__.py':
+            shutil.copy(os.path.join(source, name), target)
+    common = os.path.join(LAMBDA_ROOT, 'common')
+    for name in os.listdir(common):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(common, name), os.path.join(target, 'common'))
+    return target
+
+
+def function_environment(endpoint_url, extra):
+    env = {
+        key: value for key, value in os.environ.items()
+        if not key.startswith('AWS_') and key not in ('PYTHONPATH', 'HTTP_CLIENT')
+    }
+    env.update({
+        'AWS_ENDPOINT_URL': endpoint_url,
+        'AWS_ACCESS_KEY_ID': 'fake',
+        'AWS_SECRET_ACCESS_KEY': 'fake',
+        'AWS_DEFAULT_REGION': REGION,
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'LOG_LEVEL': 'WARNING',
+        'WEATHER_API_URL': f"{endpoint_url}/weather",
+        'WEATHER_API_SECRET_NAME': 'weather-api-key',
+        'SQS_QUEUE_URL': f"{endpoint_url}/{ACCOUNT_ID}/weather-queue",
+        'S3_BUCKET_NAME': 'weather-data',
+        'SNS_TOPIC_ARN': f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:weather-notifications"
+    })
+    env.update(extra)
+    return env
+
+
+def parse_importtime(stderr):
+    """
+    (module, self us, cumulative us, depth) of each line of `python -X importtime` output
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def import_profile(package_dir, env, top=10):
+    """
+    Import time of the handler module with its slowest top-level imports and slowest modules
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_PROBE, json.dumps(HEAVY_MODULES)],
+        cwd=package_dir, env=env, capture_output=True, text=True, check=True
+    )
+    entries = parse_importtime(completed.stderr)
+    # Modules are listed after their imports, so the handler's own imports are the lines between
+    # the previous top-level module, e.g. the ones loaded by the interpreter startup, and the handler
+    end = next(index for index, entry in enumerate(entries) if entry[0] == 'lambda_function')
+    start = end
+    while start > 0 and entries[start - 1][3] > 0:
+        start -= 1
+    entries, handler = entries[start:end], entries[end]
+    # Top-level packages loaded on behalf of the handler, standard library included
+    roots = {}
+    for name, _, cumulative_us, depth in entries:
+        if depth == 1:
+            root = name.split('.')[0]
+            roots[root] = roots.get(root, 0) + cumulative_us
+    return {
+        'total_us': handler[2],
+        'self_us': handler[1],
+        'modules': len(entries),
+        'loaded': json.loads(completed.stdout),
+        'top_packages': [
+            {'package': name, 'cumulative_us': cumulative_us}
+            for name, cumulative_us in sorted(roots.items(), key=lambda item: -item[1])[:top]
+        ],
+        'top_self': [
+            {'module': name, 'self_us': self_us}
+            for name, self_us, _, _ in sorted(entries, key=lambda entry: -entry[1])[:top]
+        ]
+    }
+
+
+def invocation_profile(package_dir, env, events):
+    completed = subprocess.run(
+        [sys.executable, '-c', INVOKE_PROBE, json.dumps(events), json.dumps(HEAVY_MODULES)],
+        cwd=package_dir, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {
+        'median': round(statistics.median(samples), 2),
+        'min': round(min(samples), 2),
+        'max': round(max(samples), 2)
+    }
+
+
+def profile_scenario(name, endpoint_url, runs):
+    function, extra, cold_event, warm_event = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as workdir:
+        package_dir = build_package(function, os.path.join(workdir, function))
+        env = function_environment(endpoint_url, extra)
+        profile = import_profile(package_dir, env)
+        invocations = [invocation_profile(package_dir, env, [cold_event, warm_event]) for _ in range(runs)]
+    return {
+        'function': function,
+        'environment': extra,
+        'importtime': profile,
+        'import_ms': summarize([run['import_ms'] for run in invocations]),
+        'first_invocation_ms': summarize([run['first_invocation_ms'] for run in invocations]),
+        'warm_invocation_ms': summarize([run['warm_invocation_ms'] for run in invocations]),
+        'loaded_after_invocation': invocations[-1]['loaded_after_invocation']
+    }
+
+
+def start_endpoint():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEndpointHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure import time and first-invocation latency of each Lambda')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters started per function')
+    parser.add_argument('--function', action='append', choices=sorted(SCENARIOS), help='scenario to measure, all by default')
+    parser.add_argument('--output', help='file the JSON results are written to, stdout by default')
+    args = parser.parse_args(argv)
+
+    server, endpoint_url = start_endpoint()
+    try:
+        results = {
+            'python': sys.version.split()[0],
+            'runs': args.runs,
+            'functions': {
+                name: profile_scenario(name, endpoint_url, args.runs)
+                for name in (args.function or SCENARIOS)
+            }
+        }
+    finally:
+        server.shutdown()
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(document + '\n')
+    else:
+        print(document)
+    for name, result in results['functions'].items():
+        print(
+            f"{name}: import {result['import_ms']['median']} ms, first invocation "
+            f"{result['first_invocation_ms']['median']} ms, warm invocation {result['warm_invocation_ms']['median']} ms",
+            file=sys.stderr
+        )
+
+
+if __name__ == '__main__':
+    main()
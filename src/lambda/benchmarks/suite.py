@@ -0,0 +1,399 @@
+"""
+Load and throughput benchmarks of the fetcher, processor and authorizer handlers against the local
+stand-ins of the harness. Every scenario reports throughput, p50/p95/p99 latency, traced memory
+allocations and the external calls made per operation, and the results are saved as JSON so two
+commits can be compared.
+
+Run from the repository root:
+    python -m src.lambda.benchmarks.suite --output before.json
+    python -m src.lambda.benchmarks.suite --output after.json --compare before.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+
+from ..harness.fakes import ACCOUNT_ID, REGION, FakeAWS
+from ..harness.pipeline import LambdaContext, LocalPipeline, latency_summary
+from ..harness.weather_server import FakeWeatherServer
+
+HOT_CITIES = ('Sydney', 'Melbourne', 'Brisbane', 'Perth', 'Adelaide')
+
+METHOD_ARN = f"arn:aws:execute-api:{REGION}:{ACCOUNT_ID}:api/prod/POST/weather"
+
+# Share of the operations of a scenario run again under tracemalloc, which slows them down a lot
+ALLOCATION_SAMPLE = 200
+
+
+def single_city_request(rng, index, notification_type='email'):
+    request = {'city_name': f"City{index:05d}", 'country_code': 'AU', 'notification_type': notification_type}
+    if notification_type in ('email', 'both'):
+        request['email'] = f"user{index}@example.com"
+    if notification_type in ('sms', 'both'):
+        request['phone_number'] = f"+614{index:08d}"
+    return request
+
+
+def hot_city_request(rng, index):
+    # Nine requests out of ten ask for one of a handful of popular cities
+    request = single_city_request(rng, index)
+    if rng.random() < 0.9:
+        request['city_name'] = rng.choice(HOT_CITIES)
+    return request
+
+
+def both_notifications_request(rng, index):
+    return single_city_request(rng, index, notification_type='both')
+
+
+def batch_request(rng, index, size=25):
+    return {'batch': [hot_city_request(rng, index * size + offset) for offset in range(size)]}
+
+
+PAYLOAD_MIXES = {
+    'single_city': single_city_request,
+    'hot_cities': hot_city_request,
+    'batch': batch_request,
+    'both_notifications': both_notifications_request
+}
+
+
+class Scenario:
+    """
+    One benchmarked workload: prepare() builds the inputs of `operations` calls, numbering requests from
+    `offset`, run_one() performs one of them and returns the number of items it covered (requests,
+    messages or authorizations)
+    """
+
+    def __init__(self, name, function, operations, concurrency):
+        self.name = name
+        self.function = function
+        self.operations = operations
+        self.concurrency = concurrency
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def prepare(self, rng, offset=0):
+        raise NotImplementedError
+
+    def run_one(self, item):
+        raise NotImplementedError
+
+    def external_calls(self):
+        return {}
+
+    def reset_calls(self):
+        pass
+
+
+class PipelineScenario(Scenario):
+
+    def __init__(self, name, function, operations, concurrency, mix, weather_latency):
+        super().__init__(name, function, operations, concurrency)
+        self.mix = mix
+        self.pipeline = LocalPipeline(
+            weather_server=FakeWeatherServer(latency=weather_latency, seed=1),
+            aws=FakeAWS(),
+            batch_size=10
+        )
+
+    def start(self):
+        self.pipeline.start()
+
+    def stop(self):
+        self.pipeline.stop()
+
+    def requests(self, rng, count, offset):
+        generate = PAYLOAD_MIXES[self.mix]
+        return [generate(rng, index) for index in range(offset, offset + count)]
+
+    def external_calls(self):
+        calls = dict(self.pipeline.aws.calls())
+        calls['weather_api.get'] = self.pipeline.weather_server.requests
+        return calls
+
+    def reset_calls(self):
+        self.pipeline.aws.reset_calls()
+        self.pipeline.weather_server.requests = 0
+
+
+class FetcherScenario(PipelineScenario):
+
+    def prepare(self, rng, offset=0):
+        return self.requests(rng, self.operations, offset)
+
+    def run_one(self, request):
+        self.pipeline.submit(request)
+        return len(request['batch']) if 'batch' in request else 1
+
+
+class ProcessorScenario(PipelineScenario):
+    """
+    The queue is filled through the fetcher first, each operation is then one batch of up to 10 records
+    """
+
+    def prepare(self, rng, offset=0):
+        for request in self.requests(rng, self.operations * self.pipeline.batch_size, offset * self.pipeline.batch_size):
+            self.pipeline.submit(request)
+        batches = []
+        while True:
+            records = self.pipeline.aws.sqs.receive_records(self.pipeline.queue_url, max_messages=self.pipeline.batch_size)
+            if not records:
+                return batches
+            batches.append(records)
+
+    def run_one(self, records):
+        self.pipeline.processor.lambda_handler({'Records': records}, LambdaContext('weather-processor'))
+        return len(records)
+
+
+class AuthorizerScenario(Scenario):
+    """
+    Authorizations of REQUEST events from `principals` callers, one in ten with an unknown token. With
+    `jwt` the callers present ES256 JWTs verified against a local JWKS instead of API tokens.
+    """
+
+    def __init__(self, name, operations, concurrency, jwt=False, principals=50):
+        super().__init__(name, 'authorizer', operations, concurrency)
+        self.jwt = jwt
+        self.principals = principals
+        self._patches = []
+
+    def start(self):
+        from ..authorizer import lambda_function as authorizer
+        from ..authorizer.jwt_verifier import JWKSCache, JWTVerifier
+        from ..authorizer.token_store import TokenStore
+
+        self.authorizer = authorizer
+        self.tokens = [f"api-token-{index:04d}" for index in range(self.principals)]
+        verifier = None
+        if self.jwt:
+            self._jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+            self.tokens = self._signed_tokens(self._jwks_file)
+            self._jwks_file.close()
+            verifier = JWTVerifier(JWKSCache(self._jwks_file.name))
+        store = TokenStore({token: f"user{index:04d}" for index, token in enumerate(self.tokens)})
+        self._patches = [
+            mock.patch.object(authorizer, 'token_store', store),
+            mock.patch.object(authorizer, 'jwt_verifier', verifier),
+            mock.patch.object(authorizer, 'quota_limiter', None)
+        ]
+        for patch in self._patches:
+            patch.start()
+        authorizer.policy_cache.clear()
+
+    def stop(self):
+        for patch in reversed(self._patches):
+            patch.stop()
+        self.authorizer.policy_cache.clear()
+        if self.jwt:
+            os.remove(self._jwks_file.name)
+
+    def prepare(self, rng, offset=0):
+        events = []
+        for _ in range(self.operations):
+            token = rng.choice(self.tokens) if rng.random() < 0.9 else f"unknown-{rng.random()}"
+            events.append({
+                'type': 'REQUEST',
+                'methodArn': METHOD_ARN,
+                'headers': {'Authorization': f"Bearer {token}"}
+            })
+        return events
+
+    def run_one(self, event):
+        self.authorizer.lambda_handler(event, LambdaContext('authorizer'))
+        return 1
+
+    def _signed_tokens(self, jwks_file):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+        def b64(data):
+            return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        numbers = key.public_key().public_numbers()
+        json.dump({'keys': [{
+            'kty': 'EC', 'crv': 'P-256', 'kid': 'bench', 'alg': 'ES256', 'use': 'sig',
+            'x': b64(numbers.x.to_bytes(32, 'big')), 'y': b64(numbers.y.to_bytes(32, 'big'))
+        }]}, jwks_file)
+
+        tokens = []
+        for index in range(self.principals):
+            header = b64(json.dumps({'alg': 'ES256', 'kid': 'bench', 'typ': 'JWT'}).encode('utf-8'))
+            payload = b64(json.dumps({'sub': f"user{index:04d}", 'exp': int(time.time()) + 3600}).encode('utf-8'))
+            r, s = decode_dss_signature(key.sign(f"{header}.{payload}".encode('ascii'), ec.ECDSA(hashes.SHA256())))
+            tokens.append(f"{header}.{payload}.{b64(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}")
+        return tokens
+
+
+def build_scenarios(operations, concurrency, weather_latency):
+    scenarios = [
+        FetcherScenario(f"fetcher.{mix}", 'weather_fetcher', operations, concurrency, mix, weather_latency)
+        for mix in PAYLOAD_MIXES
+    ]
+    scenarios.extend(
+        ProcessorScenario(f"processor.{mix}", 'weather_processor', max(1, operations // 10), concurrency, mix, weather_latency)
+        for mix in ('single_city', 'hot_cities', 'both_notifications')
+    )
+    scenarios.append(AuthorizerScenario('authorizer.api_tokens', operations * 10, concurrency))
+    scenarios.append(AuthorizerScenario('authorizer.jwt', operations * 10, concurrency, jwt=True))
+    return scenarios
+
+
+def run_scenario(scenario, seed):
+    """
+    Timed run of the scenario with its concurrency, then a traced sequential run of a sample of it
+    """
+    scenario.start()
+    try:
+        items = scenario.prepare(random.Random(seed))
+        scenario.reset_calls()
+        latencies = []
+
+        def timed(item):
+            started = time.perf_counter()
+            covered = scenario.run_one(item)
+            latencies.append((time.perf_counter() - started) * 1000)
+            return covered
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=scenario.concurrency) as executor:
+            covered = sum(executor.map(timed, items))
+        elapsed = time.perf_counter() - started
+        calls = scenario.external_calls()
+
+        # Allocations are measured on fresh requests, without the concurrency so the numbers are stable
+        sample = scenario.prepare(random.Random(seed + 1), offset=len(items))[:ALLOCATION_SAMPLE]
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        for item in sample:
+            scenario.run_one(item)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        retained = after.compare_to(before, 'filename')
+    finally:
+        scenario.stop()
+
+    return {
+        'function': scenario.function,
+        'operations': len(items),
+        'items': covered,
+        'concurrency': scenario.concurrency,
+        'elapsed_seconds': round(elapsed, 4),
+        'throughput_per_second': round(len(items) / elapsed, 2),
+        'items_per_second': round(covered / elapsed, 2),
+        'latency_ms': latency_summary(latencies),
+        'allocations': {
+            'sampled_operations': len(sample),
+            'peak_kib': round(peak / 1024, 1),
+            'retained_bytes_per_operation': round(sum(stat.size_diff for stat in retained) / max(len(sample), 1), 1),
+            'retained_blocks_per_operation': round(sum(stat.count_diff for stat in retained) / max(len(sample), 1), 2)
+        },
+        'external_calls': calls,
+        'external_calls_per_operation': {name: round(count / len(items), 3) for name, count in calls.items()},
+        'external_calls_per_item': {name: round(count / max(covered, 1), 3) for name, count in calls.items()}
+    }
+
+
+def current_commit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        return completed.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold):
+    """
+    Lines describing the throughput and p95 changes of each scenario, and whether any regressed by more than `threshold`
+    """
+    lines, regressed = [], False
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            lines.append(f"{name}: no baseline")
+            continue
+        throughput_change = result['throughput_per_second'] / before['throughput_per_second'] - 1
+        p95_change = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1 if before['latency_ms']['p95'] else 0.0
+        worse = throughput_change < -threshold or p95_change > threshold
+        regressed = regressed or worse
+        lines.append(
+            f"{name}: throughput {before['throughput_per_second']} -> {result['throughput_per_second']}/s ({throughput_change:+.1%}), "
+            f"p95 {before['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms ({p95_change:+.1%}){'  REGRESSION' if worse else ''}"
+        )
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Lambda handlers against local stand-ins')
+    parser.add_argument('--operations', type=int, default=200, help='fetcher requests per scenario, processor batches are a tenth and authorizations ten times as many')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--weather-latency', type=float, default=0.02, help='seconds added to every Weather API call')
+    parser.add_argument('--scenario', action='append', help='scenario name or prefix to run, e.g. fetcher or authorizer.jwt; all by default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file the JSON results are written to, stdout by default')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative throughput or p95 change reported as a regression')
+    args = parser.parse_args(argv)
+
+    scenarios = [
+        scenario for scenario in build_scenarios(args.operations, args.concurrency, args.weather_latency)
+        if not args.scenario or any(scenario.name == name or scenario.name.startswith(f"{name}.") for name in args.scenario)
+    ]
+    results = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'operations': args.operations,
+            'concurrency': args.concurrency,
+            'weather_latency': args.weather_latency,
+            'seed': args.seed
+        },
+        'scenarios': {}
+    }
+    for scenario in scenarios:
+        results['scenarios'][scenario.name] = run_scenario(scenario, args.seed)
+        result = results['scenarios'][scenario.name]
+        print(
+            f"{scenario.name}: {result['throughput_per_second']}/s, p50 {result['latency_ms']['p50']} ms, "
+            f"p95 {result['latency_ms']['p95']} ms, p99 {result['latency_ms']['p99']} ms",
+            file=sys.stderr
+        )
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(document + '\n')
+    else:
+        print(document)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            lines, regressed = compare(json.load(file), results, args.threshold)
+        for line in lines:
+            print(line, file=sys.stderr)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
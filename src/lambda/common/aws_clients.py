@@ -0,0 +1,114 @@
+import os
+import threading
+
+# Imported at module load so the init phase pays for boto3 and botocore, not the first invocation
+import boto3
+from botocore.config import Config
+
+# boto3.client as imported, any other factory is a unit test patch and is called without the shared config
+_BOTO3_CLIENT = boto3.client
+
+# Clients and the HTTP session are created once per container and reused by warm invocations
+_lock = threading.Lock()
+_clients = {}
+_client_factory = None
+_factory_override = None
+_http_session = None
+
+
+def client_config():
+    """
+    Botocore configuration shared by every client, tunable through environment variables
+    """
+    return Config(
+        max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '20')),
+        connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT', '2')),
+        read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', '5')),
+        retries={
+            'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '3')),
+            'mode': os.environ.get('AWS_RETRY_MODE', 'standard')
+        },
+        tcp_keepalive=True
+    )
+
+
+def client(service_name):
+    """
+    Return the container-wide boto3 client for a service, creating it on first use
+    """
+    global _client_factory
+    factory = _factory_override or boto3.client
+    cached = _clients.get(service_name)
+    if cached is not None and _client_factory is factory:
+        return cached
+
+    with _lock:
+        # Start over when the factory has changed, i.e. boto3.client patched by a unit test or local fakes installed
+        if _client_factory is not factory:
+            _clients.clear()
+            _client_factory = factory
+        if service_name not in _clients:
+            if factory is _BOTO3_CLIENT:
+                _clients[service_name] = factory(service_name, config=client_config())
+            else:
+                _clients[service_name] = factory(service_name)
+        return _clients[service_name]
+
+
+def use_client_factory(factory):
+    """
+    Build clients with `factory(service_name)` instead of boto3, e.g. in-memory stand-ins for local runs.
+    None goes back to boto3.
+    """
+    global _factory_override
+    with _lock:
+        _factory_override = factory
+        _clients.clear()
+
+
+def http_session():
+    """
+    Return the container-wide HTTP session with a keep-alive connection pool: a requests session,
+    or a urllib3 pool when HTTP_CLIENT=urllib3 so requests does not have to be packaged or imported
+    """
+    global _http_session
+    if os.environ.get('HTTP_CLIENT', 'requests') != 'urllib3':
+        import requests
+
+        # requests.get patched by a unit test stands in for the session, like a patched boto3.client
+        if requests.get is not requests.api.get:
+            return requests
+    if _http_session is not None:
+        return _http_session
+
+    with _lock:
+        if _http_session is None and os.environ.get('HTTP_CLIENT', 'requests') == 'urllib3':
+            from .http_client import Urllib3Session
+
+            _http_session = Urllib3Session(pool_size=int(os.environ.get('HTTP_POOL_MAXSIZE', '20')))
+        if _http_session is None:
+            # requests is only packaged with the functions that make HTTP calls
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            pool_size = int(os.environ.get('HTTP_POOL_MAXSIZE', '20'))
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def reset():
+    """
+    Drop every cached client and session so the next call builds new ones
+    """
+    global _client_factory, _factory_override, _http_session
+    with _lock:
+        _clients.clear()
+        _client_factory = None
+        _factory_override = None
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
@@ -0,0 +1,72 @@
+import json
+import time
+from datetime import timedelta
+from urllib.parse import urlencode
+
+
+class HTTPError(Exception):
+    """
+    Raised by Response.raise_for_status() for 4xx and 5xx answers
+    """
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class Response:
+    """
+    The part of a requests response used by the functions, for answers read through urllib3
+    """
+
+    def __init__(self, url, status_code, headers, content, elapsed):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            kind = 'Client' if self.status_code < 500 else 'Server'
+            raise HTTPError(f"{self.status_code} {kind} Error for url: {self.url}", response=self)
+
+
+class Urllib3Session:
+    """
+    Minimal requests.Session replacement on top of a urllib3 pool. urllib3 already ships with
+    botocore in the Lambda runtime, so functions using it do not need to package requests.
+    """
+
+    def __init__(self, pool_size=20):
+        import urllib3
+
+        self._pool = urllib3.PoolManager(maxsize=pool_size, retries=False)
+        self._timeout_class = urllib3.Timeout
+
+    def get(self, url, params=None, timeout=None):
+        full_url = f"{url}{'&' if '?' in url else '?'}{urlencode(params)}" if params else url
+        started = time.perf_counter()
+        response = self._pool.request(
+            'GET',
+            full_url,
+            timeout=self._timeout_class(total=timeout) if timeout is not None else None,
+            preload_content=True
+        )
+        return Response(
+            url,
+            response.status,
+            response.headers,
+            response.data,
+            timedelta(seconds=time.perf_counter() - started)
+        )
+
+    def close(self):
+        self._pool.clear()
@@ -0,0 +1,83 @@
+import hashlib
+import io
+import os
+import threading
+from datetime import datetime, timezone
+
+
+class LocalS3Client:
+    """
+    Filesystem stand-in for the subset of the S3 client used by the functions, for local runs and tests.
+    Objects are stored as <root>/<bucket>/<key>.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        body = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(body)
+        os.replace(temporary_path, path)
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise KeyError(f"No such key {Key} in bucket {Bucket}")
+        with open(path, 'rb') as file:
+            body = file.read()
+        return {
+            'Body': io.BytesIO(body),
+            'ContentLength': len(body),
+            'ETag': f'"{hashlib.md5(body).hexdigest()}"'
+        }
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, '/')
+                if not key.startswith(Prefix):
+                    continue
+                stat = os.stat(path)
+                contents.append({
+                    'Key': key,
+                    'Size': stat.st_size,
+                    'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+                })
+        contents.sort(key=lambda item: item['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise ValueError(f"Unsupported paginator {operation_name}")
+        return _ListObjectsPaginator(self)
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.normpath(os.path.join(self.root, bucket)) + os.sep):
+            raise ValueError(f"Invalid key {key}")
+        return path
+
+
+class _ListObjectsPaginator:
+
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, **kwargs):
+        yield self._client.list_objects_v2(**kwargs)
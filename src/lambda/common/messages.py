@@ -0,0 +1,152 @@
+import base64
+import gzip
+import hashlib
+import json
+import zlib
+
+from . import aws_clients
+from .cache import LRUCache
+
+# Version of the compact envelope sent from the weather fetcher to the weather processor.
+# Messages without a version are the original format: the full fetcher response as JSON.
+MESSAGE_VERSION = 2
+
+CONTACT_FIELDS = ('notification_type', 'email', 'phone_number')
+
+# Claim-check objects are content addressed and never change, so they can be cached freely
+_stored_payloads = LRUCache(max_entries=1024, ttl_seconds=3600)
+_loaded_payloads = LRUCache(max_entries=64, ttl_seconds=300)
+
+
+def message_key(message):
+    """
+    Content hash of a fetcher message: the same observation for the same recipients gets the same key,
+    so a message sent twice is recognised by the processor whatever its SQS message id
+    """
+    content = {field: message.get(field) or '' for field in CONTACT_FIELDS}
+    content['city_name'] = message['city_name']
+    content['country_code'] = message.get('country_code') or ''
+    content['data'] = message['data']
+    # Scheduled messages notify a list of recipients, left out otherwise so existing keys do not change
+    if message.get('recipients'):
+        content['recipients'] = message['recipients']
+    body = json.dumps(content, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def encode_message(message, compression='zlib', compression_threshold=2048, data_ref=None):
+    """
+    Serialize a fetcher message as a compact envelope. Bodies larger than compression_threshold
+    bytes are compressed and base64 encoded. With a data_ref the weather data is left out and
+    the processor reads it from S3 instead.
+    """
+    envelope = {'v': MESSAGE_VERSION, 'city_name': message['city_name']}
+    if message.get('message_key'):
+        envelope['key'] = message['message_key']
+    if message.get('country_code'):
+        envelope['country_code'] = message['country_code']
+    for field in CONTACT_FIELDS:
+        if message.get(field):
+            envelope[field] = message[field]
+    if message.get('recipients'):
+        envelope['recipients'] = message['recipients']
+    if message.get('store_observation') is False:
+        envelope['store_observation'] = False
+    if data_ref is not None:
+        envelope['data_ref'] = data_ref
+    else:
+        envelope['data'] = message['data']
+
+    body = json.dumps(envelope, separators=(',', ':'))
+    if compression and compression != 'none' and len(body) > compression_threshold:
+        payload = _compress(body.encode('utf-8'), compression)
+        body = json.dumps({
+            'v': MESSAGE_VERSION,
+            'encoding': compression,
+            'payload': base64.b64encode(payload).decode('ascii')
+        }, separators=(',', ':'))
+    return body
+
+
+def decode_message(body, load_data=None):
+    """
+    Parse a message body in either the original or the compact format into the original shape.
+    load_data(data_ref) is called to resolve claim-check messages.
+    """
+    message = json.loads(body)
+    if 'v' not in message:
+        return message
+
+    if 'encoding' in message:
+        payload = base64.b64decode(message['payload'])
+        message = json.loads(_decompress(payload, message['encoding']))
+    if message['v'] > MESSAGE_VERSION:
+        raise ValueError(f"Unsupported message version {message['v']}")
+
+    decoded = {field: message.get(field, '') for field in CONTACT_FIELDS}
+    decoded['city_name'] = message['city_name']
+    decoded['country_code'] = message.get('country_code', '')
+    if message.get('key'):
+        decoded['message_key'] = message['key']
+    if message.get('recipients'):
+        decoded['recipients'] = message['recipients']
+    if 'store_observation' in message:
+        decoded['store_observation'] = message['store_observation']
+    if 'data_ref' in message:
+        if load_data is None:
+            raise ValueError('Claim-check message received without a way to load its data')
+        decoded['data'] = load_data(message['data_ref'])
+    else:
+        decoded['data'] = message['data']
+    return decoded
+
+
+def store_payload(bucket, data, prefix='weather-raw/'):
+    """
+    Write weather data to S3 once, keyed by its content hash, and return the reference for the message
+    """
+    body = json.dumps(data, separators=(',', ':'), sort_keys=True)
+    key = f"{prefix}{hashlib.sha256(body.encode('utf-8')).hexdigest()}.json"
+    if _stored_payloads.get(key) is None:
+        aws_clients.client('s3').put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType='application/json'
+        )
+        _stored_payloads.put(key, True)
+    return {'bucket': bucket, 'key': key}
+
+
+def load_payload(data_ref):
+    """
+    Read the weather data of a claim-check message, messages of a batch often share the same object
+    """
+    cache_key = f"{data_ref['bucket']}/{data_ref['key']}"
+    data = _loaded_payloads.get(cache_key)
+    if data is None:
+        response = aws_clients.client('s3').get_object(Bucket=data_ref['bucket'], Key=data_ref['key'])
+        data = json.loads(response['Body'].read())
+        _loaded_payloads.put(cache_key, data)
+    return data
+
+
+def clear_payload_caches():
+    _stored_payloads.clear()
+    _loaded_payloads.clear()
+
+
+def _compress(payload, encoding):
+    if encoding == 'zlib':
+        return zlib.compress(payload)
+    if encoding == 'gzip':
+        return gzip.compress(payload)
+    raise ValueError(f"Unsupported message encoding {encoding}")
+
+
+def _decompress(payload, encoding):
+    if encoding == 'zlib':
+        return zlib.decompress(payload)
+    if encoding == 'gzip':
+        return gzip.decompress(payload)
+    raise ValueError(f"Unsupported message encoding {encoding}")
@@ -0,0 +1,217 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_NAMESPACE = 'WeatherNotification'
+
+# CloudWatch accepts at most 100 values for one metric of a record
+MAX_VALUES = 100
+
+MILLISECONDS = 'Milliseconds'
+COUNT = 'Count'
+BYTES = 'Bytes'
+
+_lock = threading.Lock()
+_invocation = contextvars.ContextVar('metrics_invocation', default=None)
+_current = None
+_sink = None
+
+
+class InvocationMetrics:
+    """
+    Metrics and properties of one invocation, written as a single CloudWatch Embedded Metric Format
+    record when the invocation ends. Stages timed several times keep every value, up to MAX_VALUES.
+    """
+
+    def __init__(self, function_name, namespace=DEFAULT_NAMESPACE, clock=time.time):
+        self.function_name = function_name
+        self.namespace = namespace
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._values = {}
+        self._units = {}
+        self._properties = {}
+
+    def record(self, name, value, unit=MILLISECONDS):
+        with self._lock:
+            values = self._values.setdefault(name, [])
+            if len(values) < MAX_VALUES:
+                values.append(value)
+            self._units[name] = unit
+
+    def count(self, name, value=1):
+        with self._lock:
+            values = self._values.setdefault(name, [0])
+            values[0] += value
+            self._units[name] = COUNT
+
+    def set_property(self, name, value):
+        with self._lock:
+            self._properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, round((time.perf_counter() - started) * 1000, 3))
+
+    def values(self, name):
+        with self._lock:
+            return list(self._values.get(name, ()))
+
+    def to_record(self):
+        """
+        The EMF document of the invocation: metric values at the top level, described under _aws
+        """
+        self.record('Duration', round((time.perf_counter() - self._started) * 1000, 3))
+        with self._lock:
+            record = dict(self._properties)
+            record['FunctionName'] = self.function_name
+            record['_aws'] = {
+                'Timestamp': int(self._clock() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': self._units[name]} for name in self._values]
+                }]
+            }
+            for name, values in self._values.items():
+                record[name] = values[0] if len(values) == 1 else list(values)
+        return record
+
+
+class _NoMetrics:
+    """
+    Stand-in used outside an instrumented invocation or when metrics are disabled, every call is a no-op
+    """
+
+    def record(self, name, value, unit=MILLISECONDS):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def set_property(self, name, value):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    def values(self, name):
+        return []
+
+
+_NO_METRICS = _NoMetrics()
+
+
+def enabled():
+    return os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+
+def current():
+    """
+    Metrics of the invocation running on this thread. Worker threads started by the invocation fall back
+    to the last invocation begun, which is the only one in a Lambda container.
+    """
+    return _invocation.get() or _current or _NO_METRICS
+
+
+def begin(function_name):
+    global _current
+    metrics = InvocationMetrics(function_name, namespace=os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)) \
+        if enabled() else None
+    _invocation.set(metrics)
+    with _lock:
+        _current = metrics
+    return metrics or _NO_METRICS
+
+
+def end():
+    """
+    Write the record of the invocation running on this thread, returns it
+    """
+    global _current
+    metrics = _invocation.get()
+    _invocation.set(None)
+    if metrics is None:
+        return None
+    with _lock:
+        if _current is metrics:
+            _current = None
+    record = metrics.to_record()
+    emit(record)
+    return record
+
+
+def emit(record):
+    if _sink is not None:
+        _sink(record)
+        return
+    # EMF records have to be plain JSON lines, so they bypass the log formatter
+    sys.stdout.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+    sys.stdout.flush()
+
+
+def set_sink(sink):
+    """
+    Hand records to `sink(record)` instead of writing them to stdout, None goes back to stdout
+    """
+    global _sink
+    _sink = sink
+
+
+def bound(fn):
+    """
+    Wrap fn so that a worker thread runs it in the context of the calling thread: it records into the
+    same invocation and continues the same trace
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, each call gets its own copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def instrumented(default_function_name):
+    """
+    Decorator of a Lambda handler: starts the metrics of each invocation and writes them when it ends
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            function_name = getattr(context, 'function_name', None) \
+                or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', default_function_name)
+            begin(function_name)
+            try:
+                return handler(event, context)
+            finally:
+                end()
+        return wrapper
+    return decorator
+
+
+def timer(name):
+    return current().timer(name)
+
+
+def record(name, value, unit=MILLISECONDS):
+    current().record(name, value, unit)
+
+
+def count(name, value=1):
+    current().count(name, value)
+
+
+def set_property(name, value):
+    current().set_property(name, value)
@@ -0,0 +1,33 @@
+import gzip
+import json
+import re
+
+
+def partition_value(value):
+    """
+    Lowercase a city or country name into a value that is safe in an S3 key
+    """
+    return re.sub(r'[^a-z0-9]+', '-', str(value).strip().lower()).strip('-') or 'unknown'
+
+
+def normalize_city_key(city_name, country_code):
+    """
+    Key of a city, so that "london,uk" and " London , UK" are the same city
+    """
+    return f"{' '.join(city_name.split()).lower()},{(country_code or '').strip().lower()}"
+
+
+def read_observations(body, content_encoding=None, key=''):
+    """
+    Parse a stored object back into observations, for both the NDJSON objects and the original
+    one-JSON-document-per-message objects
+    """
+    if content_encoding == 'gzip' or key.endswith('.gz'):
+        body = gzip.decompress(body)
+    elif content_encoding == 'zstd' or key.endswith('.zst'):
+        import zstandard
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if key.endswith('.json'):
+        return [json.loads(text)]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from . import aws_clients
+
+
+class KeyValueStore:
+    """
+    Persistent key/value store shared between containers. Values must be JSON serializable.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, value, ttl_seconds=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryStore(KeyValueStore):
+    """
+    Process-local stand-in for a shared store, used by tests and local runs
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self._clock():
+                del self._items[key]
+                return None
+            return json.loads(value)
+
+    def put(self, key, value, ttl_seconds=None):
+        expires_at = self._clock() + ttl_seconds if ttl_seconds is not None else None
+        # Values are kept serialized so callers never share mutable state with the store
+        with self._lock:
+            self._items[key] = (json.dumps(value), expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class FileStore(KeyValueStore):
+    """
+    Local stand-in for a shared store that keeps one JSON file per key in a directory
+    """
+
+    def __init__(self, directory, clock=time.time):
+        self.directory = directory
+        self._clock = clock
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as item_file:
+                item = json.load(item_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if item['expires_at'] is not None and item['expires_at'] <= self._clock():
+            self.delete(key)
+            return None
+        return item['value']
+
+    def put(self, key, value, ttl_seconds=None):
+        expires_at = self._clock() + ttl_seconds if ttl_seconds is not None else None
+        path = self._path(key)
+        # Write then rename so concurrent readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as item_file:
+            json.dump({'key': key, 'value': value, 'expires_at': expires_at}, item_file)
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBStore(KeyValueStore):
+    """
+    Shared store backed by a DynamoDB table with a 'key' partition key and 'expires_at' as TTL attribute
+    """
+
+    def __init__(self, table_name, clock=time.time):
+        self.table_name = table_name
+        self._clock = clock
+
+    def get(self, key):
+        response = aws_clients.client('dynamodb').get_item(
+            TableName=self.table_name,
+            Key={'key': {'S': key}}
+        )
+        item = response.get('Item')
+        if item is None:
+            return None
+        # DynamoDB deletes expired items lazily, so the expiry is checked on read as well
+        if 'expires_at' in item and int(item['expires_at']['N']) <= self._clock():
+            return None
+        return json.loads(item['value']['S'])
+
+    def put(self, key, value, ttl_seconds=None):
+        item = {
+            'key': {'S': key},
+            'value': {'S': json.dumps(value)}
+        }
+        if ttl_seconds is not None:
+            item['expires_at'] = {'N': str(int(self._clock() + ttl_seconds))}
+        aws_clients.client('dynamodb').put_item(TableName=self.table_name, Item=item)
+
+    def delete(self, key):
+        aws_clients.client('dynamodb').delete_item(
+            TableName=self.table_name,
+            Key={'key': {'S': key}}
+        )
+
+
+def store_from_url(url):
+    """
+    Build a store from a URL such as memory://, file:///tmp/cache or dynamodb://table-name.
+    Returns None when no URL is configured.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryStore()
+    if parsed.scheme == 'file':
+        return FileStore(parsed.netloc + parsed.path)
+    if parsed.scheme == 'dynamodb':
+        return DynamoDBStore(parsed.netloc)
+    raise ValueError(f"Unsupported store URL: {url}")
@@ -0,0 +1,265 @@
+"""
+Trace context of a weather request from the API call to its notifications. The fetcher reads the trace
+id of the request (W3C traceparent or X-Ray header) or starts a new one and sends it with each SQS message,
+the processor continues the trace for the S3 write and the SNS publish. Finished spans are appended as
+JSON lines to TRACE_EXPORT_FILE, nothing is sent over the network.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Message attributes carrying the trace to the processor and on to SNS
+TRACEPARENT_ATTRIBUTE = 'traceparent'
+REQUEST_TIME_ATTRIBUTE = 'request_time'
+
+TRACEPARENT_PATTERN = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+XRAY_ROOT_PATTERN = re.compile(r'Root=1-([0-9a-f]{8})-([0-9a-f]{24})')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_exporter = None
+_file_exporters = {}
+_lock = threading.Lock()
+
+
+class TraceContext(namedtuple('TraceContext', ['trace_id', 'span_id', 'request_time'])):
+    """
+    Position in a trace: the trace, the span to continue from and when the request was made, in epoch milliseconds
+    """
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id or '0' * 16}-01"
+
+
+class Span:
+    """
+    One timed operation of a trace, exported when it ends
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, request_time=None, attributes=None, links=()):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.request_time = request_time if request_time is not None else int(self.start * 1000)
+        self.end = None
+        self.status = 'ok'
+        self.attributes = dict(attributes or {})
+        self.links = [{'trace_id': link.trace_id, 'span_id': link.span_id} for link in links]
+
+    @property
+    def context(self):
+        return TraceContext(self.trace_id, self.span_id, self.request_time)
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round((self.end - self.start) * 1000, 3) if self.end is not None else None,
+            'request_time': self.request_time,
+            'status': self.status,
+            'attributes': self.attributes,
+            'links': self.links
+        }
+
+
+class FileExporter:
+    """
+    Local collector: appends every finished span to a file as one JSON line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as output:
+                output.write(line)
+
+
+def read_spans(path):
+    """
+    Spans written by a FileExporter
+    """
+    with open(path, encoding='utf-8') as spans:
+        return [json.loads(line) for line in spans if line.strip()]
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def parse_traceparent(value):
+    """
+    TraceContext of a W3C traceparent header value, None when it is missing or malformed
+    """
+    match = TRACEPARENT_PATTERN.match((value or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32:
+        return None
+    return TraceContext(match.group(1), match.group(2), None)
+
+
+def parse_xray_header(value):
+    """
+    TraceContext of an X-Amzn-Trace-Id header, the X-Ray root id is 32 hex digits once its dashes are removed
+    """
+    match = XRAY_ROOT_PATTERN.search(value or '')
+    if match is None:
+        return None
+    return TraceContext(match.group(1) + match.group(2), None, None)
+
+
+def context_from_event(event):
+    """
+    Trace context of an API request: traceparent or X-Amzn-Trace-Id header, else the X-Ray trace of
+    the function. The request time comes from API Gateway when it is in the event.
+    """
+    headers = {str(name).lower(): value for name, value in ((event.get('headers') or {}).items())}
+    context = parse_traceparent(headers.get('traceparent')) \
+        or parse_xray_header(headers.get('x-amzn-trace-id')) \
+        or parse_xray_header(os.environ.get('_X_AMZN_TRACE_ID'))
+    request_time = (event.get('requestContext') or {}).get('requestTimeEpoch')
+    if context is None:
+        return TraceContext(new_trace_id(), None, request_time) if request_time is not None else None
+    return context._replace(request_time=request_time)
+
+
+def context_from_message_attributes(attributes):
+    """
+    Trace context sent with an SQS message, from the attributes of a Lambda record or of ReceiveMessage
+    """
+    def value(name):
+        attribute = (attributes or {}).get(name) or {}
+        return attribute.get('stringValue') or attribute.get('StringValue')
+
+    context = parse_traceparent(value(TRACEPARENT_ATTRIBUTE))
+    if context is None:
+        return None
+    request_time = value(REQUEST_TIME_ATTRIBUTE)
+    return context._replace(request_time=int(request_time) if request_time else None)
+
+
+def message_attributes(context=None):
+    """
+    SQS or SNS message attributes carrying the trace context, the current one by default
+    """
+    context = context or current_context()
+    if context is None:
+        return {}
+    attributes = {TRACEPARENT_ATTRIBUTE: {'DataType': 'String', 'StringValue': context.traceparent()}}
+    if context.request_time is not None:
+        attributes[REQUEST_TIME_ATTRIBUTE] = {'DataType': 'Number', 'StringValue': str(int(context.request_time))}
+    return attributes
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_context():
+    span = _current_span.get()
+    return span.context if span is not None else None
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def span(name, parent=None, links=(), **attributes):
+    """
+    Time a block as a span of the parent context, of the current span by default, or of a new trace
+    """
+    parent = parent or current_context()
+    if parent is None:
+        started = Span(name, new_trace_id(), attributes=attributes, links=links)
+    else:
+        started = Span(name, parent.trace_id, parent.span_id, parent.request_time, attributes, links)
+    token = _current_span.set(started)
+    try:
+        yield started
+    except Exception as e:
+        started.status = 'error'
+        started.set_attribute('error', str(e))
+        raise
+    finally:
+        started.end = time.time()
+        _current_span.reset(token)
+        export(started)
+
+
+def export(finished):
+    exporter = _exporter or _environment_exporter()
+    if exporter is not None:
+        exporter(finished.to_dict())
+
+
+def set_exporter(exporter):
+    """
+    Hand finished spans to `exporter(span)` instead of TRACE_EXPORT_FILE, None goes back to the file
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def _environment_exporter():
+    path = os.environ.get('TRACE_EXPORT_FILE')
+    if not path:
+        return None
+    with _lock:
+        exporter = _file_exporters.get(path)
+        if exporter is None:
+            exporter = _file_exporters[path] = FileExporter(path)
+    return exporter
+
+
+class TraceLogFilter(logging.Filter):
+    """
+    Prefixes the log records written inside a span with its trace id
+    """
+
+    def filter(self, record):
+        trace_id = current_trace_id()
+        record.trace_id = trace_id
+        if trace_id is not None and not getattr(record, 'trace_prefixed', False):
+            record.msg = f"[trace_id={trace_id}] {record.msg}"
+            record.trace_prefixed = True
+        return True
+
+
+def traced(name, context_from=None):
+    """
+    Decorator of a Lambda handler: runs each invocation in a span, continuing the trace that
+    context_from(event) finds or starting a new one
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            parent = context_from(event) if context_from is not None else None
+            with span(name, parent=parent):
+                return handler(event, context)
+        return wrapper
+    return decorator
+
+
+def install_log_filter(logger):
+    if not any(isinstance(log_filter, TraceLogFilter) for log_filter in logger.filters):
+        logger.addFilter(TraceLogFilter())
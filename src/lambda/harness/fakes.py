@@ -0,0 +1,438 @@
+import collections
+import hashlib
+import io
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+ACCOUNT_ID = '123456789012'
+REGION = 'ap-southeast-2'
+
+# Largest message body accepted by SQS
+SQS_MAX_MESSAGE_BYTES = 262144
+
+
+class FakeServiceError(Exception):
+    """
+    Error answered by a fake service, with the error code the real service would return
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.code = code
+
+
+class FakeService:
+    """
+    Counts the calls made to a fake service and optionally delays each of them by `latency` seconds
+    """
+
+    service_name = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.RLock()
+        self.calls = collections.Counter()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def md5_of(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class FakeSQS(FakeService):
+    """
+    In-memory SQS queues. Received messages stay in flight until they are deleted or released, and a
+    message received more than `max_receive_count` times moves to the dead-letter queue of its queue.
+    `on_send(message_id)` is called in the sending thread for every queued message.
+    """
+
+    service_name = 'sqs'
+
+    def __init__(self, latency=0.0, on_send=None, clock=time.time):
+        super().__init__(latency)
+        self.on_send = on_send
+        self._clock = clock
+        self._available = threading.Condition(self._lock)
+        self._queues = {}
+        self._in_flight = {}
+        self._redrive = {}
+        self._receipts = itertools.count(1)
+
+    def create_queue(self, QueueName, **kwargs):
+        self._call('create_queue')
+        queue_url = f"https://sqs.{REGION}.amazonaws.com/{ACCOUNT_ID}/{QueueName}"
+        with self._lock:
+            self._queues.setdefault(queue_url, collections.deque())
+        return {'QueueUrl': queue_url}
+
+    def set_redrive_policy(self, queue_url, dead_letter_queue_url, max_receive_count):
+        with self._lock:
+            self._redrive[queue_url] = (dead_letter_queue_url, max_receive_count)
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        self._call('send_message')
+        return self._enqueue(QueueUrl, MessageBody, MessageAttributes)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._call('send_message_batch')
+        if len(Entries) > 10:
+            raise FakeServiceError('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'Maximum number of entries per request are 10')
+        successful, failed = [], []
+        for entry in Entries:
+            try:
+                response = self._enqueue(QueueUrl, entry['MessageBody'], entry.get('MessageAttributes'))
+                successful.append(dict(response, Id=entry['Id']))
+            except FakeServiceError as e:
+                failed.append({'Id': entry['Id'], 'SenderFault': True, 'Code': e.code, 'Message': str(e)})
+        return {'Successful': successful, 'Failed': failed}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        self._call('receive_message')
+        messages = self._take(QueueUrl, MaxNumberOfMessages)
+        return {'Messages': [
+            {
+                'MessageId': message['MessageId'],
+                'ReceiptHandle': message['ReceiptHandle'],
+                'Body': message['Body'],
+                'MD5OfBody': md5_of(message['Body']),
+                'Attributes': self._attributes(message),
+                'MessageAttributes': message['MessageAttributes']
+            }
+            for message in messages
+        ]} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._call('delete_message')
+        self.acknowledge(QueueUrl, ReceiptHandle)
+        return {}
+
+    def receive_records(self, queue_url, max_messages=10, batching_window=0.0, wait_seconds=0.0):
+        """
+        Receive a batch the way the Lambda event source mapping does: long poll up to `wait_seconds` for
+        a first message, then wait up to `batching_window` seconds for a full batch. The messages are
+        returned as the Records of an SQS event.
+        """
+        queue = self._queues[queue_url]
+        with self._available:
+            self._wait(lambda: len(queue) > 0, wait_seconds)
+            if queue:
+                self._wait(lambda: len(queue) >= max_messages, batching_window)
+            messages = self._take(queue_url, max_messages)
+        return [self._record(queue_url, message) for message in messages]
+
+    def acknowledge(self, queue_url, receipt_handle):
+        """
+        Delete a processed message on behalf of the event source mapping, not counted as a function call
+        """
+        with self._lock:
+            self._in_flight.pop(receipt_handle, None)
+
+    def release(self, queue_url, receipt_handle):
+        """
+        Make an in-flight message visible again, as when its visibility timeout expires
+        """
+        with self._available:
+            message = self._in_flight.pop(receipt_handle, None)
+            if message is not None:
+                self._queues[queue_url].appendleft(message)
+                self._available.notify_all()
+
+    def messages(self, queue_url):
+        """
+        Bodies of the messages waiting in a queue, in order
+        """
+        with self._lock:
+            return [message['Body'] for message in self._queues.get(queue_url, ())]
+
+    def depth(self, queue_url):
+        with self._lock:
+            return len(self._queues.get(queue_url, ()))
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def _wait(self, predicate, timeout):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._available.wait(remaining)
+
+    def _enqueue(self, queue_url, body, attributes):
+        if len(body.encode('utf-8')) > SQS_MAX_MESSAGE_BYTES:
+            raise FakeServiceError('InvalidParameterValue', f"Message must be shorter than {SQS_MAX_MESSAGE_BYTES} bytes")
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'Body': body,
+            'MessageAttributes': attributes or {},
+            'SentTimestamp': int(self._clock() * 1000),
+            'ReceiveCount': 0
+        }
+        if queue_url not in self._queues:
+            raise FakeServiceError('AWS.SimpleQueueService.NonExistentQueue', f"Queue {queue_url} does not exist")
+        # Before the message is visible, so a concurrent consumer never sees an unannounced message
+        if self.on_send is not None:
+            self.on_send(message['MessageId'])
+        with self._available:
+            self._queues[queue_url].append(message)
+            self._available.notify_all()
+        return {'MessageId': message['MessageId'], 'MD5OfMessageBody': md5_of(body)}
+
+    def _take(self, queue_url, max_messages):
+        taken = []
+        with self._lock:
+            queue = self._queues[queue_url]
+            dead_letter_queue_url, max_receive_count = self._redrive.get(queue_url, (None, None))
+            while queue and len(taken) < max_messages:
+                message = queue.popleft()
+                if max_receive_count is not None and message['ReceiveCount'] >= max_receive_count:
+                    self._queues[dead_letter_queue_url].append(message)
+                    continue
+                message['ReceiveCount'] += 1
+                message.setdefault('FirstReceiveTimestamp', int(self._clock() * 1000))
+                message['ReceiptHandle'] = f"receipt-{next(self._receipts)}"
+                self._in_flight[message['ReceiptHandle']] = message
+                taken.append(message)
+        return taken
+
+    def _attributes(self, message):
+        return {
+            'ApproximateReceiveCount': str(message['ReceiveCount']),
+            'SentTimestamp': str(message['SentTimestamp']),
+            'SenderId': ACCOUNT_ID,
+            'ApproximateFirstReceiveTimestamp': str(message['FirstReceiveTimestamp'])
+        }
+
+    def _record(self, queue_url, message):
+        # Message attributes use the lower-case keys of Lambda events rather than those of ReceiveMessage
+        return {
+            'messageId': message['MessageId'],
+            'receiptHandle': message['ReceiptHandle'],
+            'body': message['Body'],
+            'attributes': self._attributes(message),
+            'messageAttributes': {
+                name: {
+                    'stringValue': value.get('StringValue'),
+                    'binaryValue': value.get('BinaryValue'),
+                    'stringListValues': [],
+                    'binaryListValues': [],
+                    'dataType': value['DataType']
+                }
+                for name, value in message['MessageAttributes'].items()
+            },
+            'md5OfBody': md5_of(message['Body']),
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': f"arn:aws:sqs:{REGION}:{ACCOUNT_ID}:{queue_url.rsplit('/', 1)[-1]}",
+            'awsRegion': REGION
+        }
+
+
+class FakeS3(FakeService):
+    """
+    In-memory buckets for the subset of the S3 client used by the functions
+    """
+
+    service_name = 's3'
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call('put_object')
+        body = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        stored = {
+            'Body': body,
+            'ContentType': kwargs.get('ContentType'),
+            'ContentEncoding': kwargs.get('ContentEncoding'),
+            'Metadata': dict(kwargs.get('Metadata') or {}),
+            'LastModified': datetime.now(timezone.utc)
+        }
+        with self._lock:
+            self._objects[(Bucket, Key)] = stored
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call('get_object')
+        with self._lock:
+            stored = self._objects.get((Bucket, Key))
+        if stored is None:
+            raise FakeServiceError('NoSuchKey', f"No such key {Key} in bucket {Bucket}")
+        response = {
+            'Body': io.BytesIO(stored['Body']),
+            'ContentLength': len(stored['Body']),
+            'ContentType': stored['ContentType'],
+            'Metadata': stored['Metadata'],
+            'LastModified': stored['LastModified'],
+            'ETag': f'"{hashlib.md5(stored["Body"]).hexdigest()}"'
+        }
+        if stored['ContentEncoding'] is not None:
+            response['ContentEncoding'] = stored['ContentEncoding']
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        self._call('list_objects_v2')
+        with self._lock:
+            contents = [
+                {'Key': key, 'Size': len(stored['Body']), 'LastModified': stored['LastModified']}
+                for (bucket, key), stored in self._objects.items()
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        contents.sort(key=lambda item: item['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise ValueError(f"Unsupported paginator {operation_name}")
+        return _SinglePagePaginator(self.list_objects_v2)
+
+    def keys(self, bucket, prefix=''):
+        with self._lock:
+            return sorted(key for (name, key) in self._objects if name == bucket and key.startswith(prefix))
+
+
+class FakeSNS(FakeService):
+    """
+    In-memory SNS topics recording every published message. Subscriptions are confirmed straight away
+    unless `auto_confirm` is False, in which case they stay pending as for a new email address.
+    """
+
+    service_name = 'sns'
+
+    def __init__(self, latency=0.0, auto_confirm=True):
+        super().__init__(latency)
+        self.auto_confirm = auto_confirm
+        self._subscriptions = collections.defaultdict(dict)
+        self.published = []
+
+    def create_topic(self, Name, **kwargs):
+        self._call('create_topic')
+        return {'TopicArn': f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:{Name}"}
+
+    def subscribe(self, TopicArn, Protocol, Endpoint, **kwargs):
+        self._call('subscribe')
+        with self._lock:
+            subscription_arn = self._subscriptions[TopicArn].setdefault(
+                (Protocol, Endpoint),
+                f"{TopicArn}:{uuid.uuid4()}" if self.auto_confirm else 'PendingConfirmation'
+            )
+        return {'SubscriptionArn': subscription_arn if self.auto_confirm else 'pending confirmation'}
+
+    def list_subscriptions_by_topic(self, TopicArn, **kwargs):
+        self._call('list_subscriptions_by_topic')
+        with self._lock:
+            subscriptions = [
+                {
+                    'SubscriptionArn': subscription_arn,
+                    'Owner': ACCOUNT_ID,
+                    'Protocol': protocol,
+                    'Endpoint': endpoint,
+                    'TopicArn': TopicArn
+                }
+                for (protocol, endpoint), subscription_arn in self._subscriptions[TopicArn].items()
+            ]
+        return {'Subscriptions': subscriptions}
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_subscriptions_by_topic':
+            raise ValueError(f"Unsupported paginator {operation_name}")
+        return _SinglePagePaginator(self.list_subscriptions_by_topic)
+
+    def publish(self, TopicArn=None, Message=None, **kwargs):
+        self._call('publish')
+        return {'MessageId': self._record(dict(kwargs, TopicArn=TopicArn, Message=Message))}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self._call('publish_batch')
+        if len(PublishBatchRequestEntries) > 10:
+            raise FakeServiceError('TooManyEntriesInBatchRequest', 'The batch request contains more entries than permissible')
+        return {
+            'Successful': [
+                {'Id': entry['Id'], 'MessageId': self._record(dict(entry, TopicArn=TopicArn))}
+                for entry in PublishBatchRequestEntries
+            ],
+            'Failed': []
+        }
+
+    def _record(self, message):
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self.published.append(dict(message, MessageId=message_id))
+        return message_id
+
+
+class FakeSecretsManager(FakeService):
+    """
+    In-memory secrets, given as {secret id: secret string}
+    """
+
+    service_name = 'secretsmanager'
+
+    def __init__(self, secrets=None, latency=0.0):
+        super().__init__(latency)
+        self.secrets = dict(secrets or {})
+
+    def get_secret_value(self, SecretId, **kwargs):
+        self._call('get_secret_value')
+        if SecretId not in self.secrets:
+            raise FakeServiceError('ResourceNotFoundException', f"Secrets Manager can't find the specified secret {SecretId}")
+        return {'Name': SecretId, 'SecretString': self.secrets[SecretId]}
+
+
+class _SinglePagePaginator:
+
+    def __init__(self, operation):
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        yield self._operation(**kwargs)
+
+
+class FakeAWS:
+    """
+    One fake of each AWS service used by the functions, handed out by client(service_name) in place of
+    boto3.client
+    """
+
+    def __init__(self, latency=0.0, secrets=None, on_send=None):
+        self.sqs = FakeSQS(latency=latency, on_send=on_send)
+        self.s3 = FakeS3(latency=latency)
+        self.sns = FakeSNS(latency=latency)
+        self.secretsmanager = FakeSecretsManager(secrets, latency=latency)
+        self._services = {service.service_name: service for service in (self.sqs, self.s3, self.sns, self.secretsmanager)}
+
+    def client(self, service_name):
+        if service_name not in self._services:
+            raise ValueError(f"No local stand-in for the {service_name} service")
+        return self._services[service_name]
+
+    def reset_calls(self):
+        for service in self._services.values():
+            with service._lock:
+                service.calls.clear()
+
+    def calls(self):
+        """
+        Number of calls made to each service operation, e.g. {'sqs.send_message': 3}
+        """
+        return {
+            f"{name}.{operation}": count
+            for name, service in sorted(self._services.items())
+            for operation, count in sorted(service.calls.items())
+        }
@@ -0,0 +1,509 @@
+"""
+Local end-to-end run of the weather pipeline: requests go through weather_fetcher.lambda_handler,
+the messages it queues are delivered in batches to weather_processor.lambda_handler the way the SQS
+event source mapping does, and every AWS call is answered by in-memory stand-ins. The Weather API is
+a local HTTP server with configurable latency and error rates.
+
+Run from the repository root:
+    python -m src.lambda.harness.pipeline --requests 200 --cities 20 --concurrency 8
+"""
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ..common import aws_clients, metrics, tracing
+from ..common.messages import clear_payload_caches, decode_message
+from ..common.observations import read_observations
+from ..weather_fetcher.subscription_store import MemorySubscriptionStore, Subscription
+from ..weather_processor.rule_store import MemoryRuleStore
+from ..weather_processor.rules import RuleIndex
+from .fakes import ACCOUNT_ID, REGION, FakeAWS
+from .weather_server import FakeWeatherServer
+
+BUCKET_NAME = 'weather-bucket'
+SECRET_NAME = 'weather-api-key'
+
+# Module-level settings of the handlers (rate limits, caches) are read when they are first imported,
+# these only apply when no pipeline ran in the process before
+DEFAULT_ENVIRONMENT = {
+    'WEATHER_API_RATE_LIMIT': '10000',
+    'WEATHER_API_BURST': '10000',
+    'SCHEDULE_MAX_CITIES': '100000',
+    'LOG_LEVEL': 'WARNING'
+}
+
+
+class LambdaContext:
+    """
+    The attributes of the Lambda context object used by the handlers
+    """
+
+    def __init__(self, function_name, timeout_seconds=30):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{function_name}"
+        self.memory_limit_in_mb = 128
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def percentile(sorted_samples, p):
+    """
+    p-th percentile of sorted samples, interpolated between the closest ranks
+    """
+    if not sorted_samples:
+        return None
+    rank = (len(sorted_samples) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (rank - lower)
+
+
+def latency_summary(samples):
+    """
+    Count, mean, p50/p95/p99 and max of latency samples in milliseconds
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': round(percentile(ordered, 50), 3),
+        'p95': round(percentile(ordered, 95), 3),
+        'p99': round(percentile(ordered, 99), 3),
+        'max': round(ordered[-1], 3)
+    }
+
+
+class LocalPipeline:
+    """
+    Fetcher, queue and processor wired together in-process. `batch_size` and `batching_window` mirror
+    the event source mapping, `pollers` is the number of processor invocations running at once and a
+    message failing `max_receive_count` times goes to the dead-letter queue.
+    """
+
+    def __init__(self, weather_server=None, aws=None, batch_size=10, batching_window=0.0, pollers=1,
+                 max_receive_count=3, environment=None):
+        self.weather_server = weather_server or FakeWeatherServer()
+        self.aws = aws or FakeAWS()
+        self.aws.sqs.on_send = self._message_sent
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.pollers = max(pollers, 1)
+        self.max_receive_count = max_receive_count
+        self.environment = dict(DEFAULT_ENVIRONMENT, **(environment or {}))
+        self.fetcher = None
+        self.processor = None
+        self._lock = threading.Lock()
+        self._request = threading.local()
+        self._saved_environment = {}
+        self._reset_measurements()
+
+    def start(self):
+        self.weather_server.start()
+        self.queue_url = self.aws.sqs.create_queue(QueueName='weather-queue')['QueueUrl']
+        self.dead_letter_queue_url = self.aws.sqs.create_queue(QueueName='weather-dlq')['QueueUrl']
+        self.aws.sqs.set_redrive_policy(self.queue_url, self.dead_letter_queue_url, self.max_receive_count)
+        self.topic_arn = self.aws.sns.create_topic(Name='weather-notifications')['TopicArn']
+        self.aws.secretsmanager.secrets[SECRET_NAME] = self.weather_server.api_key
+        self.aws.reset_calls()
+
+        environment = dict(self.environment, **{
+            'WEATHER_API_URL': self.weather_server.url,
+            'WEATHER_API_SECRET_NAME': SECRET_NAME,
+            'SQS_QUEUE_URL': self.queue_url,
+            'S3_BUCKET_NAME': BUCKET_NAME,
+            'SNS_TOPIC_ARN': self.topic_arn
+        })
+        self._saved_environment = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+
+        aws_clients.reset()
+        aws_clients.use_client_factory(self.aws.client)
+        # The EMF records of the invocations are kept for the report instead of going to stdout
+        metrics.set_sink(self._metric_record)
+        tracing.set_exporter(self._span_finished)
+        # Imported here so a first run in the process picks the environment up
+        self.fetcher = importlib.import_module('..weather_fetcher.lambda_function', __package__)
+        self.processor = importlib.import_module('..weather_processor.lambda_function', __package__)
+        # Scheduled subscriptions of this pipeline only
+        self.subscriptions = MemorySubscriptionStore()
+        self.fetcher.subscription_store = self.subscriptions
+        # Alert rules of this pipeline only, none until add_alert_rules() is called
+        self._saved_alert_rules = self.processor.alert_rules
+        self.alert_rules = RuleIndex()
+        self.processor.alert_rules = self.alert_rules
+        self.reset_function_state()
+        return self
+
+    def stop(self):
+        # Nothing cached against the stand-ins may leak into a later use of the handlers
+        if self.fetcher is not None:
+            self.reset_function_state()
+            self.processor.alert_rules = self._saved_alert_rules
+        aws_clients.reset()
+        metrics.set_sink(None)
+        tracing.set_exporter(None)
+        for name, value in self._saved_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._saved_environment = {}
+        self.weather_server.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_function_state(self):
+        """
+        Empty the warm-container caches of the handlers, as in a new container
+        """
+        self.fetcher.secret_cache.clear()
+        self.fetcher.response_cache.clear()
+        self.fetcher.circuit_breaker.reset()
+        self.fetcher.rate_limiter.reset()
+        self.processor.subscription_index.clear()
+        self.processor.processed_messages.clear()
+        self.processor.alert_rules.clear()
+        self.processor.change_detector.clear()
+        clear_payload_caches()
+
+    def submit(self, request):
+        """
+        Invoke the fetcher with a request, as API Gateway does, and return its response
+        """
+        started = time.perf_counter()
+        self._request.started = time.time()
+        try:
+            return self.fetcher.lambda_handler(request, LambdaContext('weather-fetcher'))
+        finally:
+            self._request.started = None
+            with self._lock:
+                self.fetch_latencies.append((time.perf_counter() - started) * 1000)
+
+    def deliver(self, wait_seconds=0.0):
+        """
+        Deliver one batch of queued messages to the processor, returns the number of messages delivered
+        """
+        records = self.aws.sqs.receive_records(
+            self.queue_url,
+            max_messages=self.batch_size,
+            batching_window=self.batching_window,
+            wait_seconds=wait_seconds
+        )
+        if not records:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            response = self.processor.lambda_handler({'Records': records}, LambdaContext('weather-processor'))
+            failed = {failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])}
+        except Exception:
+            # A failed invocation returns the whole batch to the queue
+            failed = {record['messageId'] for record in records}
+        finished = time.perf_counter()
+        now = time.time()
+
+        for record in records:
+            if record['messageId'] in failed:
+                self.aws.sqs.release(self.queue_url, record['receiptHandle'])
+                continue
+            self.aws.sqs.acknowledge(self.queue_url, record['receiptHandle'])
+            with self._lock:
+                self.processed += 1
+                self.queue_to_processed.append(now * 1000 - int(record['attributes']['SentTimestamp']))
+                requested_at = self._requested_at.pop(record['messageId'], None)
+                if requested_at is not None:
+                    self.request_to_processed.append((now - requested_at) * 1000)
+        with self._lock:
+            self.batches += 1
+            self.batch_sizes.append(len(records))
+            self.redelivered += len(failed)
+            self.batch_latencies.append((finished - started) * 1000)
+        return len(records)
+
+    def drain(self):
+        """
+        Deliver batches until the queue is empty
+        """
+        while self.deliver():
+            pass
+
+    def run(self, requests, concurrency=1):
+        """
+        Submit every request with `concurrency` callers while the pollers deliver batches, then wait
+        for the queue to drain. Returns the report of the run.
+        """
+        self._reset_measurements()
+        self.aws.reset_calls()
+        submitting = threading.Event()
+        submitting.set()
+
+        def poll():
+            while True:
+                if not self.deliver(wait_seconds=0.05) and not submitting.is_set() \
+                        and self.aws.sqs.depth(self.queue_url) == 0 and self.aws.sqs.in_flight() == 0:
+                    return
+
+        started = time.perf_counter()
+        pollers = [threading.Thread(target=poll, daemon=True) for _ in range(self.pollers)]
+        for poller in pollers:
+            poller.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+                responses = list(executor.map(self.submit, requests))
+        finally:
+            submitting.clear()
+            for poller in pollers:
+                poller.join()
+        elapsed = time.perf_counter() - started
+        return self.report(responses, elapsed)
+
+    def add_alert_rules(self, rules):
+        """
+        Register alert rules, from then on the processor also notifies the rules that fire
+        """
+        if self.alert_rules.store is None:
+            self.alert_rules.store = MemoryRuleStore()
+        for rule in rules:
+            self.alert_rules.register(rule)
+
+    def run_schedule(self, subscriptions):
+        """
+        Store the subscriptions, run the scheduler once and deliver what it queued. Returns the report of the
+        run with the response of the scheduler under 'schedule'.
+        """
+        self._reset_measurements()
+        self.aws.reset_calls()
+        for subscription in subscriptions:
+            self.subscriptions.put(subscription)
+        started = time.perf_counter()
+        response = self.fetcher.schedule_handler({}, LambdaContext('weather-scheduler'))
+        self.drain()
+        report = self.report([response], time.perf_counter() - started)
+        report['schedule'] = response
+        return report
+
+    def report(self, responses, elapsed_seconds):
+        failed_requests = sum(1 for response in responses if 'statusCode' in response and response['statusCode'] >= 400)
+        return {
+            'requests': len(responses),
+            'failed_requests': failed_requests,
+            'messages_sent': self.sent,
+            'messages_processed': self.processed,
+            'batches': self.batches,
+            'redelivered': self.redelivered,
+            'dead_lettered': self.aws.sqs.depth(self.dead_letter_queue_url),
+            'elapsed_seconds': round(elapsed_seconds, 3),
+            'requests_per_second': round(len(responses) / elapsed_seconds, 2) if elapsed_seconds else None,
+            'messages_per_second': round(self.processed / elapsed_seconds, 2) if elapsed_seconds else None,
+            'mean_batch_size': round(sum(self.batch_sizes) / len(self.batch_sizes), 2) if self.batch_sizes else 0,
+            'latency_ms': {
+                'fetch': latency_summary(self.fetch_latencies),
+                'process_batch': latency_summary(self.batch_latencies),
+                'queue_to_processed': latency_summary(self.queue_to_processed),
+                'request_to_processed': latency_summary(self.request_to_processed)
+            },
+            'metrics': self.metrics_summary(),
+            'traces': self.trace_summary(),
+            'stored_objects': len(self.aws.s3.keys(BUCKET_NAME, 'weather-data/')),
+            'notifications': len(self.aws.sns.published),
+            'aws_calls': self.aws.calls(),
+            'weather_api': self.weather_server.stats()
+        }
+
+    def metrics_summary(self):
+        """
+        EMF metrics of the handlers per function name: latency summaries of the timed stages, totals of the counts
+        """
+        with self._lock:
+            records = list(self.metric_records)
+        samples = {}
+        for record in records:
+            function_metrics = samples.setdefault(record['FunctionName'], {})
+            for definition in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+                value = record[definition['Name']]
+                values = function_metrics.setdefault((definition['Name'], definition['Unit']), [])
+                values.extend(value if isinstance(value, list) else [value])
+        summary = {}
+        for function_name, function_metrics in samples.items():
+            summary[function_name] = {
+                name: latency_summary(values) if unit == metrics.MILLISECONDS else sum(values)
+                for (name, unit), values in sorted(function_metrics.items())
+            }
+        return summary
+
+    def trace_summary(self):
+        """
+        Traces followed through the pipeline: how many reached a notification and the end-to-end latency of those
+        """
+        with self._lock:
+            spans = list(self.spans)
+        started = {}
+        notified = {}
+        for span in spans:
+            started[span['trace_id']] = min(started.get(span['trace_id'], span['start']), span['start'])
+            if span['name'].startswith('sns.publish') and span['status'] == 'ok':
+                for trace_id in [span['trace_id']] + [link['trace_id'] for link in span['links']]:
+                    notified[trace_id] = max(notified.get(trace_id, span['end']), span['end'])
+        return {
+            'traces': len(started),
+            'spans': len(spans),
+            'failed_spans': sum(1 for span in spans if span['status'] != 'ok'),
+            'notified_traces': len(notified),
+            'request_to_notification_ms': latency_summary([
+                (end - started[trace_id]) * 1000 for trace_id, end in notified.items() if trace_id in started
+            ])
+        }
+
+    def stored_observations(self):
+        """
+        Every observation the processor wrote to the local bucket
+        """
+        observations = []
+        for key in self.aws.s3.keys(BUCKET_NAME, 'weather-data/'):
+            response = self.aws.s3.get_object(Bucket=BUCKET_NAME, Key=key)
+            observations.extend(read_observations(response['Body'].read(), response.get('ContentEncoding'), key=key))
+        return observations
+
+    def queued_messages(self):
+        """
+        Messages waiting in the queue, decoded like the processor does
+        """
+        return [
+            decode_message(body, load_data=lambda data_ref: None)
+            for body in self.aws.sqs.messages(self.queue_url)
+        ]
+
+    def _message_sent(self, message_id):
+        with self._lock:
+            self.sent += 1
+            started = getattr(self._request, 'started', None)
+            if started is not None:
+                self._requested_at[message_id] = started
+
+    def _metric_record(self, record):
+        with self._lock:
+            self.metric_records.append(record)
+
+    def _span_finished(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def _reset_measurements(self):
+        with self._lock:
+            self.sent = 0
+            self.processed = 0
+            self.batches = 0
+            self.redelivered = 0
+            self.batch_sizes = []
+            self.fetch_latencies = []
+            self.batch_latencies = []
+            self.queue_to_processed = []
+            self.request_to_processed = []
+            self._requested_at = {}
+            self.metric_records = []
+            self.spans = []
+
+
+def sample_requests(count, cities, notification_type='email'):
+    """
+    `count` requests spread round-robin over `cities` distinct cities
+    """
+    requests = []
+    for index in range(count):
+        city = index % cities
+        request = {'city_name': f"City{city:04d}", 'country_code': 'AU', 'notification_type': notification_type}
+        if notification_type in ('email', 'both'):
+            request['email'] = f"user{index}@example.com"
+        if notification_type in ('sms', 'both'):
+            request['phone_number'] = f"+614{index:08d}"
+        requests.append(request)
+    return requests
+
+
+def sample_subscriptions(count, cities, channel='sms', schedule='rate(1 hour)', first_run_at=0):
+    """
+    `count` subscriptions spread round-robin over `cities` distinct cities, due from `first_run_at`
+    """
+    return [
+        Subscription.create(
+            f"City{index % cities:04d}",
+            'AU',
+            channel,
+            f"+614{index:08d}" if channel == 'sms' else f"user{index}@example.com",
+            schedule,
+            first_run_at=first_run_at
+        )
+        for index in range(count)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run requests through the weather pipeline with local stand-ins for AWS and the Weather API')
+    parser.add_argument('--requests', type=int, default=100, help='number of fetcher requests')
+    parser.add_argument('--cities', type=int, default=10, help='distinct cities the requests are spread over')
+    parser.add_argument('--notification-type', default='email', choices=('email', 'sms', 'both'))
+    parser.add_argument('--subscribers', type=int, default=0,
+                        help='run one scheduler cycle for this many subscriptions over --cities instead of API requests')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent fetcher invocations')
+    parser.add_argument('--pollers', type=int, default=2, help='concurrent processor invocations')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--batching-window', type=float, default=0.0, help='seconds to wait for a full batch')
+    parser.add_argument('--weather-latency', type=float, default=0.05, help='seconds added to every Weather API call')
+    parser.add_argument('--weather-jitter', type=float, default=0.02, help='extra random seconds per Weather API call')
+    parser.add_argument('--weather-error-rate', type=float, default=0.0, help='share of Weather API calls failing with a 500')
+    parser.add_argument('--weather-throttle-rate', type=float, default=0.0, help='share of Weather API calls answered with a 429')
+    parser.add_argument('--aws-latency', type=float, default=0.0, help='seconds added to every AWS call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file the JSON report is written to, stdout by default')
+    parser.add_argument('--trace-file', help='file the spans of the run are appended to as JSON lines')
+    args = parser.parse_args(argv)
+
+    weather_server = FakeWeatherServer(
+        latency=args.weather_latency,
+        latency_jitter=args.weather_jitter,
+        error_rate=args.weather_error_rate,
+        throttle_rate=args.weather_throttle_rate,
+        seed=args.seed
+    )
+    pipeline = LocalPipeline(
+        weather_server=weather_server,
+        aws=FakeAWS(latency=args.aws_latency),
+        batch_size=args.batch_size,
+        batching_window=args.batching_window,
+        pollers=args.pollers
+    )
+    with pipeline:
+        if args.subscribers:
+            channel = 'email' if args.notification_type == 'email' else 'sms'
+            report = pipeline.run_schedule(sample_subscriptions(args.subscribers, args.cities, channel))
+        else:
+            report = pipeline.run(sample_requests(args.requests, args.cities, args.notification_type), concurrency=args.concurrency)
+    if args.trace_file:
+        exporter = tracing.FileExporter(args.trace_file)
+        for span in pipeline.spans:
+            exporter(span)
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CONDITIONS = (
+    (800, 'Clear', 'clear sky'),
+    (801, 'Clouds', 'few clouds'),
+    (500, 'Rain', 'light rain'),
+    (211, 'Thunderstorm', 'thunderstorm'),
+    (600, 'Snow', 'light snow')
+)
+
+
+def current_weather(city, country_code, observed_at):
+    """
+    OpenWeatherMap-like current weather of a city, derived from the city name so runs are repeatable
+    """
+    seed = int(hashlib.sha256(f"{city},{country_code}".lower().encode('utf-8')).hexdigest()[:8], 16)
+    condition_id, main, description = CONDITIONS[seed % len(CONDITIONS)]
+    return {
+        'coord': {'lon': round((seed % 36000) / 100 - 180, 4), 'lat': round((seed % 18000) / 100 - 90, 4)},
+        'weather': [{'id': condition_id, 'main': main, 'description': description, 'icon': '01d'}],
+        'base': 'stations',
+        'main': {
+            'temp': round(263.15 + (seed % 4000) / 100, 2),
+            'feels_like': round(262.15 + (seed % 4000) / 100, 2),
+            'pressure': 990 + seed % 40,
+            'humidity': 30 + seed % 70
+        },
+        'visibility': 10000,
+        'wind': {'speed': round((seed % 250) / 10, 1), 'deg': seed % 360},
+        'clouds': {'all': seed % 100},
+        'dt': int(observed_at),
+        'sys': {'country': country_code.upper()},
+        'timezone': 0,
+        'id': seed % 10000000,
+        'name': city.title(),
+        'cod': 200
+    }
+
+
+class FakeWeatherServer:
+    """
+    Local HTTP server answering like the OpenWeatherMap current weather API. Every answer is delayed
+    by `latency` seconds plus up to `latency_jitter`, and a share of the requests fails with a 500
+    (`error_rate`) or is rate limited with a 429 (`throttle_rate`).
+    """
+
+    def __init__(self, api_key='local-api-key', latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, seed=None, clock=time.time):
+        self.api_key = api_key
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/data/2.5/weather"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        return {'requests': self.requests, 'errors': self.errors, 'throttled': self.throttled}
+
+    def answer(self, path, query):
+        """
+        Status, headers and JSON document of a request
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.random() * self.latency_jitter
+            draw = self._random.random()
+        if delay:
+            time.sleep(delay)
+
+        if path != '/data/2.5/weather':
+            return 404, {}, {'cod': '404', 'message': 'Internal error'}
+        if query.get('appid', [None])[0] != self.api_key:
+            return 401, {}, {'cod': 401, 'message': 'Invalid API key.'}
+        if draw < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            return 429, {'Retry-After': str(self.retry_after)}, {'cod': 429, 'message': 'Too many requests'}
+        if draw < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 500, {}, {'cod': 500, 'message': 'Internal server error'}
+
+        city, _, country_code = query.get('q', [''])[0].partition(',')
+        if not city:
+            return 400, {}, {'cod': '400', 'message': 'Nothing to geocode'}
+        return 200, {}, current_weather(city, country_code or '', self._clock())
+
+    def _handler_class(self):
+        weather_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                status, headers, document = weather_server.answer(parsed.path, parse_qs(parsed.query))
+                body = json.dumps(document).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+
+from ..common import aws_clients
+from ..common.http_client import Urllib3Session
+
+
+class TestAwsClients(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+
+    def tearDown(self):
+        aws_clients.reset()
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_client_is_created_once_per_service(self, mock_boto_client):
+        mock_boto_client.side_effect = lambda service: MagicMock(name=service)
+
+        first_sqs = aws_clients.client('sqs')
+        second_sqs = aws_clients.client('sqs')
+        sns = aws_clients.client('sns')
+
+        self.assertIs(first_sqs, second_sqs)
+        self.assertIsNot(first_sqs, sns)
+        self.assertEqual(mock_boto_client.call_count, 2)
+
+    @patch.dict(os.environ, {'AWS_DEFAULT_REGION': 'ap-southeast-2', 'AWS_MAX_POOL_CONNECTIONS': '30'})
+    def test_client_is_built_with_the_shared_config(self):
+        config = aws_clients.client('s3').meta.config
+
+        self.assertEqual(config.max_pool_connections, 30)
+        self.assertTrue(config.tcp_keepalive)
+
+    @patch('requests.get')
+    def test_patched_requests_get_stands_in_for_the_session(self, mock_requests_get):
+        aws_clients.http_session().get('https://api.openweathermap.org', timeout=1)
+
+        mock_requests_get.assert_called_once_with('https://api.openweathermap.org', timeout=1)
+
+    def test_client_is_rebuilt_when_boto3_client_is_patched(self):
+        first_mock = MagicMock()
+        second_mock = MagicMock()
+
+        with patch('src.lambda.common.aws_clients.boto3.client', return_value=first_mock):
+            self.assertIs(aws_clients.client('s3'), first_mock)
+        with patch('src.lambda.common.aws_clients.boto3.client', return_value=second_mock):
+            self.assertIs(aws_clients.client('s3'), second_mock)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_client_factory_replaces_boto3_until_reset(self, mock_boto_client):
+        local_sqs = MagicMock()
+        aws_clients.use_client_factory(lambda service: local_sqs)
+
+        self.assertIs(aws_clients.client('sqs'), local_sqs)
+        mock_boto_client.assert_not_called()
+
+        aws_clients.reset()
+        self.assertIs(aws_clients.client('sqs'), mock_boto_client.return_value)
+
+    @patch.dict(os.environ, {
+        'AWS_MAX_POOL_CONNECTIONS': '50',
+        'AWS_CONNECT_TIMEOUT': '1',
+        'AWS_READ_TIMEOUT': '3',
+        'AWS_MAX_ATTEMPTS': '5'
+    })
+    def test_client_config_from_environment(self):
+        config = aws_clients.client_config()
+
+        self.assertEqual(config.max_pool_connections, 50)
+        self.assertEqual(config.connect_timeout, 1.0)
+        self.assertEqual(config.read_timeout, 3.0)
+        self.assertEqual(config.retries, {'max_attempts': 5, 'mode': 'standard'})
+
+    @patch.dict(os.environ, {'HTTP_POOL_MAXSIZE': '8'})
+    def test_http_session_is_reused_with_pooled_adapter(self):
+        session = aws_clients.http_session()
+
+        self.assertIs(session, aws_clients.http_session())
+        adapter = session.get_adapter('https://api.openweathermap.org')
+        self.assertEqual(adapter._pool_maxsize, 8)
+
+    @patch.dict(os.environ, {'HTTP_CLIENT': 'urllib3', 'HTTP_POOL_MAXSIZE': '8'})
+    def test_http_session_uses_urllib3_when_configured(self):
+        session = aws_clients.http_session()
+
+        self.assertIsInstance(session, Urllib3Session)
+        self.assertIs(session, aws_clients.http_session())
+
+
+if __name__ == '__main__':
+    unittest.main()
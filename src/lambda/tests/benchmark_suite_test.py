@@ -0,0 +1,54 @@
+import unittest
+
+from ..benchmarks.suite import AuthorizerScenario, FetcherScenario, ProcessorScenario, compare, run_scenario
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_fetcher_scenario_reports_latency_allocations_and_calls(self):
+        result = run_scenario(FetcherScenario('fetcher.batch', 'weather_fetcher', 2, 2, 'batch', 0.0), seed=1)
+
+        self.assertEqual(2, result['operations'])
+        self.assertEqual(50, result['items'])
+        self.assertEqual(2, result['latency_ms']['count'])
+        self.assertEqual(2, result['allocations']['sampled_operations'])
+        self.assertGreater(result['allocations']['peak_kib'], 0)
+        # The 25 messages of a batch request are sent ten at a time
+        self.assertEqual(6, result['external_calls']['sqs.send_message_batch'])
+        self.assertEqual(0.12, result['external_calls_per_item']['sqs.send_message_batch'])
+
+    def test_processor_scenario_delivers_batches_of_ten(self):
+        result = run_scenario(ProcessorScenario('processor.single_city', 'weather_processor', 2, 1, 'single_city', 0.0), seed=1)
+
+        self.assertEqual(2, result['operations'])
+        self.assertEqual(20, result['items'])
+        self.assertEqual(1.0, result['external_calls_per_item']['sns.publish'])
+        self.assertEqual(0, result['external_calls']['weather_api.get'])
+
+    def test_authorizer_scenario_with_jwts(self):
+        result = run_scenario(AuthorizerScenario('authorizer.jwt', 20, 2, jwt=True, principals=3), seed=1)
+
+        self.assertEqual(20, result['items'])
+        self.assertEqual({}, result['external_calls'])
+
+    def test_compare_flags_regressions(self):
+        baseline = {'scenarios': {
+            'fast': {'throughput_per_second': 100.0, 'latency_ms': {'p95': 10.0}},
+            'slow': {'throughput_per_second': 100.0, 'latency_ms': {'p95': 10.0}}
+        }}
+        results = {'scenarios': {
+            'fast': {'throughput_per_second': 105.0, 'latency_ms': {'p95': 9.0}},
+            'slow': {'throughput_per_second': 80.0, 'latency_ms': {'p95': 10.5}},
+            'new': {'throughput_per_second': 50.0, 'latency_ms': {'p95': 1.0}}
+        }}
+
+        lines, regressed = compare(baseline, results, threshold=0.1)
+
+        self.assertTrue(regressed)
+        self.assertNotIn('REGRESSION', lines[0])
+        self.assertIn('REGRESSION', lines[1])
+        self.assertEqual('new: no baseline', lines[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
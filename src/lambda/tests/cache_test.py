@@ -0,0 +1,40 @@
+import unittest
+
+from ..common.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = LRUCache(max_entries=2, ttl_seconds=10, clock=lambda: self.now)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.put('london,uk', {'temp': 10})
+
+        self.now = 9
+        self.assertEqual({'temp': 10}, self.cache.get('london,uk'))
+        self.now = 10
+        self.assertIsNone(self.cache.get('london,uk'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0, 'size': 0}, self.cache.stats())
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(3, self.cache.get('c'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_entry_ttl_can_be_overridden(self):
+        self.cache.put('a', 1, ttl_seconds=2)
+
+        self.now = 3
+        self.assertIsNone(self.cache.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
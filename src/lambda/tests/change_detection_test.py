@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from ..common.stores import FileStore, MemoryStore
+from ..weather_processor import lambda_function as processor
+from ..weather_processor.change_detection import ChangeDetector
+from ..weather_processor.notifications import Notification
+
+TOPIC_ARN = 'arn:aws:sns:region:account-id:weather-topic'
+
+
+def observation(dt, description='light rain', celsius=10.0):
+    return {
+        'dt': dt,
+        'main': {'temp': celsius + 273.15, 'humidity': 80},
+        'weather': [{'main': 'Rain', 'description': description}]
+    }
+
+
+SMS = Notification('sms', '+1234567890', 'London', 'light rain')
+EMAIL = Notification('email', 'user@example.com', 'London', 'light rain')
+
+
+class TestChangeDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.detector = ChangeDetector(clock=lambda: self.now)
+
+    def test_unchanged_observation_is_suppressed_per_recipient(self):
+        self.assertIsNone(self.detector.suppression(SMS, 'uk', observation(1), 'm1'))
+        self.assertIsNone(self.detector.suppression(EMAIL, 'uk', observation(1), 'm1'))
+
+        self.assertEqual(self.detector.suppression(SMS, 'uk', observation(2), 'm2'), 'unchanged')
+        self.assertEqual(self.detector.suppression(EMAIL, 'UK ', observation(3), 'm3'), 'unchanged')
+        self.assertEqual(self.detector.stats()['unchanged'], 2)
+
+    def test_changed_description_is_notified(self):
+        self.detector.suppression(SMS, 'uk', observation(1), 'm1')
+
+        self.assertIsNone(self.detector.suppression(SMS, 'uk', observation(2, description='heavy rain'), 'm2'))
+
+    def test_redelivered_message_is_notified_again(self):
+        self.detector.suppression(SMS, 'uk', observation(1), 'm1')
+
+        self.assertIsNone(self.detector.suppression(SMS, 'uk', observation(1), 'm1'))
+
+    def test_older_observation_is_suppressed(self):
+        self.detector.suppression(SMS, 'uk', observation(5), 'm1')
+
+        self.assertEqual(self.detector.suppression(SMS, 'uk', observation(4, description='heavy rain'), 'm2'), 'unchanged')
+
+    def test_thresholds_make_field_changes_significant(self):
+        detector = ChangeDetector(thresholds={'temp': 2}, clock=lambda: self.now)
+        detector.suppression(SMS, 'uk', observation(1, celsius=10), 'm1')
+
+        self.assertEqual(detector.suppression(SMS, 'uk', observation(2, celsius=11), 'm2'), 'unchanged')
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(3, celsius=12), 'm3'))
+
+    def test_cooldown_delays_significant_changes(self):
+        detector = ChangeDetector(cooldown_seconds=600, clock=lambda: self.now)
+        detector.suppression(SMS, 'uk', observation(1), 'm1')
+
+        self.now += 300
+        self.assertEqual(detector.suppression(SMS, 'uk', observation(2, description='snow'), 'm2'), 'cooldown')
+        self.now += 300
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(3, description='snow'), 'm3'))
+
+    def test_state_expires(self):
+        store = MemoryStore(clock=lambda: self.now)
+        detector = ChangeDetector(store=store, state_ttl_seconds=3600, clock=lambda: self.now)
+        detector.suppression(SMS, 'uk', observation(1), 'm1')
+
+        self.now += 3600
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(2), 'm2'))
+
+    def test_storage_is_skipped_only_when_enabled(self):
+        self.assertTrue(self.detector.should_store('London', 'uk', observation(1), 'm1'))
+        self.assertTrue(self.detector.should_store('London', 'uk', observation(2), 'm2'))
+
+        detector = ChangeDetector(skip_unchanged_storage=True, clock=lambda: self.now)
+        self.assertTrue(detector.should_store('London', 'uk', observation(1), 'm1'))
+        self.assertFalse(detector.should_store('London', 'uk', observation(2), 'm2'))
+        self.assertTrue(detector.should_store('London', 'uk', observation(1), 'm1'))
+        self.assertTrue(detector.should_store('Paris', 'fr', observation(2), 'm3'))
+        self.assertEqual(detector.stats()['skipped_writes'], 1)
+
+    def test_state_is_shared_through_a_persistent_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        ChangeDetector(store=FileStore(directory)).suppression(SMS, 'uk', observation(1), 'm1')
+
+        restarted = ChangeDetector(store=FileStore(directory))
+        self.assertEqual(restarted.suppression(SMS, 'uk', observation(2), 'm2'), 'unchanged')
+
+    def test_store_failure_does_not_suppress(self):
+        store = MagicMock()
+        store.get.side_effect = RuntimeError('unavailable')
+        detector = ChangeDetector(store=store)
+
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(1), 'm1'))
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(2), 'm2'))
+
+    def test_disabled_detector_suppresses_nothing(self):
+        detector = ChangeDetector(enabled=False, skip_unchanged_storage=True)
+        detector.suppression(SMS, 'uk', observation(1), 'm1')
+
+        self.assertIsNone(detector.suppression(SMS, 'uk', observation(2), 'm2'))
+        self.assertTrue(detector.should_store('London', 'uk', observation(2), 'm2'))
+
+    @patch.dict(os.environ, {
+        'CHANGE_DETECTION': 'true',
+        'CHANGE_THRESHOLDS': '{"temp": 3, "wind": 20}',
+        'CHANGE_COOLDOWN_SECONDS': '60',
+        'CHANGE_SKIP_UNCHANGED_STORAGE': 'true'
+    })
+    def test_from_environment(self):
+        detector = ChangeDetector.from_environment()
+
+        self.assertTrue(detector.enabled)
+        self.assertEqual(detector.thresholds, {'temp': 3, 'wind': 20})
+        self.assertEqual(detector.cooldown_seconds, 60)
+        self.assertTrue(detector.skip_unchanged_storage)
+        self.assertIsInstance(detector.store, MemoryStore)
+
+
+class TestProcessorChangeDetection(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(processor, 'change_detector', ChangeDetector())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        processor.subscription_index.clear()
+
+    def weather_body(self, dt, **fields):
+        return dict({
+            'city_name': 'London',
+            'country_code': 'uk',
+            'notification_type': 'sms',
+            'phone_number': '+1234567890',
+            'data': observation(dt)
+        }, **fields)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_repeated_condition_is_notified_once(self, mock_boto_client):
+        sns_client = MagicMock()
+        mock_boto_client.return_value = sns_client
+
+        processor.handle_notification(self.weather_body(1), TOPIC_ARN, message_id='m1')
+        processor.handle_notification(self.weather_body(2), TOPIC_ARN, message_id='m2')
+
+        sns_client.publish.assert_called_once()
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_scheduled_recipients_are_always_notified(self, mock_boto_client):
+        sns_client = MagicMock()
+        mock_boto_client.return_value = sns_client
+        recipients = [{'notification_type': 'sms', 'email': '', 'phone_number': '+1234567890'}]
+
+        processor.handle_notification(self.weather_body(1, recipients=recipients), TOPIC_ARN, message_id='m1')
+        processor.handle_notification(self.weather_body(2, recipients=recipients), TOPIC_ARN, message_id='m2')
+
+        self.assertEqual(sns_client.publish.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
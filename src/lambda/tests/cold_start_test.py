@@ -0,0 +1,27 @@
+import unittest
+
+from ..benchmarks.cold_start import parse_importtime
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _json
+import time:       900 |       1020 | json
+import time:       300 |        300 |     hmac
+import time:       150 |        450 |   token_store
+import time:      2000 |       2000 |   logging
+import time:       400 |       2850 | lambda_function
+"""
+
+
+class TestParseImporttime(unittest.TestCase):
+
+    def test_lines_are_parsed_with_their_depth(self):
+        entries = parse_importtime(IMPORTTIME_OUTPUT + 'unrelated output\n')
+
+        self.assertEqual(6, len(entries))
+        self.assertEqual(('_json', 120, 120, 1), entries[0])
+        self.assertEqual(('hmac', 300, 300, 2), entries[2])
+        self.assertEqual(('lambda_function', 400, 2850, 0), entries[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import unittest
+
+import pyarrow.parquet as pq
+
+from ..common.local_s3 import LocalS3Client
+from ..weather_compactor.compaction import PARQUET_SCHEMA, compact_day, flatten_observation
+
+BUCKET = 'test-weather-bucket'
+
+# 2024-05-01 13:20:00 UTC
+MEASURED_AT = 1714569600
+
+
+def observation(dt, temp, name='London', country='GB'):
+    return {
+        'coord': {'lon': -0.1257, 'lat': 51.5085},
+        'weather': [{'id': 500, 'main': 'Rain', 'description': 'light rain'}],
+        'main': {'temp': temp, 'feels_like': temp - 1, 'temp_min': temp - 2, 'temp_max': temp + 2, 'pressure': 1012, 'humidity': 81},
+        'visibility': 10000,
+        'wind': {'speed': 4.1, 'deg': 240},
+        'clouds': {'all': 75},
+        'dt': dt,
+        'sys': {'country': country},
+        'id': 2643743,
+        'name': name
+    }
+
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.s3_client = LocalS3Client(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def put_ndjson(self, key, observations):
+        body = ''.join(json.dumps(item) + '\n' for item in observations).encode('utf-8')
+        self.s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(body))
+
+    def read_table(self, key):
+        body = self.s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+        return pq.read_table(io.BytesIO(body))
+
+    def test_flatten_observation(self):
+        row = flatten_observation(observation(MEASURED_AT, 12.5), 'london', 'gb')
+
+        self.assertEqual(set(PARQUET_SCHEMA.names), set(row))
+        self.assertEqual(12.5, row['temp'])
+        self.assertEqual(81, row['humidity'])
+        self.assertEqual('light rain', row['weather_description'])
+        self.assertEqual(-0.1257, row['lon'])
+        self.assertIsNone(row['wind_gust'])
+
+    def test_compacts_partitioned_and_original_objects_per_city(self):
+        self.put_ndjson('weather-data/date=2024-05-01/hour=13/country=uk/city=london/a-00000000.jsonl.gz',
+                        [observation(MEASURED_AT, 12.5), observation(MEASURED_AT + 600, 13.0)])
+        self.put_ndjson('weather-data/date=2024-05-01/hour=14/country=uk/city=london/a-00000001.jsonl.gz',
+                        [observation(MEASURED_AT + 3600, 14.0)])
+        self.s3_client.put_object(Bucket=BUCKET, Key='weather-data/2024/05/01-09-00-00-000000.json',
+                                  Body=json.dumps(observation(MEASURED_AT - 14400, 8.0, 'Paris', 'FR'), indent=2))
+
+        summary = compact_day(self.s3_client, BUCKET, '2024-05-01')
+
+        self.assertEqual({'date': '2024-05-01', 'partitions': 2, 'written': 2, 'skipped': 0, 'rows': 4}, summary)
+        london = self.read_table('weather-parquet/date=2024-05-01/country=uk/city=london/part-00000.parquet')
+        self.assertTrue(PARQUET_SCHEMA.equals(london.schema))
+        self.assertEqual([12.5, 13.0, 14.0], london.column('temp').to_pylist())
+        paris = self.read_table('weather-parquet/date=2024-05-01/country=fr/city=paris/part-00000.parquet')
+        self.assertEqual(['paris'], paris.column('city').to_pylist())
+
+    def test_rerun_does_not_duplicate_rows(self):
+        key = 'weather-data/date=2024-05-01/hour=13/country=uk/city=london/a-00000000.jsonl.gz'
+        self.put_ndjson(key, [observation(MEASURED_AT, 12.5), observation(MEASURED_AT, 12.5)])
+
+        first = compact_day(self.s3_client, BUCKET, '2024-05-01')
+        second = compact_day(self.s3_client, BUCKET, '2024-05-01')
+        forced = compact_day(self.s3_client, BUCKET, '2024-05-01', force=True)
+
+        self.assertEqual((1, 1), (first['written'], first['rows']))
+        self.assertEqual((0, 1), (second['written'], second['skipped']))
+        self.assertEqual((1, 1), (forced['written'], forced['rows']))
+        table = self.read_table('weather-parquet/date=2024-05-01/country=uk/city=london/part-00000.parquet')
+        self.assertEqual(1, table.num_rows)
+
+    def test_new_source_object_rewrites_its_partition(self):
+        self.put_ndjson('weather-data/date=2024-05-01/hour=13/country=uk/city=london/a-00000000.jsonl.gz',
+                        [observation(MEASURED_AT, 12.5)])
+        compact_day(self.s3_client, BUCKET, '2024-05-01')
+
+        self.put_ndjson('weather-data/date=2024-05-01/hour=15/country=uk/city=london/b-00000000.jsonl.gz',
+                        [observation(MEASURED_AT + 7200, 15.0)])
+        summary = compact_day(self.s3_client, BUCKET, '2024-05-01')
+
+        self.assertEqual((1, 2), (summary['written'], summary['rows']))
+
+    def test_row_groups(self):
+        self.put_ndjson('weather-data/date=2024-05-01/hour=13/country=uk/city=london/a-00000000.jsonl.gz',
+                        [observation(MEASURED_AT + minute * 60, 10.0 + minute) for minute in range(10)])
+
+        compact_day(self.s3_client, BUCKET, '2024-05-01', row_group_size=4)
+
+        body = self.s3_client.get_object(
+            Bucket=BUCKET, Key='weather-parquet/date=2024-05-01/country=uk/city=london/part-00000.parquet')['Body']
+        self.assertEqual(3, pq.ParquetFile(body).num_row_groups)
+
+    def test_day_without_data(self):
+        self.assertEqual(
+            {'date': '2024-05-02', 'partitions': 0, 'written': 0, 'skipped': 0, 'rows': 0},
+            compact_day(self.s3_client, BUCKET, '2024-05-02')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
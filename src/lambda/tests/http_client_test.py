@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ..common.http_client import HTTPError, Response, Urllib3Session
+
+
+class TestUrllib3Session(unittest.TestCase):
+
+    @patch('urllib3.PoolManager.request')
+    def test_get_encodes_params_and_wraps_the_answer(self, mock_request):
+        mock_request.return_value = MagicMock(status=200, headers={'Retry-After': '3'}, data=b'{"name": "Sydney"}')
+        session = Urllib3Session(pool_size=4)
+
+        response = session.get('https://api.example.com/weather', params={'q': 'Sydney,AU', 'appid': 'key'}, timeout=5)
+
+        args, kwargs = mock_request.call_args
+        self.assertEqual(('GET', 'https://api.example.com/weather?q=Sydney%2CAU&appid=key'), args)
+        self.assertEqual(5, kwargs['timeout'].total)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'name': 'Sydney'}, response.json())
+        self.assertEqual('3', response.headers.get('Retry-After'))
+        self.assertGreaterEqual(response.elapsed.total_seconds(), 0)
+        response.raise_for_status()
+
+    @patch('urllib3.PoolManager.request')
+    def test_get_appends_params_to_an_existing_query(self, mock_request):
+        mock_request.return_value = MagicMock(status=200, headers={}, data=b'{}')
+
+        Urllib3Session().get('https://api.example.com/weather?units=metric', params={'q': 'Sydney'})
+
+        self.assertEqual('https://api.example.com/weather?units=metric&q=Sydney', mock_request.call_args[0][1])
+        self.assertIsNone(mock_request.call_args[1]['timeout'])
+
+    def test_raise_for_status_on_error_answers(self):
+        for status_code, kind in ((404, 'Client'), (503, 'Server')):
+            response = Response('https://api.example.com/weather', status_code, {}, b'', None)
+            with self.assertRaises(HTTPError) as raised:
+                response.raise_for_status()
+            self.assertIn(f"{status_code} {kind} Error", str(raised.exception))
+            self.assertIs(response, raised.exception.response)
+
+
+if __name__ == '__main__':
+    unittest.main()
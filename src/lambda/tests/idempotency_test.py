@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock
+
+from ..common.stores import MemoryStore
+from ..weather_processor.idempotency import STAGE_STORED, BatchProgress, ProcessedMessages, notification_stage
+
+
+class TestProcessedMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.clock = lambda: self.now
+
+    def test_marked_stages_are_remembered(self):
+        processed = ProcessedMessages(clock=self.clock)
+
+        self.assertEqual(frozenset(), processed.completed('key-1'))
+        processed.mark('key-1', STAGE_STORED)
+        processed.mark('key-1', notification_stage('email', 'test@example.com'))
+
+        self.assertEqual(
+            {STAGE_STORED, notification_stage('email', 'test@example.com')},
+            processed.completed('key-1')
+        )
+
+    def test_seen_set_is_bounded_and_expires(self):
+        processed = ProcessedMessages(max_entries=2, ttl_seconds=60, clock=self.clock)
+        for key in ('key-1', 'key-2', 'key-3'):
+            processed.mark(key, STAGE_STORED)
+
+        self.assertEqual(frozenset(), processed.completed('key-1'))
+        self.now = 61
+        self.assertEqual(frozenset(), processed.completed('key-3'))
+
+    def test_shared_store_is_used_across_containers(self):
+        store = MemoryStore()
+        ProcessedMessages(store=store, clock=self.clock).mark('key-1', STAGE_STORED)
+
+        self.assertEqual({STAGE_STORED}, ProcessedMessages(store=store, clock=self.clock).completed('key-1'))
+        self.assertNotIn('test@example.com', str(store.get('processed:key-1')))
+
+    def test_store_failures_do_not_fail_processing(self):
+        store = MagicMock()
+        store.get.side_effect = Exception('Store unavailable')
+        store.put.side_effect = Exception('Store unavailable')
+        processed = ProcessedMessages(store=store, clock=self.clock)
+
+        processed.mark('key-1', STAGE_STORED)
+
+        self.assertEqual({STAGE_STORED}, processed.completed('key-1'))
+
+
+class TestBatchProgress(unittest.TestCase):
+
+    def test_repeated_key_in_a_batch_is_a_duplicate(self):
+        progress = BatchProgress(ProcessedMessages())
+
+        self.assertEqual(frozenset(), progress.begin('message-1', 'key-1'))
+        self.assertIsNone(progress.begin('message-2', 'key-1'))
+        self.assertEqual({'message-2': 'message-1'}, progress.duplicates)
+
+    def test_commit_records_completed_stages_except_discarded(self):
+        processed = ProcessedMessages()
+        progress = BatchProgress(processed)
+        progress.begin('message-1', 'key-1')
+        progress.begin('message-2', 'key-2')
+        progress.complete('message-1', STAGE_STORED)
+        progress.complete('message-2', STAGE_STORED)
+        progress.discard(['message-2'])
+
+        progress.commit()
+
+        self.assertEqual({STAGE_STORED}, processed.completed('key-1'))
+        self.assertEqual(frozenset(), processed.completed('key-2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+from ..authorizer.jwt_verifier import InvalidTokenError, JWKSCache, JWTVerifier, read_jwks
+
+NOW = 1714569600
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+EC_KEY = ec.generate_private_key(ec.SECP256R1())
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64_int(value, length=None):
+    return b64(value.to_bytes(length or (value.bit_length() + 7) // 8, 'big'))
+
+
+def rsa_jwk(kid, key=RSA_KEY):
+    numbers = key.public_key().public_numbers()
+    return {'kty': 'RSA', 'kid': kid, 'alg': 'RS256', 'use': 'sig', 'n': b64_int(numbers.n), 'e': b64_int(numbers.e)}
+
+
+def ec_jwk(kid, key=EC_KEY):
+    numbers = key.public_key().public_numbers()
+    return {'kty': 'EC', 'kid': kid, 'alg': 'ES256', 'crv': 'P-256', 'x': b64_int(numbers.x, 32), 'y': b64_int(numbers.y, 32)}
+
+
+def sign(claims, kid='rsa-1', algorithm='RS256', key=None):
+    header = b64(json.dumps({'alg': algorithm, 'kid': kid, 'typ': 'JWT'}).encode('utf-8'))
+    payload = b64(json.dumps(claims).encode('utf-8'))
+    signing_input = f"{header}.{payload}".encode('ascii')
+    if algorithm == 'RS256':
+        signature = (key or RSA_KEY).sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
+    else:
+        r, s = decode_dss_signature((key or EC_KEY).sign(signing_input, ec.ECDSA(hashes.SHA256())))
+        signature = r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+    return f"{header}.{payload}.{b64(signature)}"
+
+
+def claims(**overrides):
+    return dict({'sub': 'alice', 'iss': 'https://issuer.example.com', 'aud': 'weather-api', 'exp': NOW + 300}, **overrides)
+
+
+class TestJWTVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.now = NOW
+        self.documents = [{'keys': [rsa_jwk('rsa-1'), ec_jwk('ec-1')]}]
+        self.jwks = JWKSCache('jwks', ttl_seconds=3600, min_refresh_seconds=60,
+                              loader=lambda source: self.documents[-1], clock=lambda: self.now)
+        self.verifier = JWTVerifier(self.jwks, issuer='https://issuer.example.com', audience='weather-api',
+                                    clock=lambda: self.now)
+
+    def test_rs256_and_es256_tokens_are_verified(self):
+        self.assertEqual('alice', self.verifier.verify(sign(claims()))['sub'])
+        self.assertEqual('bob', self.verifier.verify(sign(claims(sub='bob'), 'ec-1', 'ES256'))['sub'])
+        self.assertEqual(1, self.jwks.fetches)
+
+    def test_tampered_token_is_rejected(self):
+        header, _, signature = sign(claims()).split('.')
+        forged = f"{header}.{b64(json.dumps(claims(sub='mallory')).encode('utf-8'))}.{signature}"
+
+        with self.assertRaises(InvalidTokenError):
+            self.verifier.verify(forged)
+
+    def test_claims_are_checked(self):
+        for token in (
+            sign(claims(exp=NOW - 1)),
+            sign(claims(nbf=NOW + 60)),
+            sign(claims(iss='https://other.example.com')),
+            sign(claims(aud=['other-api'])),
+            sign({'sub': 'alice', 'iss': 'https://issuer.example.com', 'aud': 'weather-api'}),
+            sign(claims(), algorithm='ES256', kid='rsa-1'),
+            'not-a-jwt',
+            'a.b.c'
+        ):
+            with self.assertRaises(InvalidTokenError):
+                self.verifier.verify(token)
+
+    def test_verified_claims_are_cached_until_expiry(self):
+        token = sign(claims())
+        self.verifier.verify(token)
+        # Without its keys the token could no longer be verified, only the cache can answer
+        self.documents.append({'keys': []})
+        self.jwks.clear()
+
+        self.now = NOW + 299
+        self.assertEqual('alice', self.verifier.verify(token)['sub'])
+        self.assertEqual(1, self.verifier.stats()['hits'])
+        self.assertEqual(0, self.jwks.fetches)
+
+        self.now = NOW + 300
+        with self.assertRaises(InvalidTokenError):
+            self.verifier.verify(token)
+
+    def test_unknown_kid_refreshes_the_jwks_once_per_interval(self):
+        rotated_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.verifier.verify(sign(claims()))
+        self.documents.append({'keys': [rsa_jwk('rsa-1'), rsa_jwk('rsa-2', rotated_key)]})
+
+        self.now += 61
+        self.assertEqual('alice', self.verifier.verify(sign(claims(), 'rsa-2', key=rotated_key))['sub'])
+        with self.assertRaises(InvalidTokenError):
+            self.verifier.verify(sign(claims(), 'rsa-3'))
+        self.assertEqual(2, self.jwks.fetches)
+
+    def test_local_jwks_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump({'keys': [rsa_jwk('rsa-1')]}, file)
+        try:
+            self.assertEqual(['rsa-1'], [key['kid'] for key in read_jwks(f"file://{file.name}")['keys']])
+            self.assertEqual(1, len(read_jwks(file.name)['keys']))
+        finally:
+            os.remove(file.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
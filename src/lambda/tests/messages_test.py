@@ -0,0 +1,114 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ..common import aws_clients
+from ..common.messages import encode_message, decode_message, message_key, store_payload, load_payload, clear_payload_caches
+
+
+MESSAGE = {
+    'status_code': 200,
+    'notification_type': 'email',
+    'email': 'test@example.com',
+    'phone_number': '',
+    'city_name': 'London',
+    'country_code': 'UK',
+    'data': {'weather': [{'description': 'light rain'}], 'main': {'temp': 280.1}},
+    'response_time_ms': 87,
+    'cache_status': 'miss'
+}
+
+
+class TestMessages(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+        clear_payload_caches()
+
+    def test_compact_envelope_keeps_only_required_fields(self):
+        body = encode_message(MESSAGE)
+
+        self.assertEqual({
+            'v': 2,
+            'city_name': 'London',
+            'country_code': 'UK',
+            'notification_type': 'email',
+            'email': 'test@example.com',
+            'data': MESSAGE['data']
+        }, json.loads(body))
+        self.assertLess(len(body), len(json.dumps(MESSAGE)))
+
+    def test_round_trip(self):
+        decoded = decode_message(encode_message(MESSAGE))
+
+        self.assertEqual('London', decoded['city_name'])
+        self.assertEqual('email', decoded['notification_type'])
+        self.assertEqual('', decoded['phone_number'])
+        self.assertEqual(MESSAGE['data'], decoded['data'])
+
+    def test_message_key_round_trip(self):
+        key = message_key(MESSAGE)
+        decoded = decode_message(encode_message(dict(MESSAGE, message_key=key)))
+
+        self.assertEqual(key, decoded['message_key'])
+        self.assertEqual(key, message_key(dict(MESSAGE, cache_status='hit', response_time_ms=3)))
+        self.assertNotEqual(key, message_key(dict(MESSAGE, email='other@example.com')))
+
+    def test_recipients_round_trip(self):
+        recipients = [
+            {'notification_type': 'sms', 'email': '', 'phone_number': '+61400000001'},
+            {'notification_type': 'email', 'email': 'a@example.com', 'phone_number': ''}
+        ]
+        message = dict(MESSAGE, notification_type='', email='', recipients=recipients, store_observation=False)
+        decoded = decode_message(encode_message(message))
+
+        self.assertEqual(recipients, decoded['recipients'])
+        self.assertFalse(decoded['store_observation'])
+        self.assertNotIn('recipients', decode_message(encode_message(MESSAGE)))
+        # Recipients are part of the key, messages without them keep their existing key
+        self.assertNotEqual(message_key(message), message_key(dict(message, recipients=recipients[:1])))
+        self.assertEqual(message_key(MESSAGE), message_key(dict(MESSAGE, recipients=[])))
+
+    def test_large_messages_are_compressed(self):
+        message = dict(MESSAGE, data={'list': [{'description': 'light rain', 'temp': 280}] * 200})
+
+        for compression in ('zlib', 'gzip'):
+            body = encode_message(message, compression=compression, compression_threshold=1024)
+            envelope = json.loads(body)
+            self.assertEqual(compression, envelope['encoding'])
+            self.assertLess(len(body), len(json.dumps(message)) / 5)
+            self.assertEqual(message['data'], decode_message(body)['data'])
+
+    def test_original_format_is_still_accepted(self):
+        self.assertEqual(MESSAGE, decode_message(json.dumps(MESSAGE)))
+
+    def test_newer_versions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_message(json.dumps({'v': 3, 'city_name': 'London'}))
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_claim_check_round_trip(self, mock_boto3_client):
+        mock_s3_client = MagicMock()
+        mock_boto3_client.return_value = mock_s3_client
+
+        data_ref = store_payload('test-weather-bucket', MESSAGE['data'])
+        store_payload('test-weather-bucket', MESSAGE['data'])
+        mock_s3_client.put_object.assert_called_once()
+
+        stored_body = mock_s3_client.put_object.call_args.kwargs['Body']
+        mock_s3_client.get_object.return_value = {'Body': MagicMock(read=MagicMock(return_value=stored_body))}
+        body = encode_message(MESSAGE, data_ref=data_ref)
+
+        self.assertEqual(MESSAGE['data'], decode_message(body, load_data=load_payload)['data'])
+        self.assertEqual(MESSAGE['data'], decode_message(body, load_data=load_payload)['data'])
+        mock_s3_client.get_object.assert_called_once_with(Bucket='test-weather-bucket', Key=data_ref['key'])
+
+    def test_claim_check_needs_a_loader(self):
+        body = encode_message(MESSAGE, data_ref={'bucket': 'b', 'key': 'k'})
+
+        with self.assertRaises(ValueError):
+            decode_message(body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import io
+import json
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from ..common import aws_clients, metrics
+from ..weather_fetcher.lambda_function import lambda_handler, circuit_breaker, response_cache, secret_cache
+
+
+class TestInvocationMetrics(unittest.TestCase):
+
+    def test_record_is_embedded_metric_format(self):
+        invocation = metrics.InvocationMetrics('weather-fetcher', namespace='Test', clock=lambda: 1700000000.5)
+        invocation.record('UpstreamCall', 12.5)
+        invocation.record('UpstreamCall', 7.0)
+        invocation.count('CacheHits')
+        invocation.count('CacheHits', 2)
+        invocation.set_property('Mode', 'batch')
+
+        record = invocation.to_record()
+
+        self.assertEqual('weather-fetcher', record['FunctionName'])
+        self.assertEqual('batch', record['Mode'])
+        self.assertEqual([12.5, 7.0], record['UpstreamCall'])
+        self.assertEqual(3, record['CacheHits'])
+        self.assertIn('Duration', record)
+        self.assertEqual(1700000000500, record['_aws']['Timestamp'])
+        directive = record['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual('Test', directive['Namespace'])
+        self.assertEqual([['FunctionName']], directive['Dimensions'])
+        self.assertIn({'Name': 'UpstreamCall', 'Unit': 'Milliseconds'}, directive['Metrics'])
+        self.assertIn({'Name': 'CacheHits', 'Unit': 'Count'}, directive['Metrics'])
+
+    def test_values_are_capped(self):
+        invocation = metrics.InvocationMetrics('weather-processor')
+        for value in range(metrics.MAX_VALUES + 5):
+            invocation.record('S3Put', value)
+        self.assertEqual(metrics.MAX_VALUES, len(invocation.values('S3Put')))
+
+    def test_timer_records_milliseconds(self):
+        invocation = metrics.InvocationMetrics('weather-processor')
+        with invocation.timer('SnsPublish'):
+            pass
+        self.assertEqual(1, len(invocation.values('SnsPublish')))
+        self.assertGreaterEqual(invocation.values('SnsPublish')[0], 0)
+
+
+class TestInvocationLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        self.records = []
+        metrics.set_sink(self.records.append)
+        self.addCleanup(metrics.set_sink, None)
+
+    def test_one_record_per_invocation(self):
+        @metrics.instrumented('weather-fetcher')
+        def handler(event, context):
+            metrics.count('MessagesQueued', event['messages'])
+            return 'done'
+
+        self.assertEqual('done', handler({'messages': 3}, None))
+        self.assertEqual('done', handler({'messages': 1}, None))
+
+        self.assertEqual([3, 1], [record['MessagesQueued'] for record in self.records])
+        self.assertEqual(['weather-fetcher'] * 2, [record['FunctionName'] for record in self.records])
+
+    def test_function_name_comes_from_the_context(self):
+        context = MagicMock()
+        context.function_name = 'weather-fetcher-prod'
+        metrics.instrumented('weather-fetcher')(lambda event, context: None)({}, context)
+        self.assertEqual('weather-fetcher-prod', self.records[0]['FunctionName'])
+
+    def test_record_is_written_when_the_handler_raises(self):
+        @metrics.instrumented('weather-processor')
+        def handler(event, context):
+            metrics.count('RecordsFailed')
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            handler({}, None)
+        self.assertEqual(1, self.records[0]['RecordsFailed'])
+
+    def test_worker_threads_record_into_their_invocation(self):
+        metrics.begin('weather-processor')
+        worker = threading.Thread(target=metrics.bound(lambda: metrics.record('S3Put', 1.0)))
+        worker.start()
+        worker.join()
+        record = metrics.end()
+        self.assertEqual(1.0, record['S3Put'])
+
+    def test_nothing_is_collected_outside_an_invocation(self):
+        metrics.count('CacheHits')
+        with metrics.timer('SecretFetch'):
+            pass
+        self.assertIsNone(metrics.end())
+        self.assertEqual([], self.records)
+
+    @patch.dict('os.environ', {'METRICS_ENABLED': 'false'})
+    def test_disabled_metrics_write_nothing(self):
+        metrics.instrumented('weather-fetcher')(lambda event, context: metrics.count('CacheHits'))({}, None)
+        self.assertEqual([], self.records)
+
+    def test_records_go_to_stdout_as_json_lines(self):
+        metrics.set_sink(None)
+        metrics.begin('weather-fetcher')
+        metrics.count('CacheHits')
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            metrics.end()
+        line, = stdout.getvalue().splitlines()
+        self.assertEqual(1, json.loads(line)['CacheHits'])
+
+
+class TestFetcherMetrics(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+        secret_cache.clear()
+        response_cache.clear()
+        circuit_breaker.reset()
+        self.records = []
+        metrics.set_sink(self.records.append)
+        self.addCleanup(metrics.set_sink, None)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    @patch('requests.Session.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com'
+    })
+    def test_stages_of_the_fetcher_are_timed(self, mock_requests_get, mock_boto3_client):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+        event = {'city_name': 'TestCity', 'country_code': 'TC', 'notification_type': 'email', 'email': 'a@example.com'}
+
+        lambda_handler(event, None)
+        lambda_handler(event, None)
+
+        first, second = self.records
+        for stage in ('SecretFetch', 'UpstreamCall', 'SqsSend', 'Duration'):
+            self.assertIsInstance(first[stage], float, stage)
+        self.assertEqual(1, first['CacheMisses'])
+        self.assertEqual(0, first['UpstreamRetries'])
+        self.assertEqual('single', first['Mode'])
+        # The second invocation is answered by the response cache
+        self.assertEqual(1, second['CacheHits'])
+        self.assertNotIn('UpstreamCall', second)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    @patch('requests.Session.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com'
+    })
+    def test_secret_cache_hits_and_misses_are_counted(self, mock_requests_get, mock_boto3_client):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+
+        lambda_handler({'city_name': 'FirstCity', 'country_code': 'TC'}, None)
+        lambda_handler({'city_name': 'SecondCity', 'country_code': 'TC'}, None)
+
+        first, second = self.records
+        self.assertEqual(1, first['SecretCacheMiss'])
+        self.assertNotIn('SecretCacheHit', first)
+        self.assertEqual(1, second['SecretCacheHit'])
+        self.assertNotIn('SecretCacheMiss', second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import json
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from ..weather_processor.notifications import Notification, NotificationDispatcher, build_notifications
+
+TOPIC_ARN = 'arn:aws:sns:region:account-id:weather-topic'
+
+
+class TestNotifications(unittest.TestCase):
+
+    def setUp(self):
+        self.sns_client = MagicMock()
+        self.subscription_index = MagicMock()
+
+    def test_build_notifications(self):
+        weather_body = {
+            'notification_type': 'both',
+            'data': {'weather': [{'description': 'Cloudy'}]},
+            'city_name': 'TestCity',
+            'phone_number': '+1234567890',
+            'email': 'test@example.com'
+        }
+
+        self.assertEqual([
+            Notification('sms', '+1234567890', 'TestCity', 'Cloudy'),
+            Notification('email', 'test@example.com', 'TestCity', 'Cloudy')
+        ], build_notifications(weather_body))
+        self.assertEqual([], build_notifications(dict(weather_body, notification_type='')))
+
+    def test_build_notifications_for_recipients(self):
+        weather_body = {
+            'notification_type': '',
+            'data': {'weather': [{'description': 'Cloudy'}]},
+            'city_name': 'TestCity',
+            'recipients': [
+                {'notification_type': 'sms', 'phone_number': '+1234567890', 'email': ''},
+                {'notification_type': 'email', 'phone_number': '', 'email': 'test@example.com'}
+            ]
+        }
+
+        self.assertEqual([
+            Notification('sms', '+1234567890', 'TestCity', 'Cloudy'),
+            Notification('email', 'test@example.com', 'TestCity', 'Cloudy')
+        ], build_notifications(weather_body))
+
+    def test_duplicates_are_sent_once(self):
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index)
+        dispatcher.add(Notification('email', 'test@example.com', 'London', 'Rain'), 'message-1')
+        dispatcher.add(Notification('email', 'test@example.com', 'London', 'Rain'), 'message-2')
+        dispatcher.add(Notification('sms', '+1234567890', 'London', 'Rain'), 'message-2')
+
+        outcomes = dispatcher.dispatch()
+
+        self.assertEqual(2, self.sns_client.publish.call_count)
+        self.assertEqual(['message-1', 'message-2'], outcomes[0]['message_ids'])
+        self.assertEqual(['sent', 'sent'], [outcome['status'] for outcome in outcomes])
+        self.assertEqual([], dispatcher.dispatch())
+
+    def test_sms_goes_to_its_phone_number_and_email_to_its_filtered_subscription(self):
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index)
+        dispatcher.add(Notification('sms', '+1234567890', 'London', 'Rain'))
+        dispatcher.add(Notification('email', 'test@example.com', 'London', 'Rain'))
+
+        dispatcher.dispatch()
+
+        sms, email = [call.kwargs for call in self.sns_client.publish.call_args_list]
+        self.assertEqual('+1234567890', sms['PhoneNumber'])
+        self.assertNotIn('TopicArn', sms)
+        self.assertEqual(TOPIC_ARN, email['TopicArn'])
+        self.assertEqual('test@example.com', email['MessageAttributes']['email']['StringValue'])
+        # Only the email address is subscribed, with a filter policy matching its own messages
+        self.subscription_index.ensure_subscribed.assert_called_once_with(
+            self.sns_client, TOPIC_ARN, 'email', 'test@example.com',
+            attributes={'FilterPolicy': json.dumps({'email': ['test@example.com']})}
+        )
+
+    def test_sends_run_in_parallel(self):
+        # Every publish waits for the others, which only completes when they run concurrently
+        barrier = threading.Barrier(4, timeout=5)
+        self.sns_client.publish.side_effect = lambda **kwargs: barrier.wait()
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index, max_workers=4)
+        for index in range(4):
+            dispatcher.add(Notification('email', f'user{index}@example.com', 'London', 'Rain'))
+
+        outcomes = dispatcher.dispatch()
+
+        self.assertEqual(['sent'] * 4, [outcome['status'] for outcome in outcomes])
+
+    def test_failed_send_is_reported_per_recipient(self):
+        def publish(**kwargs):
+            if 'Subject' not in kwargs:
+                raise Exception('SMS quota exceeded')
+        self.sns_client.publish.side_effect = publish
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index, max_workers=1)
+        dispatcher.add(Notification('sms', '+1234567890', 'London', 'Rain'), 'message-1')
+        dispatcher.add(Notification('email', 'test@example.com', 'London', 'Rain'), 'message-2')
+
+        outcomes = dispatcher.dispatch()
+
+        self.assertEqual('failed', outcomes[0]['status'])
+        self.assertEqual('SMS quota exceeded', outcomes[0]['error'])
+        self.assertEqual('sent', outcomes[1]['status'])
+
+    def test_publish_batch(self):
+        self.sns_client.publish_batch.side_effect = lambda TopicArn, PublishBatchRequestEntries: {
+            'Successful': [{'Id': entry['Id']} for entry in PublishBatchRequestEntries[1:]],
+            'Failed': [{'Id': PublishBatchRequestEntries[0]['Id'], 'Code': 'InternalError', 'Message': 'try again'}]
+        }
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index, publish_batch=True)
+        for index in range(12):
+            dispatcher.add(Notification('email', f'user{index}@example.com', 'London', 'Rain'), f'message-{index}')
+
+        outcomes = dispatcher.dispatch()
+
+        self.sns_client.publish.assert_not_called()
+        self.assertEqual(2, self.sns_client.publish_batch.call_count)
+        self.assertEqual(12, self.subscription_index.ensure_subscribed.call_count)
+        # Batches are published in parallel, in any order
+        batches = sorted(
+            (call.kwargs['PublishBatchRequestEntries'] for call in self.sns_client.publish_batch.call_args_list), key=len
+        )
+        self.assertEqual([2, 10], [len(batch) for batch in batches])
+        self.assertEqual('Weather condition for London', batches[1][0]['Subject'])
+        failed = [outcome['endpoint'] for outcome in outcomes if outcome['status'] == 'failed']
+        self.assertEqual(2, len(failed))
+
+    def test_publish_batch_sends_sms_to_their_phone_number(self):
+        self.sns_client.publish_batch.side_effect = lambda TopicArn, PublishBatchRequestEntries: {
+            'Successful': [{'Id': entry['Id']} for entry in PublishBatchRequestEntries],
+            'Failed': []
+        }
+        dispatcher = NotificationDispatcher(self.sns_client, TOPIC_ARN, self.subscription_index, publish_batch=True)
+        dispatcher.add(Notification('sms', '+1234567890', 'London', 'Rain'))
+        dispatcher.add(Notification('email', 'test@example.com', 'London', 'Rain'))
+
+        outcomes = dispatcher.dispatch()
+
+        self.assertEqual(['sent', 'sent'], [outcome['status'] for outcome in outcomes])
+        self.sns_client.publish.assert_called_once()
+        self.assertEqual('+1234567890', self.sns_client.publish.call_args.kwargs['PhoneNumber'])
+        entries = self.sns_client.publish_batch.call_args.kwargs['PublishBatchRequestEntries']
+        self.assertEqual(['Weather condition for London'], [entry['Subject'] for entry in entries])
+
+
+if __name__ == '__main__':
+    unittest.main()
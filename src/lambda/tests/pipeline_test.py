@@ -0,0 +1,232 @@
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+
+from ..harness.fakes import FakeAWS, FakeServiceError
+from ..harness.pipeline import LocalPipeline, latency_summary, sample_requests
+from ..harness.weather_server import FakeWeatherServer
+from ..weather_processor.change_detection import ChangeDetector
+from ..weather_processor.rules import Rule
+
+
+class TestLocalPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = LocalPipeline(batch_size=5).start()
+        self.addCleanup(self.pipeline.stop)
+
+    def test_requests_flow_from_the_fetcher_to_s3_and_sns(self):
+        report = self.pipeline.run(sample_requests(12, cities=3), concurrency=4)
+
+        self.assertEqual(12, report['messages_sent'])
+        self.assertEqual(12, report['messages_processed'])
+        self.assertEqual(0, report['failed_requests'])
+        self.assertEqual(0, report['dead_lettered'])
+        # Each distinct city is fetched once, later requests are served from the response cache
+        self.assertEqual(3, report['weather_api']['requests'])
+        self.assertEqual(12, report['aws_calls']['sqs.send_message'])
+        self.assertEqual(12, report['notifications'])
+        self.assertEqual(12, report['latency_ms']['request_to_processed']['count'])
+        self.assertLessEqual(max(self.pipeline.batch_sizes), 5)
+
+        observations = self.pipeline.stored_observations()
+        self.assertEqual(12, len(observations))
+        self.assertEqual({'City0000', 'City0001', 'City0002'}, {observation['name'] for observation in observations})
+        recipients = {
+            message['MessageAttributes']['email']['StringValue'] for message in self.pipeline.aws.sns.published
+        }
+        self.assertEqual({f"user{index}@example.com" for index in range(12)}, recipients)
+
+    def test_report_summarizes_the_emf_metrics_of_the_handlers(self):
+        report = self.pipeline.run(sample_requests(6, cities=2), concurrency=2)
+
+        fetcher = report['metrics']['weather-fetcher']
+        self.assertEqual(2, fetcher['UpstreamCall']['count'])
+        self.assertEqual(6, fetcher['SqsSend']['count'])
+        self.assertEqual(6, fetcher['Duration']['count'])
+        self.assertEqual(6, fetcher.get('CacheHits', 0) + fetcher.get('CacheCoalesced', 0) + fetcher['CacheMisses'])
+        processor = report['metrics']['weather-processor']
+        self.assertEqual(6, processor['BatchSize'])
+        self.assertEqual(6, processor['NotificationsSent'])
+        self.assertEqual(6, processor['SnsPublish']['count'])
+        self.assertEqual(6, processor['ObservationsStored'])
+
+    def test_trace_of_a_request_reaches_s3_and_sns(self):
+        trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+        request = sample_requests(1, cities=1, notification_type='sms')[0]
+        request['headers'] = {'traceparent': f"00-{trace_id}-00f067aa0ba902b7-01"}
+        self.pipeline.submit(request)
+
+        record, = self.pipeline.aws.sqs.receive_records(self.pipeline.queue_url, max_messages=10)
+        self.assertIn(trace_id, record['messageAttributes']['traceparent']['stringValue'])
+        self.pipeline.aws.sqs.release(self.pipeline.queue_url, record['receiptHandle'])
+        self.pipeline.drain()
+
+        key, = self.pipeline.aws.s3.keys('weather-bucket', 'weather-data/')
+        metadata = self.pipeline.aws.s3.get_object(Bucket='weather-bucket', Key=key)['Metadata']
+        self.assertEqual({'trace-ids': trace_id, 'trace-count': '1'}, metadata)
+        published, = self.pipeline.aws.sns.published
+        self.assertIn(trace_id, published['MessageAttributes']['traceparent']['StringValue'])
+        self.assertIn('request_time', published['MessageAttributes'])
+
+        spans = [span for span in self.pipeline.spans if span['trace_id'] == trace_id]
+        self.assertEqual(
+            {'weather-fetcher', 'weather-api.get', 'sqs.send_message', 'weather-processor.record', 's3.put_object', 'sns.publish'},
+            {span['name'] for span in spans}
+        )
+        record_span, = [span for span in spans if span['name'] == 'weather-processor.record']
+        self.assertGreaterEqual(record_span['attributes']['queue_dwell_ms'], 0)
+        processor_record = [r for r in self.pipeline.metric_records if r['FunctionName'] == 'weather-processor'][-1]
+        self.assertEqual([trace_id], processor_record['TraceIds'])
+        self.assertIn('RequestToNotification', processor_record)
+        self.assertEqual(1, self.pipeline.trace_summary()['notified_traces'])
+
+    def test_only_alert_rules_that_fire_are_notified(self):
+        self.pipeline.add_alert_rules([
+            Rule.from_dict({
+                'city_name': 'City0000', 'country_code': 'AU', 'field': 'temp', 'operator': 'above', 'value': -100,
+                'channel': 'sms', 'endpoint': '+61499999999'
+            }),
+            Rule.from_dict({
+                'city_name': 'City0001', 'country_code': 'AU', 'field': 'temp', 'operator': 'above', 'value': 100,
+                'channel': 'sms', 'endpoint': '+61499999998'
+            })
+        ])
+
+        with patch.dict('os.environ', {'NOTIFICATION_MODE': 'rules'}):
+            report = self.pipeline.run(sample_requests(10, cities=2), concurrency=2)
+
+        # Every observation is stored, the rule of City0000 fires once for the observation shared by its requests
+        self.assertEqual(10, len(self.pipeline.stored_observations()))
+        published, = self.pipeline.aws.sns.published
+        self.assertTrue(published['Message'].startswith('Weather condition for City0000 - temp above -100°C'))
+        self.assertEqual(1, report['metrics']['weather-processor']['RulesFired'])
+        self.assertEqual(10, report['metrics']['weather-processor']['RuleEvaluation']['count'])
+
+    def test_unchanged_observations_are_not_notified_or_stored_again(self):
+        self.now = 1700000000
+        pipeline = LocalPipeline(weather_server=FakeWeatherServer(clock=lambda: self.now), batch_size=5).start()
+        self.addCleanup(pipeline.stop)
+        detector = ChangeDetector(skip_unchanged_storage=True)
+        with patch.object(pipeline.processor, 'change_detector', detector):
+            first = pipeline.run(sample_requests(10, cities=2), concurrency=2)
+            # An hour later the same requests get new observations saying the same
+            self.now += 3600
+            pipeline.fetcher.response_cache.clear()
+            second = pipeline.run(sample_requests(10, cities=2), concurrency=2)
+
+        self.assertEqual(10, first['messages_processed'])
+        self.assertEqual(10, second['messages_processed'])
+        self.assertEqual(10, len(pipeline.aws.sns.published))
+        self.assertEqual(10, second['metrics']['weather-processor']['NotificationsUnchanged'])
+        # One object per city, the later observations of a city are identical
+        self.assertEqual(2, len(pipeline.stored_observations()))
+        self.assertEqual(8, first['metrics']['weather-processor']['ObservationsUnchanged'])
+        self.assertEqual(10, second['metrics']['weather-processor']['ObservationsUnchanged'])
+
+    def test_records_are_shaped_like_event_source_mapping_records(self):
+        self.pipeline.submit({'city_name': 'Sydney', 'country_code': 'AU', 'notification_type': 'sms', 'phone_number': '+61400000000'})
+
+        records = self.pipeline.aws.sqs.receive_records(self.pipeline.queue_url)
+
+        self.assertEqual(1, len(records))
+        record = records[0]
+        self.assertEqual('aws:sqs', record['eventSource'])
+        self.assertEqual('1', record['attributes']['ApproximateReceiveCount'])
+        self.assertIn('SentTimestamp', record['attributes'])
+        self.assertTrue(record['eventSourceARN'].endswith(':weather-queue'))
+
+    def test_failed_messages_are_redelivered_then_dead_lettered(self):
+        self.pipeline.submit({'city_name': 'Sydney', 'country_code': 'AU', 'notification_type': 'email', 'email': 'a@example.com'})
+
+        with patch.object(self.pipeline.aws.s3, 'put_object', side_effect=FakeServiceError('SlowDown', 'Please reduce your request rate')):
+            self.pipeline.drain()
+
+        self.assertEqual(3, self.pipeline.batches)
+        self.assertEqual(0, self.pipeline.processed)
+        self.assertEqual(1, self.pipeline.aws.sqs.depth(self.pipeline.dead_letter_queue_url))
+        self.assertEqual(0, self.pipeline.aws.sqs.depth(self.pipeline.queue_url))
+        self.assertTrue(all(
+            message['Subject'] == 'Weather Processing Error' for message in self.pipeline.aws.sns.published
+        ))
+
+    def test_queued_messages_are_decoded(self):
+        self.pipeline.submit({'city_name': 'Perth', 'country_code': 'AU', 'notification_type': 'email', 'email': 'a@example.com'})
+
+        messages = self.pipeline.queued_messages()
+
+        self.assertEqual(1, len(messages))
+        self.assertEqual('Perth', messages[0]['city_name'])
+        self.assertEqual('Perth', messages[0]['data']['name'])
+
+
+class TestFakeWeatherServer(unittest.TestCase):
+
+    def test_error_and_throttle_rates(self):
+        server = FakeWeatherServer(error_rate=0.5, throttle_rate=0.25, seed=7)
+        statuses = [server.answer('/data/2.5/weather', {'q': ['Sydney,AU'], 'appid': [server.api_key]})[0] for _ in range(400)]
+
+        self.assertEqual(400, server.requests)
+        self.assertEqual(server.throttled, statuses.count(429))
+        self.assertEqual(server.errors, statuses.count(500))
+        self.assertAlmostEqual(0.25, server.throttled / 400, delta=0.07)
+        self.assertAlmostEqual(0.5, server.errors / 400, delta=0.07)
+
+    def test_unknown_api_key_is_rejected(self):
+        server = FakeWeatherServer()
+
+        status, _, document = server.answer('/data/2.5/weather', {'q': ['Sydney,AU'], 'appid': ['wrong']})
+
+        self.assertEqual(401, status)
+        self.assertEqual('Invalid API key.', document['message'])
+
+
+class TestFakeAWS(unittest.TestCase):
+
+    def test_batching_window_waits_for_a_full_batch(self):
+        aws = FakeAWS()
+        queue_url = aws.sqs.create_queue(QueueName='queue')['QueueUrl']
+        aws.sqs.send_message_batch(QueueUrl=queue_url, Entries=[
+            {'Id': str(index), 'MessageBody': f"message {index}"} for index in range(3)
+        ])
+
+        self.assertEqual(3, len(aws.sqs.receive_records(queue_url, max_messages=10, batching_window=0.01)))
+        self.assertEqual([], aws.sqs.receive_records(queue_url, max_messages=10))
+        self.assertEqual(3, aws.sqs.in_flight())
+
+    def test_oversized_messages_are_rejected(self):
+        aws = FakeAWS()
+        queue_url = aws.sqs.create_queue(QueueName='queue')['QueueUrl']
+
+        with self.assertRaises(FakeServiceError):
+            aws.sqs.send_message(QueueUrl=queue_url, MessageBody='x' * 262145)
+
+    def test_s3_objects_round_trip_with_their_encoding(self):
+        aws = FakeAWS()
+        aws.s3.put_object(Bucket='bucket', Key='a/b.json.gz', Body=gzip.compress(b'{}'), ContentEncoding='gzip')
+
+        response = aws.client('s3').get_object(Bucket='bucket', Key='a/b.json.gz')
+
+        self.assertEqual('gzip', response['ContentEncoding'])
+        self.assertEqual({}, json.loads(gzip.decompress(response['Body'].read())))
+        self.assertEqual(['a/b.json.gz'], aws.s3.keys('bucket', 'a/'))
+        self.assertEqual({'s3.get_object': 1, 's3.put_object': 1}, aws.calls())
+        with self.assertRaises(FakeServiceError):
+            aws.s3.get_object(Bucket='bucket', Key='missing')
+
+
+class TestLatencySummary(unittest.TestCase):
+
+    def test_percentiles_are_interpolated(self):
+        summary = latency_summary(range(1, 101))
+
+        self.assertEqual(100, summary['count'])
+        self.assertEqual(50.5, summary['p50'])
+        self.assertEqual(99.01, summary['p99'])
+        self.assertEqual(100, summary['max'])
+        self.assertEqual({'count': 0}, latency_summary([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
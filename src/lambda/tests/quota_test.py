@@ -0,0 +1,139 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from ..common import aws_clients
+from ..benchmarks.cold_start import build_package
+from ..authorizer.quota import (DynamoDBQuotaCounter, MemoryQuotaCounter, QuotaLimiter, QuotaTier,
+                                parse_tiers, quota_counter_from_url)
+
+TIERS = {
+    'standard': QuotaTier(rate=1.0, burst=2),
+    'premium': QuotaTier(rate=10.0, burst=20),
+    'internal': QuotaTier(rate=None, burst=0)
+}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class TestQuotaLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.counter = MemoryQuotaCounter(clock=lambda: self.now)
+        self.limiter = QuotaLimiter(TIERS, self.counter, principal_tiers={'vip': 'premium', 'ops': 'internal'})
+
+    def test_burst_then_throttle_then_refill(self):
+        self.assertTrue(self.limiter.check('alice').allowed)
+        self.assertTrue(self.limiter.check('alice').allowed)
+
+        decision = self.limiter.check('alice')
+        self.assertFalse(decision.allowed)
+        self.assertEqual('standard', decision.tier)
+        self.assertAlmostEqual(1.0, decision.retry_after)
+
+        self.now += 1
+        self.assertTrue(self.limiter.check('alice').allowed)
+        self.assertEqual(1, self.limiter.throttled)
+
+    def test_principals_have_separate_buckets_and_tiers(self):
+        for _ in range(2):
+            self.limiter.check('alice')
+
+        self.assertFalse(self.limiter.check('alice').allowed)
+        self.assertTrue(self.limiter.check('bob').allowed)
+        self.assertTrue(all(self.limiter.check('vip').allowed for _ in range(20)))
+        self.assertTrue(all(self.limiter.check('ops').allowed for _ in range(100)))
+
+    def test_tier_without_refill_denies_after_its_burst(self):
+        limiter = QuotaLimiter({'standard': QuotaTier(rate=0.0, burst=2)}, self.counter)
+
+        decisions = [limiter.check('alice') for _ in range(5)]
+
+        self.assertEqual([True, True, False, False, False], [decision.allowed for decision in decisions])
+        self.assertEqual(3600, decisions[-1].retry_after)
+        self.now += 60
+        self.assertFalse(limiter.check('alice').allowed)
+        self.now += 3600
+        self.assertTrue(limiter.check('alice').allowed)
+
+    def test_counter_failure_allows_the_request(self):
+        counter = MagicMock()
+        counter.consume.side_effect = Exception('Counter unavailable')
+
+        self.assertTrue(QuotaLimiter(TIERS, counter).check('alice').allowed)
+
+    def test_parse_tiers(self):
+        tiers = parse_tiers('{"standard": {"rate": 0.5, "burst": 10}, "internal": {"rate": null}}')
+
+        self.assertEqual(QuotaTier(0.5, 10), tiers['standard'])
+        self.assertIsNone(tiers['internal'].rate)
+
+
+class TestQuotaCounters(unittest.TestCase):
+
+    def test_file_counter_is_shared_between_instances(self):
+        directory = tempfile.mkdtemp()
+        try:
+            tier = QuotaTier(rate=0.001, burst=2)
+            first = quota_counter_from_url(f"file://{directory}")
+            second = quota_counter_from_url(f"file://{directory}")
+
+            self.assertTrue(first.consume('alice', tier)[0])
+            self.assertTrue(second.consume('alice', tier)[0])
+            self.assertFalse(first.consume('alice', tier)[0])
+        finally:
+            shutil.rmtree(directory)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_dynamodb_counter_retries_concurrent_updates(self, mock_boto3_client):
+        aws_clients.reset()
+        dynamodb = MagicMock()
+        dynamodb.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        mock_boto3_client.return_value = dynamodb
+        dynamodb.get_item.side_effect = [
+            {},
+            {'Item': {'tokens': {'N': '1.0'}, 'updated_at': {'N': '1000.0'}}}
+        ]
+        dynamodb.put_item.side_effect = [ConditionalCheckFailedException(), {}]
+        counter = DynamoDBQuotaCounter('quota-table', clock=lambda: 1000.0)
+
+        allowed, remaining, _ = counter.consume('alice', QuotaTier(rate=1.0, burst=2))
+
+        self.assertTrue(allowed)
+        self.assertEqual(0.0, remaining)
+        last_put = dynamodb.put_item.call_args.kwargs
+        self.assertEqual('updated_at = :updated_at', last_put['ConditionExpression'])
+        self.assertEqual({'S': 'quota:alice'}, last_put['Item']['key'])
+        aws_clients.reset()
+
+
+
+class TestAuthorizerImports(unittest.TestCase):
+
+    def test_boto3_is_only_loaded_for_a_dynamodb_store(self):
+        package_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, package_dir)
+        build_package('authorizer', os.path.join(package_dir, 'authorizer'))
+        probe = (
+            "import sys, lambda_function, quota; loaded = 'boto3' in sys.modules; "
+            "quota.quota_counter_from_url('dynamodb://quotas'); print(loaded, 'boto3' in sys.modules)"
+        )
+        env = {key: value for key, value in os.environ.items() if key not in ('PYTHONPATH', 'QUOTA_STORE')}
+
+        completed = subprocess.run(
+            [sys.executable, '-c', probe], cwd=os.path.join(package_dir, 'authorizer'), env=env,
+            capture_output=True, text=True, check=True
+        )
+
+        self.assertEqual('False True', completed.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
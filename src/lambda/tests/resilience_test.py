@@ -0,0 +1,192 @@
+import unittest
+from unittest.mock import MagicMock
+from email.utils import formatdate
+import time
+
+from ..weather_fetcher.resilience import TokenBucket, RetryBudget, RetryPolicy, CircuitBreaker, parse_retry_after
+
+
+def response(status_code, retry_after=None):
+    mock_response = MagicMock()
+    mock_response.status_code = status_code
+    mock_response.headers = {} if retry_after is None else {'Retry-After': retry_after}
+    return mock_response
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        self.bucket = TokenBucket(rate=2, capacity=2, clock=lambda: self.now, sleep=sleep)
+
+    def test_burst_then_rate(self):
+        self.assertTrue(self.bucket.acquire())
+        self.assertTrue(self.bucket.acquire())
+        self.assertFalse(self.bucket.acquire())
+        self.assertEqual(1, self.bucket.throttled)
+
+        self.now += 0.5
+        self.assertTrue(self.bucket.acquire())
+
+    def test_acquire_waits_up_to_max_wait(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+
+        self.assertTrue(self.bucket.acquire(max_wait=1))
+        self.assertEqual([0.5], self.sleeps)
+        self.assertFalse(self.bucket.acquire(max_wait=0.1))
+
+    def test_reset_refills_the_bucket(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.assertFalse(self.bucket.acquire())
+
+        self.bucket.reset()
+
+        self.assertEqual(0, self.bucket.throttled)
+        self.assertTrue(self.bucket.acquire())
+        self.assertTrue(self.bucket.acquire())
+
+    def test_zero_rate_is_unlimited(self):
+        bucket = TokenBucket(rate=0, capacity=0)
+        self.assertTrue(all(bucket.acquire() for _ in range(100)))
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+
+    def policy(self, **kwargs):
+        return RetryPolicy(sleep=self.sleeps.append, jitter=lambda: 1.0, **kwargs)
+
+    def test_retries_5xx_with_exponential_backoff(self):
+        send = MagicMock(side_effect=[response(503), response(502), response(200)])
+
+        result = self.policy(max_retries=2, base_delay=0.1).execute(send)
+
+        self.assertEqual(200, result.status_code)
+        self.assertEqual([0.1, 0.2], self.sleeps)
+
+    def test_gives_up_after_max_retries(self):
+        send = MagicMock(return_value=response(500))
+
+        result = self.policy(max_retries=2).execute(send)
+
+        self.assertEqual(500, result.status_code)
+        self.assertEqual(3, send.call_count)
+
+    def test_client_errors_are_not_retried(self):
+        send = MagicMock(return_value=response(404))
+
+        self.policy().execute(send)
+
+        send.assert_called_once()
+
+    def test_retry_after_is_honored(self):
+        send = MagicMock(side_effect=[response(429, '2'), response(200)])
+
+        self.policy(max_delay=5).execute(send)
+
+        self.assertEqual([2.0], self.sleeps)
+
+    def test_retry_after_longer_than_max_delay_is_not_waited(self):
+        send = MagicMock(return_value=response(429, '60'))
+
+        result = self.policy(max_delay=5).execute(send)
+
+        self.assertEqual(429, result.status_code)
+        send.assert_called_once()
+        self.assertEqual([], self.sleeps)
+
+    def test_retry_budget_limits_retries(self):
+        budget = RetryBudget(ratio=0.5, min_tokens=1)
+        policy = self.policy(max_retries=3, budget=budget)
+
+        policy.execute(MagicMock(return_value=response(503)))
+
+        # The budget started with one token and the call deposited half of one
+        self.assertEqual(1, policy.retries)
+        self.assertEqual(1, budget.exhausted)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, slow_call_seconds=1, clock=lambda: self.now)
+
+    def open_breaker(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(True, 0.1)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record(True, 0.1)
+        self.breaker.record(False, 0.1)
+        self.breaker.record(True, 0.1)
+        self.assertEqual('closed', self.breaker.state)
+
+        self.breaker.record(True, 0.1)
+        self.assertEqual('open', self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(1, self.breaker.rejected)
+
+    def test_slow_calls_count_as_failures(self):
+        self.breaker.record(False, 2)
+        self.breaker.record(False, 2)
+
+        self.assertEqual('open', self.breaker.state)
+
+    def test_half_open_allows_one_trial(self):
+        self.open_breaker()
+        self.now = 30
+
+        self.assertEqual('half_open', self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record(False, 0.1)
+        self.assertEqual('closed', self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+
+    def test_released_trial_keeps_the_circuit_half_open(self):
+        self.open_breaker()
+        self.now = 30
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.release()
+
+        self.assertEqual('half_open', self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_failed_trial_opens_again(self):
+        self.open_breaker()
+        self.now = 30
+        self.breaker.allow()
+
+        self.breaker.record(True, 0.1)
+
+        self.assertEqual('open', self.breaker.state)
+        self.now = 59
+        self.assertFalse(self.breaker.allow())
+
+
+class TestParseRetryAfter(unittest.TestCase):
+
+    def test_seconds_and_http_date(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertEqual(3.0, parse_retry_after('3'))
+        self.assertAlmostEqual(30, parse_retry_after(formatdate(time.time() + 30, usegmt=True)), delta=2)
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
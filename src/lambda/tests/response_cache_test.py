@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import MagicMock
+
+from ..common.stores import MemoryStore
+from ..weather_fetcher.response_cache import ResponseCache, normalize_city_key
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.clock = lambda: self.now
+
+    def test_normalize_city_key(self):
+        self.assertEqual('london,uk', normalize_city_key('London', 'UK'))
+        self.assertEqual('new york,us', normalize_city_key('  New   York ', ' us '))
+
+    def test_local_tier_hit(self):
+        cache = ResponseCache(ttl_seconds=60)
+        self.assertEqual((None, 'miss'), cache.get('london,uk'))
+
+        cache.put('london,uk', {'temp': 10})
+
+        self.assertEqual(({'temp': 10}, 'hit'), cache.get('london,uk'))
+
+    def test_shared_tier_fills_local_tier(self):
+        shared_store = MemoryStore(clock=self.clock)
+        ResponseCache(ttl_seconds=60, shared_store=shared_store, clock=self.clock).put('london,uk', {'temp': 10})
+        other_container = ResponseCache(ttl_seconds=60, shared_store=shared_store, clock=self.clock)
+
+        self.assertEqual(({'temp': 10}, 'shared_hit'), other_container.get('london,uk'))
+        self.assertEqual(({'temp': 10}, 'hit'), other_container.get('london,uk'))
+        self.assertEqual(1, other_container.stats()['shared_hits'])
+
+    def test_shared_tier_entries_expire_with_their_original_age(self):
+        shared_store = MemoryStore(clock=self.clock)
+        ResponseCache(ttl_seconds=60, shared_store=shared_store, clock=self.clock).put('london,uk', {'temp': 10})
+        self.now += 61
+
+        cache = ResponseCache(ttl_seconds=60, shared_store=shared_store, clock=self.clock)
+
+        self.assertEqual((None, 'miss'), cache.get('london,uk'))
+
+    def test_failing_shared_tier_is_ignored(self):
+        shared_store = MagicMock()
+        shared_store.get.side_effect = Exception('store unavailable')
+        shared_store.put.side_effect = Exception('store unavailable')
+        cache = ResponseCache(ttl_seconds=60, shared_store=shared_store)
+
+        self.assertEqual((None, 'miss'), cache.get('london,uk'))
+        cache.put('london,uk', {'temp': 10})
+        self.assertEqual(({'temp': 10}, 'hit'), cache.get('london,uk'))
+
+    def test_zero_ttl_disables_cache(self):
+        cache = ResponseCache(ttl_seconds=0)
+        cache.put('london,uk', {'temp': 10})
+
+        self.assertEqual((None, 'miss'), cache.get('london,uk'))
+
+    def test_stale_entry_is_kept_as_fallback(self):
+        cache = ResponseCache(ttl_seconds=60, stale_seconds=600, clock=self.clock)
+        cache.put('london,uk', {'temp': 10})
+        self.now += 120
+
+        self.assertEqual((None, 'miss'), cache.get('london,uk'))
+        self.assertEqual({'temp': 10}, cache.get_stale('london,uk'))
+        self.now += 600
+        self.assertIsNone(cache.get_stale('london,uk'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+
+from ..common import aws_clients
+from ..common.stores import MemoryStore
+from ..weather_processor import lambda_function as processor
+from ..weather_processor.rule_store import DynamoDBRuleStore, FileRuleStore, MemoryRuleStore
+from ..weather_processor.rules import CityRules, Rule, RuleIndex, main, observation_fields
+
+TOPIC_ARN = 'arn:aws:sns:region:account-id:weather-topic'
+
+
+def rule(field, operator, value, endpoint='+1234567890', channel='sms', rule_id=None, city_name='London'):
+    return Rule.from_dict({
+        'rule_id': rule_id,
+        'city_name': city_name,
+        'country_code': 'uk',
+        'field': field,
+        'operator': operator,
+        'value': value,
+        'channel': channel,
+        'endpoint': endpoint
+    })
+
+
+def observation(dt, celsius=10.0, wind_ms=1.0, condition='Clouds'):
+    return {
+        'dt': dt,
+        'main': {'temp': celsius + 273.15, 'feels_like': celsius + 273.15, 'humidity': 80, 'pressure': 1012},
+        'wind': {'speed': wind_ms},
+        'weather': [{'main': condition, 'description': condition.lower()}]
+    }
+
+
+class TestRule(unittest.TestCase):
+
+    def test_observation_fields_are_converted(self):
+        fields = observation_fields(observation(1, celsius=-2.5, wind_ms=20, condition='Thunderstorm'))
+
+        self.assertEqual(fields['temp'], -2.5)
+        self.assertEqual(fields['wind'], 72.0)
+        self.assertEqual(fields['condition'], 'thunderstorm')
+        self.assertEqual(fields['humidity'], 80)
+
+    def test_invalid_rules_are_rejected(self):
+        with self.assertRaises(ValueError):
+            rule('visibility', 'below', 100)
+        with self.assertRaises(ValueError):
+            rule('condition', 'below', 1)
+        with self.assertRaises(ValueError):
+            rule('temp', 'in', 'rain')
+        with self.assertRaises(ValueError):
+            rule('temp', 'below', 0, channel='push')
+
+    def test_rule_round_trips_through_a_dict(self):
+        condition_rule = rule('condition', 'in', 'Thunderstorm, snow')
+
+        self.assertEqual(condition_rule.value, ('snow', 'thunderstorm'))
+        self.assertEqual(Rule.from_dict(condition_rule.to_dict()), condition_rule)
+        self.assertEqual(rule('temp', 'below', 0).describe(-1.5), 'temp below 0°C, now -1.5°C')
+
+
+class TestCityRules(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = [rule('temp', 'below', threshold, rule_id=f"below{threshold}") for threshold in (0, 5, 10)]
+        self.rules += [rule('temp', 'above', threshold, rule_id=f"above{threshold}") for threshold in (20, 25)]
+        self.city = CityRules(self.rules)
+
+    def ids(self, rules):
+        return sorted(matched.rule_id for matched in rules)
+
+    def test_only_crossed_thresholds_fire(self):
+        self.assertEqual(self.ids(self.city.crossed('temp', 12, 4)), ['below10', 'below5'])
+        self.assertEqual(self.ids(self.city.crossed('temp', 4, 3)), [])
+        self.assertEqual(self.ids(self.city.crossed('temp', 18, 26)), ['above20', 'above25'])
+        self.assertEqual(self.ids(self.city.crossed('temp', 4, 12)), [])
+
+    def test_value_on_a_threshold_does_not_cross_it(self):
+        self.assertEqual(self.ids(self.city.crossed('temp', 12, 10)), [])
+        self.assertEqual(self.ids(self.city.crossed('temp', 10, 9)), ['below10'])
+        self.assertEqual(self.ids(self.city.crossed('temp', 20, 21)), ['above20'])
+
+    def test_every_holding_rule_fires_without_a_previous_value(self):
+        self.assertEqual(self.ids(self.city.crossed('temp', None, 4)), ['below10', 'below5'])
+        self.assertEqual(self.ids(self.city.crossed('temp', None, 30)), ['above20', 'above25'])
+
+    def test_condition_rules_fire_when_the_condition_changes(self):
+        city = CityRules([rule('condition', 'in', 'thunderstorm,snow', rule_id='storm')])
+
+        self.assertEqual(self.ids(city.crossed('condition', 'rain', 'snow')), ['storm'])
+        self.assertEqual(self.ids(city.crossed('condition', 'snow', 'snow')), [])
+        self.assertEqual(self.ids(city.crossed('condition', 'snow', 'thunderstorm')), ['storm'])
+        self.assertEqual(city.fields, {'condition'})
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.index = RuleIndex(store=MemoryRuleStore(), ttl_seconds=60, clock=lambda: self.now)
+
+    def test_rules_fire_on_the_observation_that_crosses_them(self):
+        self.index.register(rule('temp', 'below', 0, rule_id='freezing'))
+
+        self.assertEqual(self.index.evaluate('London', 'uk', observation(1, celsius=3)), [])
+        fired = self.index.evaluate(' london ', 'UK', observation(2, celsius=-1))
+        self.assertEqual([(matched.rule_id, value) for matched, value in fired], [('freezing', -1.0)])
+        self.assertEqual(self.index.evaluate('London', 'uk', observation(3, celsius=-2)), [])
+        self.assertEqual(self.index.stats()['fired'], 1)
+
+    def test_redelivered_message_fires_the_same_rules(self):
+        self.index.register(rule('wind', 'above', 60, rule_id='gale'))
+
+        first = self.index.evaluate('London', 'uk', observation(1, wind_ms=20), message_key='a')
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(self.index.evaluate('London', 'uk', observation(1, wind_ms=20), message_key='a'), first)
+        self.assertEqual(self.index.evaluate('London', 'uk', observation(1, wind_ms=20), message_key='b'), [])
+        self.assertEqual(self.index.evaluate('London', 'uk', observation(0, wind_ms=30), message_key='c'), [])
+
+    def test_city_without_rules_is_not_tracked(self):
+        self.index.register(rule('temp', 'below', 0))
+
+        self.assertEqual(self.index.evaluate('Paris', 'fr', observation(1, celsius=-5)), [])
+        self.assertEqual(self.index.stats()['evaluations'], 0)
+
+    def test_rules_are_cached_until_the_ttl(self):
+        store = MagicMock(wraps=MemoryRuleStore())
+        index = RuleIndex(store=store, ttl_seconds=60, clock=lambda: self.now)
+
+        for dt in range(3):
+            index.evaluate('London', 'uk', observation(dt))
+        self.assertEqual(store.rules.call_count, 1)
+
+        self.now = 61
+        index.evaluate('London', 'uk', observation(4))
+        self.assertEqual(store.rules.call_count, 2)
+
+    def test_containers_sharing_the_state_store_do_not_fire_twice(self):
+        rules = MemoryRuleStore()
+        state = MemoryStore()
+        first = RuleIndex(store=rules, state_store=state)
+        second = RuleIndex(store=rules, state_store=state)
+        first.register(rule('temp', 'below', 0, rule_id='freezing'))
+
+        self.assertEqual(len(first.evaluate('London', 'uk', observation(1, celsius=-1))), 1)
+        self.assertEqual(second.evaluate('London', 'uk', observation(2, celsius=-2)), [])
+
+    def test_redelivery_to_another_container_fires_the_same_rules(self):
+        rules = MemoryRuleStore()
+        state = MemoryStore()
+        RuleIndex(store=rules).register(rule('temp', 'below', 0, rule_id='freezing'))
+
+        first = RuleIndex(store=rules, state_store=state).evaluate('London', 'uk', observation(1, celsius=-1), 'a')
+        again = RuleIndex(store=rules, state_store=state).evaluate('London', 'uk', observation(1, celsius=-1), 'a')
+
+        self.assertEqual(first, again)
+
+    def test_unregister_removes_a_rule(self):
+        self.index.register(rule('temp', 'below', 0, rule_id='freezing'))
+        self.index.register(rule('temp', 'below', 5, rule_id='cold'))
+
+        self.assertTrue(self.index.unregister('London', 'uk', 'freezing'))
+        self.assertFalse(self.index.unregister('London', 'uk', 'freezing'))
+        self.assertEqual([kept.rule_id for kept in self.index.rules('London', 'uk')], ['cold'])
+
+    def test_index_without_a_store_is_disabled(self):
+        index = RuleIndex()
+
+        self.assertFalse(index.enabled)
+        self.assertEqual(index.evaluate('London', 'uk', observation(1, celsius=-5)), [])
+
+    def test_command_line_adds_and_lists_rules(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with patch.dict(os.environ, {'ALERT_RULES_STORE': f"file://{directory}"}):
+            with redirect_stdout(io.StringIO()):
+                main(['add', '--city', 'London', '--country', 'uk', '--field', 'condition', '--operator', 'in',
+                      '--value', 'snow', '--channel', 'email', '--endpoint', 'user@example.com'])
+            output = io.StringIO()
+            with redirect_stdout(output):
+                main(['list', '--city', 'london', '--country', 'UK'])
+
+        self.assertIn('"endpoint": "user@example.com"', output.getvalue())
+
+
+class TestRuleStores(unittest.TestCase):
+
+    def test_file_store_keeps_one_file_per_rule(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = FileRuleStore(directory)
+
+        store.put('london,uk', 'one', {'rule_id': 'one'})
+        store.put('london,uk', 'two', {'rule_id': 'two'})
+        store.put('paris,fr', 'three', {'rule_id': 'three'})
+
+        self.assertEqual(sorted(rule['rule_id'] for rule in store.rules('london,uk')), ['one', 'two'])
+        self.assertTrue(store.delete('london,uk', 'one'))
+        self.assertFalse(store.delete('london,uk', 'one'))
+        self.assertEqual(store.rules('london,uk'), [{'rule_id': 'two'}])
+        self.assertEqual(store.rules('berlin,de'), [])
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_dynamodb_store_queries_the_rules_of_a_city(self, mock_boto3_client):
+        aws_clients.reset()
+        self.addCleanup(aws_clients.reset)
+        client = mock_boto3_client.return_value
+        client.get_paginator.return_value.paginate.return_value = [
+            {'Items': [{'city_key': {'S': 'london,uk'}, 'rule_id': {'S': 'one'}, 'rule': {'S': '{"rule_id": "one"}'}}]},
+            {'Items': []}
+        ]
+        client.delete_item.return_value = {}
+        store = DynamoDBRuleStore('alert-rules')
+
+        self.assertEqual(store.rules('london,uk'), [{'rule_id': 'one'}])
+        client.get_paginator.assert_called_once_with('query')
+        arguments = client.get_paginator.return_value.paginate.call_args.kwargs
+        self.assertEqual(arguments['KeyConditionExpression'], 'city_key = :city')
+        store.put('london,uk', 'two', {'rule_id': 'two'})
+        self.assertEqual(client.put_item.call_args.kwargs['Item']['rule_id'], {'S': 'two'})
+        self.assertFalse(store.delete('london,uk', 'three'))
+
+
+class TestProcessorAlerts(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RuleIndex(store=MemoryRuleStore())
+        self.index.register(rule('temp', 'below', 0, rule_id='freezing'))
+        self.index.register(rule('condition', 'in', 'snow', endpoint='user@example.com', channel='email'))
+        patcher = patch.object(processor, 'alert_rules', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        processor.subscription_index.clear()
+
+    def weather_body(self, dt, celsius, condition):
+        return {
+            'city_name': 'London',
+            'country_code': 'uk',
+            'notification_type': 'sms',
+            'phone_number': '+1999999999',
+            'data': observation(dt, celsius=celsius, condition=condition)
+        }
+
+    @patch.dict(os.environ, {'NOTIFICATION_MODE': 'rules'})
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_rules_mode_only_notifies_fired_rules(self, mock_boto_client):
+        sns_client = MagicMock()
+        mock_boto_client.return_value = sns_client
+
+        processor.handle_notification(self.weather_body(1, 2, 'Clouds'), TOPIC_ARN)
+        sns_client.publish.assert_not_called()
+
+        processor.handle_notification(self.weather_body(2, -1, 'Snow'), TOPIC_ARN)
+        messages = sorted(call.kwargs['Message'] for call in sns_client.publish.call_args_list)
+        self.assertEqual(messages, [
+            'Weather Condition for London - condition is now snow',
+            'Weather condition for London - temp below 0°C, now -1°C'
+        ])
+
+    @patch.dict(os.environ, {})
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_message_recipients_and_fired_rules_are_notified_by_default(self, mock_boto_client):
+        sns_client = MagicMock()
+        mock_boto_client.return_value = sns_client
+        os.environ.pop('NOTIFICATION_MODE', None)
+
+        processor.handle_notification(self.weather_body(1, -1, 'Clouds'), TOPIC_ARN)
+
+        messages = sorted(call.kwargs['Message'] for call in sns_client.publish.call_args_list)
+        self.assertEqual(messages, [
+            'Weather condition for London - clouds',
+            'Weather condition for London - temp below 0°C, now -1°C'
+        ])
+
+    @patch.dict(os.environ, {'NOTIFICATION_MODE': 'rules'})
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_rules_mode_still_notifies_scheduled_recipients(self, mock_boto_client):
+        sns_client = MagicMock()
+        mock_boto_client.return_value = sns_client
+        weather_body = self.weather_body(1, 2, 'Clouds')
+        weather_body['recipients'] = [{'notification_type': 'sms', 'email': '', 'phone_number': '+1888888888'}]
+
+        processor.handle_notification(weather_body, TOPIC_ARN)
+
+        sns_client.publish.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from ..harness.pipeline import LocalPipeline, sample_subscriptions
+from ..weather_fetcher.subscription_store import Subscription
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = LocalPipeline(batch_size=10).start()
+        self.addCleanup(self.pipeline.stop)
+
+    def test_each_city_is_fetched_once_per_cycle(self):
+        report = self.pipeline.run_schedule(sample_subscriptions(60, cities=4))
+
+        self.assertEqual(
+            {'status_code': 200, 'due': 60, 'cities_fetched': 4, 'cities_failed': 0, 'queued': 4, 'notified': 60, 'deferred': 0},
+            report['schedule']
+        )
+        self.assertEqual(4, report['weather_api']['requests'])
+        self.assertEqual(4, report['messages_processed'])
+        self.assertEqual(60, report['notifications'])
+        # One observation per city, whatever the number of subscribers
+        self.assertEqual(4, len(self.pipeline.stored_observations()))
+
+        # Notified subscriptions are not due again before their next run
+        self.assertEqual(0, self.pipeline.run_schedule([])['schedule']['due'])
+
+    def test_large_cities_are_split_over_several_messages(self):
+        with patch.dict('os.environ', {'SCHEDULE_RECIPIENTS_PER_MESSAGE': '10'}):
+            report = self.pipeline.run_schedule(sample_subscriptions(25, cities=1, channel='email'))
+
+        self.assertEqual(3, report['schedule']['queued'])
+        self.assertEqual(1, report['weather_api']['requests'])
+        self.assertEqual(25, report['notifications'])
+        self.assertEqual(1, len(self.pipeline.stored_observations()))
+
+    def test_cities_over_the_limit_stay_due(self):
+        with patch.dict('os.environ', {'SCHEDULE_MAX_CITIES': '2'}):
+            report = self.pipeline.run_schedule(sample_subscriptions(6, cities=3))
+        self.assertEqual(2, report['schedule']['cities_fetched'])
+        self.assertEqual(2, report['schedule']['deferred'])
+
+        report = self.pipeline.run_schedule([])
+        self.assertEqual(2, report['schedule']['due'])
+        self.assertEqual(2, report['schedule']['notified'])
+
+    def test_subscriptions_of_a_failed_city_stay_due(self):
+        unknown = Subscription.create('Atlantis', '', 'sms', '+61400000000', 'rate(1 hour)', first_run_at=0)
+        self.pipeline.weather_server.api_key = 'rotated-key'
+        report = self.pipeline.run_schedule([unknown])
+        self.assertEqual(1, report['schedule']['cities_failed'])
+        self.assertEqual(0, report['schedule']['notified'])
+        self.assertEqual(1, len(self.pipeline.subscriptions.due(float('inf'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
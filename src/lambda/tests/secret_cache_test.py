@@ -0,0 +1,71 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+
+from ..common import aws_clients
+from ..weather_fetcher.secret_cache import SecretCache
+
+
+class TestSecretCache(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+        self.now = 1000.0
+        self.cache = SecretCache(ttl_seconds=60, clock=lambda: self.now)
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_secret_is_read_again_after_ttl(self, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_boto3_client.return_value = mock_secrets_manager_client
+        mock_secrets_manager_client.get_secret_value.side_effect = [
+            {'SecretString': 'first-key'},
+            {'SecretString': 'second-key'}
+        ]
+
+        self.assertEqual('first-key', self.cache.get('test-secret'))
+        self.now += 59
+        self.assertEqual('first-key', self.cache.get('test-secret'))
+        self.now += 2
+        self.assertEqual('second-key', self.cache.get('test-secret'))
+
+        self.assertEqual({'hits': 1, 'misses': 2, 'invalidations': 0}, self.cache.stats())
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_concurrent_hits_are_all_counted(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-key'}
+        self.assertEqual(('test-key', False), self.cache.lookup('test-secret'))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: self.cache.lookup('test-secret'), range(2000)))
+
+        self.assertEqual([('test-key', True)] * 2000, results)
+        self.assertEqual({'hits': 2000, 'misses': 1, 'invalidations': 0}, self.cache.stats())
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_invalidate_forces_a_new_read(self, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_boto3_client.return_value = mock_secrets_manager_client
+        mock_secrets_manager_client.get_secret_value.side_effect = [
+            {'SecretString': 'first-key'},
+            {'SecretString': 'rotated-key'}
+        ]
+
+        self.cache.get('test-secret')
+        self.cache.invalidate('test-secret')
+
+        self.assertEqual('rotated-key', self.cache.get('test-secret'))
+        self.assertEqual(1, self.cache.stats()['invalidations'])
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_secrets_are_cached_per_secret_id(self, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_boto3_client.return_value = mock_secrets_manager_client
+        mock_secrets_manager_client.get_secret_value.side_effect = lambda SecretId: {'SecretString': f'{SecretId}-value'}
+
+        self.assertEqual('a-value', self.cache.get('a'))
+        self.assertEqual('b-value', self.cache.get('b'))
+        self.assertEqual(2, mock_secrets_manager_client.get_secret_value.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
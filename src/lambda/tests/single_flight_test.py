@@ -0,0 +1,81 @@
+import threading
+import unittest
+
+from ..common.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, single_flight, fn, callers):
+        outcomes = [None] * callers
+
+        def call(index):
+            try:
+                outcomes[index] = single_flight.do('london,uk', fn)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'temp': 10}
+
+        threads, outcomes = self.run_concurrently(single_flight, fetch, 1)
+        started.wait(5)
+        followers, follower_outcomes = self.run_concurrently(single_flight, fetch, 4)
+        # Let every follower register before the leader finishes
+        while single_flight.stats()['coalesced'] < 4:
+            pass
+        release.set()
+        for thread in threads + followers:
+            thread.join(5)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(({'temp': 10}, False), outcomes[0])
+        self.assertEqual([({'temp': 10}, True)] * 4, follower_outcomes)
+        self.assertEqual({'executed': 1, 'coalesced': 4}, single_flight.stats())
+
+    def test_error_is_shared_with_waiting_callers(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            raise ValueError('upstream failed')
+
+        threads, outcomes = self.run_concurrently(single_flight, fetch, 1)
+        started.wait(5)
+        followers, follower_outcomes = self.run_concurrently(single_flight, fetch, 2)
+        while single_flight.stats()['coalesced'] < 2:
+            pass
+        release.set()
+        for thread in threads + followers:
+            thread.join(5)
+
+        for outcome in outcomes + follower_outcomes:
+            self.assertIsInstance(outcome, ValueError)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        single_flight = SingleFlight()
+
+        self.assertEqual((1, False), single_flight.do('key', lambda: 1))
+        self.assertEqual((2, False), single_flight.do('key', lambda: 2))
+        self.assertEqual({'executed': 2, 'coalesced': 0}, single_flight.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
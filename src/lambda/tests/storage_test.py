@@ -0,0 +1,105 @@
+import gzip
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from ..common.observations import read_observations
+from ..weather_processor.storage import ObservationWriter, partition_key
+
+# 2024-05-01 13:20:00 UTC
+MEASURED_AT = 1714569600
+
+
+class TestPartitionKey(unittest.TestCase):
+
+    def test_partition_uses_measurement_time_and_location(self):
+        self.assertEqual(
+            'date=2024-05-01/hour=13/country=gb/city=new-york',
+            partition_key({'dt': MEASURED_AT}, 'New York', 'GB')
+        )
+
+    def test_country_falls_back_to_observation(self):
+        key = partition_key({'dt': MEASURED_AT, 'sys': {'country': 'JP'}}, 'Tokyo')
+
+        self.assertTrue(key.endswith('/country=jp/city=tokyo'))
+
+
+class TestObservationWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.s3_client = MagicMock()
+
+    def writer(self, **kwargs):
+        return ObservationWriter(self.s3_client, 'test-bucket', clock=lambda: self.now, **kwargs)
+
+    def test_flush_writes_one_gzip_object_per_partition(self):
+        writer = self.writer()
+        writer.add({'dt': MEASURED_AT, 'temp': 1}, 'London', 'UK', 'message-1')
+        writer.add({'dt': MEASURED_AT, 'temp': 2}, 'London', 'UK', 'message-2')
+        writer.add({'dt': MEASURED_AT, 'temp': 3}, 'Paris', 'FR', 'message-3')
+
+        self.assertEqual({}, writer.flush())
+
+        self.assertEqual(2, self.s3_client.put_object.call_count)
+        keys = [call.kwargs['Key'] for call in self.s3_client.put_object.call_args_list]
+        self.assertEqual(len(keys), len(set(keys)))
+        london = next(call for call in self.s3_client.put_object.call_args_list if 'city=london' in call.kwargs['Key'])
+        self.assertTrue(london.kwargs['Key'].startswith('weather-data/date=2024-05-01/hour=13/country=uk/city=london/'))
+        self.assertEqual('gzip', london.kwargs['ContentEncoding'])
+        lines = gzip.decompress(london.kwargs['Body']).decode('utf-8').splitlines()
+        self.assertEqual([{'dt': MEASURED_AT, 'temp': 1}, {'dt': MEASURED_AT, 'temp': 2}], [json.loads(line) for line in lines])
+
+    def test_flushes_when_record_threshold_is_reached(self):
+        writer = self.writer(max_records=2)
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-1')
+        self.s3_client.put_object.assert_not_called()
+
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-2')
+
+        self.s3_client.put_object.assert_called_once()
+
+    def test_flushes_when_buffer_is_too_old(self):
+        writer = self.writer(max_age_seconds=30)
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-1')
+        self.now = 31
+
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-2')
+
+        self.s3_client.put_object.assert_called_once()
+
+    def test_failed_put_reports_every_message_of_the_object(self):
+        self.s3_client.put_object.side_effect = Exception('S3 Error')
+        writer = self.writer()
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-1')
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-2')
+
+        writer.flush()
+
+        self.assertEqual({'message-1': 'S3 Error', 'message-2': 'S3 Error'}, writer.failures)
+
+    def test_uncompressed_output(self):
+        writer = self.writer(compression='none')
+        writer.add({'dt': MEASURED_AT}, 'London', 'UK', 'message-1')
+        writer.flush()
+
+        call = self.s3_client.put_object.call_args
+        self.assertTrue(call.kwargs['Key'].endswith('.jsonl'))
+        self.assertNotIn('ContentEncoding', call.kwargs)
+
+    def test_unknown_compression_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.writer(compression='lz4')
+
+
+class TestReadObservations(unittest.TestCase):
+
+    def test_reads_ndjson_and_legacy_objects(self):
+        body = gzip.compress(b'{"temp":1}\n{"temp":2}\n')
+
+        self.assertEqual([{'temp': 1}, {'temp': 2}], read_observations(body, 'gzip', 'a.jsonl.gz'))
+        self.assertEqual([{'temp': 1}], read_observations(json.dumps({'temp': 1}, indent=2), key='a.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
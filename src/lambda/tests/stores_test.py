@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from ..common import aws_clients
+from ..common.stores import MemoryStore, FileStore, DynamoDBStore, store_from_url
+
+
+class TestStores(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.clock = lambda: self.now
+
+    def assert_store_behaviour(self, store):
+        self.assertIsNone(store.get('missing'))
+
+        store.put('weather:london,uk', {'temp': 10})
+        store.put('expiring', [1, 2], ttl_seconds=5)
+        self.assertEqual({'temp': 10}, store.get('weather:london,uk'))
+        self.assertEqual([1, 2], store.get('expiring'))
+
+        self.now += 5
+        self.assertIsNone(store.get('expiring'))
+
+        store.delete('weather:london,uk')
+        self.assertIsNone(store.get('weather:london,uk'))
+
+    def test_memory_store(self):
+        self.assert_store_behaviour(MemoryStore(clock=self.clock))
+
+    def test_file_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assert_store_behaviour(FileStore(directory, clock=self.clock))
+
+    def test_file_store_is_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            FileStore(directory).put('key', 'value')
+            self.assertEqual('value', FileStore(directory).get('key'))
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_dynamodb_store(self, mock_boto3_client):
+        aws_clients.reset()
+        mock_dynamodb_client = MagicMock()
+        mock_boto3_client.return_value = mock_dynamodb_client
+        store = DynamoDBStore('weather-cache', clock=self.clock)
+
+        store.put('key', {'temp': 10}, ttl_seconds=60)
+        mock_dynamodb_client.put_item.assert_called_once_with(
+            TableName='weather-cache',
+            Item={
+                'key': {'S': 'key'},
+                'value': {'S': '{"temp": 10}'},
+                'expires_at': {'N': '1060'}
+            }
+        )
+
+        mock_dynamodb_client.get_item.return_value = {'Item': mock_dynamodb_client.put_item.call_args.kwargs['Item']}
+        self.assertEqual({'temp': 10}, store.get('key'))
+        self.now = 1060
+        self.assertIsNone(store.get('key'))
+
+    def test_store_from_url(self):
+        self.assertIsNone(store_from_url(None))
+        self.assertIsInstance(store_from_url('memory://'), MemoryStore)
+        with tempfile.TemporaryDirectory() as directory:
+            store = store_from_url(f"file://{directory}/cache")
+            self.assertIsInstance(store, FileStore)
+            self.assertTrue(os.path.isdir(f"{directory}/cache"))
+        self.assertEqual('weather-cache', store_from_url('dynamodb://weather-cache').table_name)
+        with self.assertRaises(ValueError):
+            store_from_url('redis://localhost')
+
+
+if __name__ == '__main__':
+    unittest.main()
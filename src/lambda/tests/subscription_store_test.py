@@ -0,0 +1,146 @@
+import io
+import json
+import os
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from ..common import aws_clients
+from ..weather_fetcher.subscription_store import (
+    DynamoDBSubscriptionStore, MemorySubscriptionStore, Schedule, Subscription, main, subscription_store_from_url
+)
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+def subscription(subscription_id, next_run_at=NOW, schedule='rate(1 hour)', city_name='Sydney'):
+    return Subscription.create(
+        city_name, 'AU', 'sms', '+61400000000', schedule, first_run_at=next_run_at, subscription_id=subscription_id
+    )
+
+
+class TestSchedule(unittest.TestCase):
+
+    def test_rate_keeps_its_cadence(self):
+        schedule = Schedule('rate(30 minutes)')
+        self.assertEqual(NOW + 1800, schedule.next_run(NOW, NOW + 10))
+        # Runs missed while the scheduler was late are skipped
+        self.assertEqual(NOW + 3 * 1800, schedule.next_run(NOW, NOW + 2 * 1800))
+        self.assertEqual(86400, Schedule('rate(1 day)').interval)
+
+    def test_daily_runs_at_a_utc_time(self):
+        schedule = Schedule('daily(07:30)')
+        self.assertEqual(
+            datetime(2024, 5, 2, 7, 30, tzinfo=timezone.utc).timestamp(),
+            schedule.next_run(NOW - 86400, NOW)
+        )
+        self.assertEqual(
+            datetime(2024, 5, 1, 7, 30, tzinfo=timezone.utc).timestamp(),
+            schedule.next_run(NOW, datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc).timestamp())
+        )
+
+    def test_unsupported_schedules_are_rejected(self):
+        for expression in ('rate(0 minutes)', 'rate(5 weeks)', 'daily(24:00)', 'cron(0 7 * * ? *)'):
+            with self.assertRaises(ValueError):
+                Schedule(expression)
+        with self.assertRaises(ValueError):
+            Subscription.create('Sydney', 'AU', 'push', 'token', 'rate(1 hour)')
+
+
+class TestMemorySubscriptionStore(unittest.TestCase):
+
+    def test_due_subscriptions_longest_overdue_first(self):
+        store = MemorySubscriptionStore([
+            subscription('later', NOW + 60),
+            subscription('due', NOW - 10),
+            subscription('overdue', NOW - 600)
+        ])
+        self.assertEqual(['overdue', 'due'], [item.subscription_id for item in store.due(NOW)])
+
+    def test_advance_only_once(self):
+        store = MemorySubscriptionStore([subscription('due', NOW - 10)])
+        due, = store.due(NOW)
+        self.assertTrue(store.advance(due, NOW + 3600))
+        self.assertFalse(store.advance(due, NOW + 7200))
+        self.assertEqual(NOW + 3600, store.get('due').next_run_at)
+        self.assertEqual([], store.due(NOW))
+
+    def test_store_from_url(self):
+        self.assertIsInstance(subscription_store_from_url(None), MemorySubscriptionStore)
+        self.assertEqual('weather-subscriptions', subscription_store_from_url('dynamodb://weather-subscriptions').table_name)
+        with self.assertRaises(ValueError):
+            subscription_store_from_url('redis://localhost')
+
+
+class TestDynamoDBSubscriptionStore(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_due_scans_with_a_filter(self, mock_boto3_client):
+        paginator = mock_boto3_client.return_value.get_paginator.return_value
+        paginator.paginate.return_value = [{'Items': [{
+            'subscription_id': {'S': 'one'},
+            'city_name': {'S': 'Sydney'},
+            'country_code': {'S': 'AU'},
+            'channel': {'S': 'sms'},
+            'endpoint': {'S': '+61400000000'},
+            'schedule': {'S': 'rate(1 hour)'},
+            'next_run_at': {'N': '1714564800.0'}
+        }]}]
+
+        due = DynamoDBSubscriptionStore('subscriptions').due(NOW)
+
+        self.assertEqual([subscription('one', 1714564800.0)], due)
+        arguments = paginator.paginate.call_args.kwargs
+        self.assertEqual('next_run_at <= :now', arguments['FilterExpression'])
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_advance_is_conditional(self, mock_boto3_client):
+        client = mock_boto3_client.return_value
+        client.exceptions.ConditionalCheckFailedException = type('ConditionalCheckFailedException', (Exception,), {})
+        store = DynamoDBSubscriptionStore('subscriptions')
+
+        self.assertTrue(store.advance(subscription('one'), NOW + 3600))
+        self.assertEqual('next_run_at = :previous', client.update_item.call_args.kwargs['ConditionExpression'])
+
+        client.update_item.side_effect = client.exceptions.ConditionalCheckFailedException()
+        self.assertFalse(store.advance(subscription('one'), NOW + 3600))
+
+
+class TestSubscriptionCommands(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_add_and_remove(self, mock_boto3_client):
+        client = mock_boto3_client.return_value
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main(['--store', 'dynamodb://subscriptions', 'add', '--city', 'Sydney', '--country', 'AU',
+                  '--channel', 'email', '--endpoint', 'user@example.com', '--schedule', 'daily(07:30)',
+                  '--first-run-at', str(NOW)])
+        added = json.loads(output.getvalue())
+
+        item = client.put_item.call_args.kwargs['Item']
+        self.assertEqual(added['subscription_id'], item['subscription_id']['S'])
+        self.assertEqual('user@example.com', item['endpoint']['S'])
+        self.assertEqual(NOW, added['next_run_at'])
+
+        main(['--store', 'dynamodb://subscriptions', 'remove', '--subscription-id', added['subscription_id']])
+        client.delete_item.assert_called_once_with(
+            TableName='subscriptions', Key={'subscription_id': {'S': added['subscription_id']}}
+        )
+
+    @patch.dict(os.environ, {'SUBSCRIPTION_STORE': ''})
+    def test_a_persistent_store_is_required(self):
+        for store in ([], ['--store', 'memory://']):
+            with self.assertRaises(SystemExit), redirect_stdout(io.StringIO()), patch('sys.stderr', io.StringIO()):
+                main(store + ['remove', '--subscription-id', 'one'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+
+from ..common import aws_clients
+from ..weather_processor.subscription_index_store import (
+    DynamoDBSubscriptionIndexStore, FileSubscriptionIndexStore, MemorySubscriptionIndexStore,
+    subscription_index_store_from_url
+)
+from ..weather_processor.subscriptions import SubscriptionIndex, add_filter_policies, main
+
+TOPIC_ARN = 'arn:aws:sns:region:account-id:weather-topic'
+
+
+def sns_client_with_pages(*pages):
+    sns_client = MagicMock()
+    sns_client.get_paginator.return_value.paginate.return_value = [
+        {'Subscriptions': [{'Protocol': protocol, 'Endpoint': endpoint} for protocol, endpoint in page]}
+        for page in pages
+    ]
+    return sns_client
+
+
+class TestSubscriptionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.clock = lambda: self.now
+
+    def test_subscriber_on_a_later_page_is_not_subscribed_again(self):
+        first_page = [('email', f'user{index}@example.com') for index in range(100)]
+        sns_client = sns_client_with_pages(first_page, [('sms', '+1234567890')])
+        index = SubscriptionIndex(clock=self.clock)
+
+        self.assertFalse(index.ensure_subscribed(sns_client, TOPIC_ARN, 'sms', '+1234567890'))
+        self.assertFalse(index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'user42@example.com'))
+
+        sns_client.subscribe.assert_not_called()
+        sns_client.get_paginator.return_value.paginate.assert_called_once_with(TopicArn=TOPIC_ARN)
+
+    def test_new_subscription_is_written_through(self):
+        sns_client = sns_client_with_pages([])
+        index = SubscriptionIndex(clock=self.clock)
+
+        self.assertTrue(index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'new@example.com'))
+        self.assertFalse(index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'new@example.com'))
+
+        sns_client.subscribe.assert_called_once_with(
+            TopicArn=TOPIC_ARN,
+            Protocol='email',
+            Endpoint='new@example.com'
+        )
+        self.assertEqual({'topics': 1, 'listings': 1, 'subscribes': 1}, index.stats())
+
+    def test_attributes_are_set_on_new_subscriptions(self):
+        sns_client = sns_client_with_pages([])
+        index = SubscriptionIndex(clock=self.clock)
+        attributes = {'FilterPolicy': '{"email": ["new@example.com"]}'}
+
+        index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'new@example.com', attributes=attributes)
+
+        sns_client.subscribe.assert_called_once_with(
+            TopicArn=TOPIC_ARN,
+            Protocol='email',
+            Endpoint='new@example.com',
+            Attributes=attributes
+        )
+
+    def test_topic_is_listed_again_after_ttl(self):
+        sns_client = sns_client_with_pages([('email', 'user@example.com')])
+        index = SubscriptionIndex(ttl_seconds=60, clock=self.clock)
+
+        index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'user@example.com')
+        self.now = 61
+        index.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'user@example.com')
+
+        self.assertEqual(2, index.stats()['listings'])
+
+    def test_shared_store_avoids_listing_in_new_containers(self):
+        store = MemorySubscriptionIndexStore()
+        first_container = SubscriptionIndex(store=store, clock=self.clock)
+        first_container.ensure_subscribed(sns_client_with_pages([('sms', '+1234567890')]), TOPIC_ARN, 'email', 'new@example.com')
+
+        sns_client = MagicMock()
+        second_container = SubscriptionIndex(store=store, clock=self.clock)
+
+        self.assertFalse(second_container.ensure_subscribed(sns_client, TOPIC_ARN, 'sms', '+1234567890'))
+        self.assertFalse(second_container.ensure_subscribed(sns_client, TOPIC_ARN, 'email', 'new@example.com'))
+        sns_client.get_paginator.assert_not_called()
+        sns_client.subscribe.assert_not_called()
+
+    def test_store_failure_falls_back_to_listing(self):
+        store = MagicMock()
+        store.subscriptions.side_effect = RuntimeError('unavailable')
+        store.add.side_effect = RuntimeError('unavailable')
+        index = SubscriptionIndex(store=store, clock=self.clock)
+
+        self.assertTrue(index.ensure_subscribed(sns_client_with_pages([]), TOPIC_ARN, 'email', 'new@example.com'))
+        self.assertEqual(1, index.stats()['listings'])
+
+
+class TestSubscriptionIndexStores(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.clock = lambda: self.now
+
+    def check_store(self, store):
+        self.assertIsNone(store.subscriptions(TOPIC_ARN))
+        # Subscriptions added before a listing do not make the topic known
+        store.add(TOPIC_ARN, 'email', 'new@example.com', 60)
+        self.assertIsNone(store.subscriptions(TOPIC_ARN))
+
+        store.record_listing(TOPIC_ARN, {('sms', '+1234567890')}, 60)
+        store.add(TOPIC_ARN, 'email', 'later@example.com', 60)
+        self.assertEqual(
+            {('sms', '+1234567890'), ('email', 'new@example.com'), ('email', 'later@example.com')},
+            store.subscriptions(TOPIC_ARN)
+        )
+        self.assertIsNone(store.subscriptions('arn:aws:sns:region:account-id:other-topic'))
+
+        self.now += 60
+        self.assertIsNone(store.subscriptions(TOPIC_ARN))
+
+    def test_memory_store(self):
+        self.check_store(MemorySubscriptionIndexStore(clock=self.clock))
+
+    def test_file_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.check_store(FileSubscriptionIndexStore(directory, clock=self.clock))
+
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_dynamodb_store_writes_one_item_per_subscription(self, mock_boto3_client):
+        aws_clients.reset()
+        self.addCleanup(aws_clients.reset)
+        client = mock_boto3_client.return_value
+        client.batch_write_item.return_value = {'UnprocessedItems': {}}
+        store = DynamoDBSubscriptionIndexStore('subscription-index', clock=self.clock)
+
+        store.record_listing(TOPIC_ARN, {('email', f'user{index}@example.com') for index in range(30)}, 60)
+
+        self.assertEqual(2, client.batch_write_item.call_count)
+        first_batch = client.batch_write_item.call_args_list[0].kwargs['RequestItems']['subscription-index']
+        self.assertEqual(25, len(first_batch))
+        self.assertEqual('#listing', client.put_item.call_args.kwargs['Item']['subscription']['S'])
+
+        client.get_paginator.return_value.paginate.return_value = [{'Items': [
+            {'topic_arn': {'S': TOPIC_ARN}, 'subscription': {'S': '#listing'}, 'expires_at': {'N': '1060'}},
+            {'topic_arn': {'S': TOPIC_ARN}, 'subscription': {'S': 'sms +1234567890'}, 'protocol': {'S': 'sms'},
+             'endpoint': {'S': '+1234567890'}, 'expires_at': {'N': '1060'}},
+            {'topic_arn': {'S': TOPIC_ARN}, 'subscription': {'S': 'email old@example.com'}, 'protocol': {'S': 'email'},
+             'endpoint': {'S': 'old@example.com'}, 'expires_at': {'N': '900'}}
+        ]}]
+        self.assertEqual({('sms', '+1234567890')}, store.subscriptions(TOPIC_ARN))
+        self.assertEqual(
+            'topic_arn = :topic', client.get_paginator.return_value.paginate.call_args.kwargs['KeyConditionExpression']
+        )
+
+    def test_store_from_url(self):
+        self.assertIsNone(subscription_index_store_from_url(None))
+        self.assertIsInstance(subscription_index_store_from_url('memory://'), MemorySubscriptionIndexStore)
+        self.assertEqual('index', subscription_index_store_from_url('dynamodb://index').table_name)
+        with self.assertRaises(ValueError):
+            subscription_index_store_from_url('redis://localhost')
+
+
+class TestFilterPolicyMigration(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+
+    def test_policy_is_set_on_confirmed_email_subscriptions(self):
+        sns_client = MagicMock()
+        sns_client.get_paginator.return_value.paginate.return_value = [
+            {'Subscriptions': [
+                {'Protocol': 'email', 'Endpoint': 'old@example.com', 'SubscriptionArn': f"{TOPIC_ARN}:1"},
+                {'Protocol': 'sms', 'Endpoint': '+1234567890', 'SubscriptionArn': f"{TOPIC_ARN}:2"}
+            ]},
+            {'Subscriptions': [
+                {'Protocol': 'email', 'Endpoint': 'pending@example.com', 'SubscriptionArn': 'PendingConfirmation'}
+            ]}
+        ]
+
+        self.assertEqual(1, add_filter_policies(sns_client, TOPIC_ARN))
+
+        sns_client.set_subscription_attributes.assert_called_once_with(
+            SubscriptionArn = f"{TOPIC_ARN}:1",
+            AttributeName = 'FilterPolicy',
+            AttributeValue = json.dumps({'email': ['old@example.com']})
+        )
+
+    @patch.dict(os.environ, {'SNS_TOPIC_ARN': TOPIC_ARN})
+    @patch('src.lambda.common.aws_clients.boto3.client')
+    def test_command_defaults_to_the_processor_topic(self, mock_boto3_client):
+        paginator = mock_boto3_client.return_value.get_paginator.return_value
+        paginator.paginate.return_value = []
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main([])
+
+        paginator.paginate.assert_called_once_with(TopicArn=TOPIC_ARN)
+        self.assertIn('0 email subscriptions', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ..authorizer.token_store import TokenStore, token_fingerprint, token_from_header
+
+
+class TestTokenStore(unittest.TestCase):
+
+    def test_token_from_header(self):
+        self.assertEqual('abc', token_from_header('Bearer abc'))
+        self.assertEqual('abc', token_from_header('bearer  abc '))
+        self.assertIsNone(token_from_header('abc'))
+        self.assertIsNone(token_from_header('Basic abc'))
+        self.assertIsNone(token_from_header('Bearer '))
+        self.assertIsNone(token_from_header(None))
+
+    def test_lookup(self):
+        store = TokenStore({'key-1': 'alice', 'key-2': 'bob'})
+
+        self.assertEqual('alice', store.principal('key-1'))
+        self.assertEqual('bob', store.principal('key-2'))
+        self.assertIsNone(store.principal('key-3'))
+        self.assertIsNone(store.principal(None))
+
+    def test_load_lines_with_digests(self):
+        store = TokenStore()
+        store.load(
+            '# API keys\n'
+            'key-1 alice\n'
+            f"sha256:{hashlib.sha256(b'key-2').hexdigest()} bob\n"
+            '\n'
+            'key-3\n'
+        )
+
+        self.assertEqual(3, len(store))
+        self.assertEqual('bob', store.principal('key-2'))
+        self.assertEqual('user123', store.principal('key-3'))
+
+    def test_load_json(self):
+        store = TokenStore()
+        store.load('{"key-1": "alice"}')
+
+        self.assertEqual('alice', store.principal('key-1'))
+
+    def test_from_environment(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+            file.write(''.join(f"key-{index} user{index}\n" for index in range(20000)))
+        try:
+            with patch.dict(os.environ, {'AUTH_TOKENS_FILE': file.name, 'AUTH_TOKENS': 'extra-1 carol,extra-2'}):
+                store = TokenStore.from_environment()
+        finally:
+            os.remove(file.name)
+
+        self.assertEqual(20002, len(store))
+        self.assertEqual('user19999', store.principal('key-19999'))
+        self.assertEqual('carol', store.principal('extra-1'))
+        self.assertIsNone(store.principal('valid-JWT-001'))
+
+    def test_default_tokens(self):
+        with patch.dict(os.environ, {}, clear=True):
+            store = TokenStore.from_environment()
+
+        self.assertEqual('user123', store.principal('valid-JWT-001'))
+
+    def test_fingerprint_does_not_reveal_the_token(self):
+        self.assertEqual(8, len(token_fingerprint('valid-JWT-001')))
+        self.assertNotIn('valid', token_fingerprint('valid-JWT-001'))
+
+
+if __name__ == '__main__':
+    unittest.main()
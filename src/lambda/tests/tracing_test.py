@@ -0,0 +1,141 @@
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from ..common import metrics, tracing
+
+
+class TestTraceContext(unittest.TestCase):
+
+    def test_traceparent_round_trip(self):
+        context = tracing.parse_traceparent('00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01')
+        self.assertEqual('4bf92f3577b34da6a3ce929d0e0e4736', context.trace_id)
+        self.assertEqual('00f067aa0ba902b7', context.span_id)
+        self.assertEqual('00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01', context.traceparent())
+
+    def test_malformed_traceparent_is_ignored(self):
+        for value in (None, '', 'not-a-trace', '00-' + '0' * 32 + '-00f067aa0ba902b7-01'):
+            self.assertIsNone(tracing.parse_traceparent(value))
+
+    def test_context_from_api_gateway_event(self):
+        event = {
+            'headers': {'X-Amzn-Trace-Id': 'Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=1'},
+            'requestContext': {'requestTimeEpoch': 1700000000123}
+        }
+        context = tracing.context_from_event(event)
+        self.assertEqual('5759e988bd862e3fe1be46a994272793', context.trace_id)
+        self.assertEqual(1700000000123, context.request_time)
+
+    def test_traceparent_header_wins_over_xray(self):
+        event = {'headers': {
+            'traceparent': '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01',
+            'X-Amzn-Trace-Id': 'Root=1-5759e988-bd862e3fe1be46a994272793'
+        }}
+        self.assertEqual('4bf92f3577b34da6a3ce929d0e0e4736', tracing.context_from_event(event).trace_id)
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_event_without_trace_starts_a_new_one(self):
+        self.assertIsNone(tracing.context_from_event({'city_name': 'Sydney'}))
+
+    def test_message_attributes_round_trip(self):
+        context = tracing.TraceContext('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', 1700000000123)
+        attributes = tracing.message_attributes(context)
+        self.assertEqual(context, tracing.context_from_message_attributes(attributes))
+
+        # Lambda SQS records use lower-case keys
+        record_attributes = {
+            name: {'stringValue': value['StringValue'], 'dataType': value['DataType']}
+            for name, value in attributes.items()
+        }
+        self.assertEqual(context, tracing.context_from_message_attributes(record_attributes))
+        self.assertIsNone(tracing.context_from_message_attributes({}))
+
+
+class TestSpans(unittest.TestCase):
+
+    def setUp(self):
+        self.spans = []
+        tracing.set_exporter(self.spans.append)
+        self.addCleanup(tracing.set_exporter, None)
+
+    def test_nested_spans_share_the_trace(self):
+        with tracing.span('request') as request:
+            with tracing.span('sqs.send_message', messages=1) as send:
+                self.assertEqual(send.span_id, tracing.current_context().span_id)
+
+        send_span, request_span = self.spans
+        self.assertEqual(request_span['trace_id'], send_span['trace_id'])
+        self.assertEqual(request_span['span_id'], send_span['parent_id'])
+        self.assertIsNone(request_span['parent_id'])
+        self.assertEqual({'messages': 1}, send_span['attributes'])
+        self.assertIsNone(tracing.current_context())
+
+    def test_span_continues_a_remote_parent_with_links(self):
+        parent = tracing.TraceContext('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', 1700000000123)
+        other = tracing.TraceContext('5759e988bd862e3fe1be46a994272793', 'a0f067aa0ba902b7', None)
+        with tracing.span('s3.put_object', parent=parent, links=[other]):
+            pass
+        span, = self.spans
+        self.assertEqual(parent.trace_id, span['trace_id'])
+        self.assertEqual(parent.span_id, span['parent_id'])
+        self.assertEqual(1700000000123, span['request_time'])
+        self.assertEqual([{'trace_id': other.trace_id, 'span_id': other.span_id}], span['links'])
+
+    def test_failed_span_is_exported_with_the_error(self):
+        with self.assertRaises(ValueError):
+            with tracing.span('weather-api.get'):
+                raise ValueError('timeout')
+        self.assertEqual('error', self.spans[0]['status'])
+        self.assertEqual('timeout', self.spans[0]['attributes']['error'])
+
+    def test_worker_threads_continue_the_trace(self):
+        seen = []
+        with tracing.span('batch') as batch:
+            worker = threading.Thread(target=metrics.bound(lambda: seen.append(tracing.current_trace_id())))
+            worker.start()
+            worker.join()
+        self.assertEqual([batch.trace_id], seen)
+
+    def test_traced_handler(self):
+        @tracing.traced('weather-fetcher', context_from=tracing.context_from_event)
+        def handler(event, context):
+            return tracing.current_trace_id()
+
+        event = {'headers': {'traceparent': '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'}}
+        self.assertEqual('4bf92f3577b34da6a3ce929d0e0e4736', handler(event, None))
+        self.assertEqual('weather-fetcher', self.spans[0]['name'])
+
+    def test_log_records_carry_the_trace_id(self):
+        logger = logging.getLogger('tracing_test')
+        tracing.install_log_filter(logger)
+        tracing.install_log_filter(logger)
+        self.assertEqual(1, len(logger.filters))
+        with self.assertLogs(logger, level='INFO') as logs:
+            with tracing.span('request') as request:
+                logger.info('Fetching weather')
+            logger.info('Done')
+        self.assertEqual(
+            [f"INFO:tracing_test:[trace_id={request.trace_id}] Fetching weather", 'INFO:tracing_test:Done'],
+            logs.output
+        )
+
+
+class TestFileExporter(unittest.TestCase):
+
+    def test_spans_are_appended_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.jsonl')
+            with patch.dict('os.environ', {'TRACE_EXPORT_FILE': path}):
+                with tracing.span('request'):
+                    with tracing.span('sqs.send_message'):
+                        pass
+            spans = tracing.read_spans(path)
+        self.assertEqual(['sqs.send_message', 'request'], [span['name'] for span in spans])
+        self.assertGreaterEqual(spans[1]['duration_ms'], spans[0]['duration_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
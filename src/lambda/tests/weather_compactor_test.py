@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from ..weather_compactor.lambda_function import lambda_handler
+
+
+class TestWeatherCompactor(unittest.TestCase):
+
+    @patch.dict('os.environ', {'S3_BUCKET_NAME': 'test-weather-bucket', 'PARQUET_ROW_GROUP_SIZE': '5000'})
+    @patch('src.lambda.weather_compactor.lambda_function.aws_clients.client')
+    @patch('src.lambda.weather_compactor.lambda_function.compact_day')
+    def test_lambda_handler_compacts_requested_days(self, mock_compact_day, mock_client):
+        mock_compact_day.side_effect = lambda s3_client, bucket, day, **kwargs: {'date': day}
+
+        result = lambda_handler({'dates': ['2024-05-01', '2024-05-02']}, None)
+
+        self.assertEqual(200, result['statusCode'])
+        self.assertEqual([{'date': '2024-05-01'}, {'date': '2024-05-02'}], result['body'])
+        mock_compact_day.assert_called_with(
+            mock_client.return_value,
+            'test-weather-bucket',
+            '2024-05-02',
+            source_prefix='weather-data',
+            target_prefix='weather-parquet',
+            row_group_size=5000,
+            force=False
+        )
+
+    @patch.dict('os.environ', {'S3_BUCKET_NAME': 'test-weather-bucket'})
+    @patch('src.lambda.weather_compactor.lambda_function.aws_clients.client')
+    @patch('src.lambda.weather_compactor.lambda_function.compact_day')
+    def test_lambda_handler_defaults_to_yesterday(self, mock_compact_day, mock_client):
+        mock_compact_day.return_value = {}
+
+        lambda_handler({}, None)
+
+        mock_compact_day.assert_called_once()
+        self.assertRegex(mock_compact_day.call_args.args[2], r'^\d{4}-\d{2}-\d{2}$')
+
+    @patch.dict('os.environ', {'S3_BUCKET_NAME': 'test-weather-bucket'})
+    @patch('src.lambda.weather_compactor.lambda_function.aws_clients.client')
+    def test_lambda_handler_rejects_invalid_date(self, mock_client):
+        with self.assertRaises(ValueError):
+            lambda_handler({'date': '01/05/2024'}, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
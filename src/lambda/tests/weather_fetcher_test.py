@@ -1,9 +1,25 @@
+import json
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
 
-from ..weather_fetcher.lambda_function import lambda_handler
+import requests
+
+from ..common import aws_clients
+from ..common.messages import decode_message, clear_payload_caches
+from ..weather_fetcher.lambda_function import lambda_handler, circuit_breaker, response_cache, secret_cache
+from ..weather_fetcher.resilience import CircuitBreaker
 
 class TestWeatherFetcherLambdaFunction(unittest.TestCase):
+
+    def setUp(self):
+        aws_clients.reset()
+        secret_cache.clear()
+        response_cache.clear()
+        circuit_breaker.reset()
+        clear_payload_caches()
     @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
     @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
     @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
@@ -43,11 +59,14 @@ class TestWeatherFetcherLambdaFunction(unittest.TestCase):
             'email': 'test@example.com',
             'phone_number': '1234567890',
             'city_name': 'TestCity',
+            'country_code': 'TC',
             'data': {'weather': 'sunny'},
-            'response_time_ms': 123
+            'response_time_ms': 123,
+            'cache_status': 'miss'
         }
 
         mock_sqs_client.send_message.assert_called_once()
+        self.assertEqual(64, len(response.pop('message_key')))
         self.assertEqual(expected_response, response)
 
 
@@ -110,3 +129,484 @@ class TestWeatherFetcherLambdaFunction(unittest.TestCase):
 
         self.assertEqual(500, response['statusCode'])
         self.assertIn('Failed to fetch weather data', response['body'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_api_key_is_cached_across_invocations(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+
+        lambda_handler({'city_name': 'FirstCity', 'country_code': 'TC'}, MagicMock())
+        lambda_handler({'city_name': 'SecondCity', 'country_code': 'TC'}, MagicMock())
+
+        mock_secrets_manager_client.get_secret_value.assert_called_once_with(SecretId='test-secret')
+        self.assertEqual(2, mock_requests_get.call_count)
+        self.assertEqual({'hits': 1, 'misses': 1, 'invalidations': 0}, secret_cache.stats())
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_rotated_api_key_is_refreshed_on_401(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+
+        mock_secrets_manager_client.get_secret_value.side_effect = [
+            {'SecretString': 'old-api-key'},
+            {'SecretString': 'new-api-key'}
+        ]
+        unauthorized_response = MagicMock()
+        unauthorized_response.status_code = 401
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.side_effect = [unauthorized_response, mock_weather_response]
+
+        response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertEqual(200, response['status_code'])
+        self.assertEqual('new-api-key', mock_requests_get.call_args.kwargs['params']['appid'])
+        self.assertEqual(1, secret_cache.stats()['invalidations'])
+        mock_sqs_client.send_message.assert_called_once()
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_repeated_city_is_served_from_cache(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.2
+        mock_requests_get.return_value = mock_weather_response
+
+        first = lambda_handler({'city_name': 'london', 'country_code': 'uk'}, MagicMock())
+        second = lambda_handler({'city_name': 'London', 'country_code': 'UK'}, MagicMock())
+
+        mock_requests_get.assert_called_once()
+        self.assertEqual('miss', first['cache_status'])
+        self.assertEqual('hit', second['cache_status'])
+        self.assertEqual({'weather': 'sunny'}, second['data'])
+        self.assertEqual('London', second['city_name'])
+        self.assertEqual(2, mock_sqs_client.send_message.call_count)
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30',
+        'FETCH_CONCURRENCY': '4'
+    })
+    def test_batch_fetches_each_city_once_and_sends_in_chunks(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+
+        def weather_response(url, params, timeout):
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = {'name': params['q']}
+            response.elapsed.total_seconds.return_value = 0.1
+            return response
+        mock_requests_get.side_effect = weather_response
+        mock_sqs_client.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id']} for entry in Entries]
+        }
+
+        cities = [('London', 'UK'), ('london', 'uk'), ('Melbourne', 'AU'), ('Paris', 'FR')]
+        batch = [
+            {'city_name': cities[index % 4][0], 'country_code': cities[index % 4][1],
+             'notification_type': 'email', 'email': f'user{index}@example.com'}
+            for index in range(11)
+        ]
+        batch.append({'country_code': 'TC'})
+
+        response = lambda_handler({'batch': batch}, MagicMock())
+
+        self.assertEqual(3, mock_requests_get.call_count)
+        self.assertEqual(3, response['cities_fetched'])
+        self.assertEqual(11, response['queued'])
+        self.assertEqual(1, response['failed'])
+        self.assertEqual('error', response['results'][11]['status'])
+        self.assertEqual(['queued'] * 11, [result['status'] for result in response['results'][:11]])
+
+        self.assertEqual(2, mock_sqs_client.send_message_batch.call_count)
+        sent_entries = [entry for call in mock_sqs_client.send_message_batch.call_args_list
+                        for entry in call.kwargs['Entries']]
+        self.assertEqual(10, len(mock_sqs_client.send_message_batch.call_args_list[0].kwargs['Entries']))
+        self.assertEqual(11, len(sent_entries))
+        first_message = decode_message(sent_entries[0]['MessageBody'])
+        self.assertEqual('user0@example.com', first_message['email'])
+        self.assertEqual('London', first_message['city_name'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_batch_reports_per_item_failures(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+
+        def weather_response(url, params, timeout):
+            if params['q'] == 'Nowhere,XX':
+                raise Exception('city not found')
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = {'name': params['q']}
+            response.elapsed.total_seconds.return_value = 0.1
+            return response
+        mock_requests_get.side_effect = weather_response
+        mock_sqs_client.send_message_batch.return_value = {
+            'Successful': [{'Id': '0'}],
+            'Failed': [{'Id': '2', 'Code': 'InternalError', 'Message': 'SQS unavailable'}]
+        }
+
+        batch = [
+            {'city_name': 'London', 'country_code': 'UK'},
+            {'city_name': 'Nowhere', 'country_code': 'XX'},
+            {'city_name': 'Paris', 'country_code': 'FR'}
+        ]
+
+        response = lambda_handler({'batch': batch}, MagicMock())
+
+        self.assertEqual(1, response['queued'])
+        self.assertEqual(['queued', 'error', 'error'], [result['status'] for result in response['results']])
+        self.assertEqual('city not found', response['results'][1]['error'])
+        self.assertEqual('SQS unavailable', response['results'][2]['error'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'MAX_BATCH_SIZE': '2'
+    })
+    def test_batch_over_limit_is_rejected(self):
+        batch = [{'city_name': 'London', 'country_code': 'UK'}] * 3
+
+        response = lambda_handler({'batch': batch}, MagicMock())
+
+        self.assertEqual(500, response['statusCode'])
+        self.assertIn('the limit is 2', response['body'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.retry_policy._sleep')
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_rate_limited_upstream_returns_429(self, mock_requests_get, mock_boto3_client, mock_sleep):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        throttled_response = MagicMock()
+        throttled_response.status_code = 429
+        throttled_response.headers = {'Retry-After': '1'}
+        mock_requests_get.return_value = throttled_response
+
+        response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        # The first call and two retries, each waiting at least the requested second
+        self.assertEqual(3, mock_requests_get.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
+        self.assertTrue(all(call.args[0] >= 1 for call in mock_sleep.call_args_list))
+        self.assertEqual(429, response['statusCode'])
+        self.assertEqual('1', response['headers']['Retry-After'])
+        self.assertIn('Weather API rate limit exceeded', response['body'])
+        mock_sqs_client.send_message.assert_not_called()
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_stale_weather_is_served_when_upstream_fails(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+
+        event = {'city_name': 'TestCity', 'country_code': 'TC'}
+        lambda_handler(event, MagicMock())
+
+        # Expire the fresh entry, then make the upstream fail
+        with patch.object(response_cache, 'ttl_seconds', 0.0001):
+            mock_requests_get.return_value = None
+            mock_requests_get.side_effect = Exception('Weather API call failed')
+            response = lambda_handler(event, MagicMock())
+
+        self.assertEqual('stale', response['cache_status'])
+        self.assertEqual({'weather': 'sunny'}, response['data'])
+        self.assertEqual(2, mock_sqs_client.send_message.call_count)
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_open_circuit_fails_fast(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_boto3_client.return_value = mock_secrets_manager_client
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_requests_get.side_effect = Exception('Weather API call failed')
+
+        for index in range(circuit_breaker.failure_threshold):
+            lambda_handler({'city_name': f'City{index}', 'country_code': 'TC'}, MagicMock())
+        response = lambda_handler({'city_name': 'OtherCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertEqual(circuit_breaker.failure_threshold, mock_requests_get.call_count)
+        self.assertEqual(503, response['statusCode'])
+        self.assertIn('Weather API temporarily unavailable', response['body'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.rate_limiter')
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_local_rate_limit_does_not_close_a_half_open_circuit(self, mock_requests_get, mock_boto3_client, mock_rate_limiter):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_rate_limiter.acquire.return_value = False
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record(True, 0.1)
+
+        with patch('src.lambda.weather_fetcher.lambda_function.circuit_breaker', breaker):
+            response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertEqual(429, response['statusCode'])
+        mock_requests_get.assert_not_called()
+        # The trial was given back without an outcome, the next call probes the upstream
+        self.assertEqual('half_open', breaker.state)
+        self.assertTrue(breaker.allow())
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    def test_hanging_upstream_is_not_waited_for_beyond_the_slow_call_threshold(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        release = threading.Event()
+
+        class HangingHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                release.wait(5)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), HangingHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(release.set)
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_seconds=0.2)
+        environ = {
+            'WEATHER_API_SECRET_NAME': 'test-secret',
+            'WEATHER_API_URL': f"http://127.0.0.1:{server.server_address[1]}/weather",
+            'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+            'TIMEOUT': '30'
+        }
+
+        started = time.perf_counter()
+        with patch('src.lambda.weather_fetcher.lambda_function.circuit_breaker', breaker), \
+                patch('src.lambda.weather_fetcher.lambda_function.os.environ', environ):
+            response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual(500, response['statusCode'])
+        self.assertEqual('open', breaker.state)
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.rate_limiter')
+    @patch('src.lambda.weather_fetcher.lambda_function.retry_policy._sleep')
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_retry_refused_locally_reports_the_upstream_error(self, mock_requests_get, mock_boto3_client, mock_sleep,
+                                                               mock_rate_limiter):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_rate_limiter.acquire.side_effect = [True, False]
+        unavailable_response = MagicMock()
+        unavailable_response.status_code = 503
+        unavailable_response.headers = {}
+        unavailable_response.raise_for_status.side_effect = requests.HTTPError('503 Server Error: Service Unavailable')
+        mock_requests_get.return_value = unavailable_response
+
+        response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertEqual(1, mock_requests_get.call_count)
+        self.assertEqual(500, response['statusCode'])
+        self.assertNotIn('Retry-After', response['headers'])
+        self.assertIn('503 Server Error', json.loads(response['body'])['details'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.retry_policy._sleep')
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'TIMEOUT': '30'
+    })
+    def test_retry_backoff_is_not_a_slow_call(self, mock_requests_get, mock_boto3_client, mock_sleep):
+        mock_boto3_client.return_value.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_sleep.side_effect = lambda delay: time.sleep(0.2)
+        unavailable_response = MagicMock()
+        unavailable_response.status_code = 503
+        unavailable_response.headers = {}
+        weather_response = MagicMock()
+        weather_response.status_code = 200
+        weather_response.json.return_value = {'weather': 'sunny'}
+        weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.side_effect = [unavailable_response, weather_response]
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_seconds=0.1)
+
+        with patch('src.lambda.weather_fetcher.lambda_function.circuit_breaker', breaker):
+            response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        self.assertEqual({'weather': 'sunny'}, response['data'])
+        self.assertEqual('closed', breaker.state)
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'MESSAGE_CLAIM_CHECK': 'true'
+    })
+    def test_claim_check_message_carries_only_the_pointer(self, mock_requests_get, mock_boto3_client):
+        mock_clients = {'secretsmanager': MagicMock(), 'sqs': MagicMock(), 's3': MagicMock()}
+        mock_boto3_client.side_effect = lambda service: mock_clients[service]
+        mock_clients['secretsmanager'].get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_clients['sqs'].send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id']} for entry in Entries]
+        }
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': [{'description': 'sunny'}]}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+
+        batch = [{'city_name': 'London', 'country_code': 'UK', 'email': f'user{index}@example.com'} for index in range(3)]
+        lambda_handler({'batch': batch}, MagicMock())
+
+        # The three messages point to the same object, which is written once
+        mock_clients['s3'].put_object.assert_called_once()
+        stored_key = mock_clients['s3'].put_object.call_args.kwargs['Key']
+        self.assertTrue(stored_key.startswith('weather-raw/'))
+        for entry in mock_clients['sqs'].send_message_batch.call_args.kwargs['Entries']:
+            body = json.loads(entry['MessageBody'])
+            self.assertNotIn('data', body)
+            self.assertEqual({'bucket': 'test-weather-bucket', 'key': stored_key}, body['data_ref'])
+
+
+    @patch('src.lambda.weather_fetcher.lambda_function.boto3.client')
+    @patch('src.lambda.weather_fetcher.lambda_function.requests.get')
+    @patch('src.lambda.weather_fetcher.lambda_function.os.environ', {
+        'WEATHER_API_SECRET_NAME': 'test-secret',
+        'WEATHER_API_URL': 'https://api.testweather.com',
+        'SQS_QUEUE_URL': 'https://sqs.testqueue.com',
+        'MESSAGE_FORMAT': 'legacy'
+    })
+    def test_legacy_message_format(self, mock_requests_get, mock_boto3_client):
+        mock_secrets_manager_client = MagicMock()
+        mock_sqs_client = MagicMock()
+        mock_boto3_client.side_effect = lambda service: (
+            mock_secrets_manager_client if service == 'secretsmanager' else mock_sqs_client
+        )
+        mock_secrets_manager_client.get_secret_value.return_value = {'SecretString': 'test-api-key'}
+        mock_weather_response = MagicMock()
+        mock_weather_response.status_code = 200
+        mock_weather_response.json.return_value = {'weather': 'sunny'}
+        mock_weather_response.elapsed.total_seconds.return_value = 0.1
+        mock_requests_get.return_value = mock_weather_response
+
+        response = lambda_handler({'city_name': 'TestCity', 'country_code': 'TC'}, MagicMock())
+
+        sent_body = mock_sqs_client.send_message.call_args.kwargs['MessageBody']
+        self.assertEqual(response, json.loads(sent_body))
@@ -4,10 +4,24 @@ import json
 import os
 from datetime import datetime
 
-from ..weather_processor.lambda_function import lambda_handler, handle_notification
+from ..common.messages import encode_message, clear_payload_caches, message_key
+from ..weather_processor.lambda_function import lambda_handler, handle_notification, processed_messages, subscription_index
+from ..common.observations import read_observations
+
+
+def stored_observations(put_object_call):
+    return read_observations(
+        put_object_call.kwargs['Body'],
+        put_object_call.kwargs.get('ContentEncoding'),
+        put_object_call.kwargs['Key']
+    )
 
 class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
+    def setUp(self):
+        subscription_index.clear()
+        processed_messages.clear()
+
     @patch('src.lambda.weather_processor.lambda_function.boto3.client')
     def test_handle_notification_sms(self, mock_boto_client):
         mock_sns_client = MagicMock()
@@ -23,7 +37,7 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
         handle_notification(weather_body, sns_topic_arn)
 
         mock_sns_client.publish.assert_called_once_with(
-            TopicArn=sns_topic_arn,
+            PhoneNumber='+1234567890',
             Message='Weather condition for TestCity - Rainy',
             MessageAttributes={
                 'AWS.SNS.SMS.SenderID': {
@@ -83,7 +97,7 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
         self.assertEqual(2, mock_sns_client.publish.call_count)
         mock_sns_client.publish.assert_any_call(
-            TopicArn=sns_topic_arn,
+            PhoneNumber='+1234567890',
             Message='Weather condition for TestCity - Cloudy',
             MessageAttributes={
                 'AWS.SNS.SMS.SenderID': {
@@ -151,9 +165,12 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
         mock_s3_client.put_object.assert_called_once()
         call_args = mock_s3_client.put_object.call_args
         self.assertEqual(call_args.kwargs['Bucket'], 'test-weather-bucket')
-        self.assertTrue(call_args.kwargs['Key'].startswith('weather-data/'))
-        self.assertTrue(call_args.kwargs['Key'].endswith('.json'))
-        self.assertEqual(call_args.kwargs['ContentType'], 'application/json')
+        self.assertTrue(call_args.kwargs['Key'].startswith('weather-data/date='))
+        self.assertIn('/country=unknown/city=testcity/', call_args.kwargs['Key'])
+        self.assertTrue(call_args.kwargs['Key'].endswith('.jsonl.gz'))
+        self.assertEqual(call_args.kwargs['ContentType'], 'application/x-ndjson')
+        self.assertEqual(call_args.kwargs['ContentEncoding'], 'gzip')
+        self.assertEqual(stored_observations(call_args), [{'weather': [{'description': 'Sunny', 'temp': 25}]}])
 
         # Verify handle_notification was called
         mock_handle_notification.assert_called_once()
@@ -197,7 +214,7 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
         # Verify the weather data was formatted correctly
         call_args = mock_s3_client.put_object.call_args
-        stored_data = json.loads(call_args.kwargs['Body'])
+        stored_data = stored_observations(call_args)[0]
         self.assertEqual(stored_data['weather'][0]['description'], 'Rainy')
         self.assertEqual(stored_data['weather'][0]['temp'], 18)
 
@@ -230,10 +247,13 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
         context = {}
 
         # Execute
-        with self.assertRaises(Exception) as context:
-            lambda_handler(test_event, None)
+        result = lambda_handler(test_event, context)
 
-        self.assertTrue("S3 connection failed" in str(context.exception))
+        # The failed record is reported for retry and an error notification is sent
+        self.assertEqual(result['batchItemFailures'], [{'itemIdentifier': None}])
+        mock_sns_client.publish.assert_called_once()
+        error_message = json.loads(mock_sns_client.publish.call_args.kwargs['Message'])
+        self.assertEqual(error_message['details'], 'S3 connection failed')
 
     @patch.dict(os.environ, {
         'S3_BUCKET_NAME': 'test-weather-bucket',
@@ -301,7 +321,7 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
         # Verify the complete weather data was stored
         call_args = mock_s3_client.put_object.call_args
-        stored_data = json.loads(call_args.kwargs['Body'])
+        stored_data = stored_observations(call_args)[0]
         self.assertEqual(stored_data['weather'][0]['description'], 'Partly Cloudy')
         self.assertEqual(stored_data['weather'][0]['temp'], 22)
         self.assertEqual(stored_data['weather'][0]['humidity'], 65)
@@ -335,12 +355,11 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
         context = {}
 
-        with self.assertRaises(Exception) as context:
-            lambda_handler(test_event, None)
+        result = lambda_handler(test_event, context)
 
         mock_s3_client.put_object.assert_called_once()
         mock_sns_client.publish.assert_called_once()
-        self.assertTrue("S3 Error" in str(context.exception))
+        self.assertEqual(result['batchItemFailures'], [{'itemIdentifier': None}])
 
     def test_lambda_handler_missing_environment_variables(self):
         # Test without environment variables
@@ -414,10 +433,295 @@ class TestWeatherProcessorLambdaFunction(unittest.TestCase):
 
         # Verify the complex data was stored correctly
         call_args = mock_s3_client.put_object.call_args
-        stored_data = json.loads(call_args.kwargs['Body'])
+        stored_data = stored_observations(call_args)[0]
         self.assertEqual(stored_data['weather'][0]['description'], 'Heavy Rain')
         self.assertEqual(len(stored_data['forecast']), 2)
         self.assertEqual(stored_data['forecast'][0]['day'], 'tomorrow')
 
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic',
+        'RECORD_CONCURRENCY': '4'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    @patch('src.lambda.weather_processor.lambda_function.handle_notification')
+    def test_lambda_handler_processes_whole_batch(self, mock_handle_notification, mock_boto_client):
+        # Setup mocks
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+
+        # Test event with ten records, like the SQS event source mapping delivers
+        test_event = {
+            'Records': [{
+                'messageId': f'message-{index}',
+                'body': json.dumps({
+                    'notification_type': 'email',
+                    'data': {'weather': [{'description': 'Sunny'}]},
+                    'city_name': f'City{index}',
+                    'email': 'test@example.com'
+                })
+            } for index in range(10)]
+        }
+
+        # Execute
+        result = lambda_handler(test_event, {})
+
+        # Assertions
+        self.assertEqual(result['batchItemFailures'], [])
+        self.assertEqual(mock_s3_client.put_object.call_count, 10)
+        self.assertEqual(mock_handle_notification.call_count, 10)
+        notified_cities = {call.args[0]['city_name'] for call in mock_handle_notification.call_args_list}
+        self.assertEqual(notified_cities, {f'City{index}' for index in range(10)})
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic',
+        'RECORD_CONCURRENCY': '1'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    @patch('src.lambda.weather_processor.lambda_function.handle_notification')
+    def test_lambda_handler_reports_partial_batch_failure(self, mock_handle_notification, mock_boto_client):
+        # Setup mocks
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+
+        valid_body = json.dumps({
+            'notification_type': 'email',
+            'data': {'weather': [{'description': 'Sunny'}]},
+            'city_name': 'TestCity',
+            'email': 'test@example.com'
+        })
+        test_event = {
+            'Records': [
+                {'messageId': 'message-1', 'body': valid_body},
+                {'messageId': 'message-2', 'body': 'not-json'},
+                {'messageId': 'message-3', 'body': valid_body}
+            ]
+        }
+
+        # Execute
+        result = lambda_handler(test_event, {})
+
+        # Only the malformed record is retried
+        self.assertEqual(result['batchItemFailures'], [{'itemIdentifier': 'message-2'}])
+        mock_s3_client.put_object.assert_called_once()
+        self.assertEqual(len(stored_observations(mock_s3_client.put_object.call_args)), 2)
+        self.assertEqual(mock_handle_notification.call_count, 2)
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    @patch('src.lambda.weather_processor.lambda_function.handle_notification')
+    def test_lambda_handler_compact_and_claim_check_messages(self, mock_handle_notification, mock_boto_client):
+        clear_payload_caches()
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+        weather_data = {'weather': [{'description': 'Foggy'}]}
+        mock_s3_client.get_object.return_value = {
+            'Body': MagicMock(read=MagicMock(return_value=json.dumps(weather_data).encode('utf-8')))
+        }
+        message = {
+            'notification_type': 'email',
+            'email': 'test@example.com',
+            'city_name': 'London',
+            'country_code': 'UK',
+            'data': weather_data
+        }
+
+        test_event = {
+            'Records': [
+                {'messageId': 'compact', 'body': encode_message(message, compression_threshold=0)},
+                {'messageId': 'claim-check', 'body': encode_message(
+                    message, data_ref={'bucket': 'test-weather-bucket', 'key': 'weather-raw/abc.json'}
+                )}
+            ]
+        }
+
+        result = lambda_handler(test_event, {})
+
+        self.assertEqual(result['batchItemFailures'], [])
+        mock_s3_client.get_object.assert_called_once_with(Bucket='test-weather-bucket', Key='weather-raw/abc.json')
+        mock_s3_client.put_object.assert_called_once()
+        self.assertIn('/country=uk/city=london/', mock_s3_client.put_object.call_args.kwargs['Key'])
+        self.assertEqual([weather_data, weather_data], stored_observations(mock_s3_client.put_object.call_args))
+        for call in mock_handle_notification.call_args_list:
+            self.assertEqual('test@example.com', call.args[0]['email'])
+            self.assertEqual(weather_data, call.args[0]['data'])
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    def test_lambda_handler_deduplicates_notifications_of_a_batch(self, mock_boto_client):
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+        body = json.dumps({
+            'notification_type': 'both',
+            'data': {'weather': [{'description': 'Windy'}]},
+            'city_name': 'Wellington',
+            'phone_number': '+6412345678',
+            'email': 'test@example.com'
+        })
+        test_event = {'Records': [{'messageId': f'message-{index}', 'body': body} for index in range(3)]}
+
+        result = lambda_handler(test_event, {})
+
+        self.assertEqual(result['batchItemFailures'], [])
+        mock_s3_client.put_object.assert_called_once()
+        self.assertEqual(2, mock_sns_client.publish.call_count)
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    def test_lambda_handler_retries_messages_with_failed_notifications(self, mock_boto_client):
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+
+        def publish(**kwargs):
+            if kwargs.get('MessageAttributes', {}).get('email', {}).get('StringValue') == 'bounce@example.com':
+                raise Exception('Publish failed')
+        mock_sns_client.publish.side_effect = publish
+
+        def record(message_id, email):
+            return {'messageId': message_id, 'body': json.dumps({
+                'notification_type': 'email',
+                'data': {'weather': [{'description': 'Sunny'}]},
+                'city_name': 'TestCity',
+                'email': email
+            })}
+        test_event = {'Records': [record('message-1', 'test@example.com'), record('message-2', 'bounce@example.com')]}
+
+        result = lambda_handler(test_event, {})
+
+        self.assertEqual(result['batchItemFailures'], [{'itemIdentifier': 'message-2'}])
+        error_notifications = [call for call in mock_sns_client.publish.call_args_list
+                               if call.kwargs.get('Subject') == 'Weather Processing Error']
+        self.assertEqual(1, len(error_notifications))
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    def test_lambda_handler_skips_redelivered_messages(self, mock_boto_client):
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+        body = json.dumps({
+            'notification_type': 'both',
+            'data': {'weather': [{'description': 'Windy'}]},
+            'city_name': 'Wellington',
+            'phone_number': '+6412345678',
+            'email': 'test@example.com'
+        })
+        test_event = {'Records': [{'messageId': 'message-1', 'body': body}]}
+
+        lambda_handler(test_event, {})
+        result = lambda_handler(test_event, {})
+
+        self.assertEqual(result['batchItemFailures'], [])
+        mock_s3_client.put_object.assert_called_once()
+        self.assertEqual(2, mock_sns_client.publish.call_count)
+        self.assertEqual(1, processed_messages.stats()['skipped'])
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    def test_lambda_handler_retry_only_sends_failed_notifications(self, mock_boto_client):
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+        sms_attempts = []
+
+        def publish(**kwargs):
+            if kwargs.get('Subject') is None:
+                sms_attempts.append(kwargs)
+                if len(sms_attempts) == 1:
+                    raise Exception('Publish failed')
+        mock_sns_client.publish.side_effect = publish
+        body = json.dumps({
+            'notification_type': 'both',
+            'data': {'weather': [{'description': 'Windy'}]},
+            'city_name': 'Wellington',
+            'phone_number': '+6412345678',
+            'email': 'test@example.com'
+        })
+        test_event = {'Records': [{'messageId': 'message-1', 'body': body}]}
+
+        first = lambda_handler(test_event, {})
+        second = lambda_handler(test_event, {})
+
+        self.assertEqual(first['batchItemFailures'], [{'itemIdentifier': 'message-1'}])
+        self.assertEqual(second['batchItemFailures'], [])
+        mock_s3_client.put_object.assert_called_once()
+        emails = [call for call in mock_sns_client.publish.call_args_list
+                  if call.kwargs.get('Subject') == 'Weather condition for Wellington']
+        self.assertEqual(1, len(emails))
+        self.assertEqual(2, len(sms_attempts))
+
+    @patch.dict(os.environ, {
+        'S3_BUCKET_NAME': 'test-weather-bucket',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:region:account-id:weather-topic'
+    })
+    @patch('src.lambda.weather_processor.lambda_function.boto3.client')
+    def test_lambda_handler_suppresses_messages_with_the_same_key(self, mock_boto_client):
+        mock_s3_client = MagicMock()
+        mock_sns_client = MagicMock()
+        mock_boto_client.side_effect = lambda service: {
+            's3': mock_s3_client,
+            'sns': mock_sns_client
+        }[service]
+        message = {
+            'notification_type': 'email',
+            'email': 'test@example.com',
+            'city_name': 'Wellington',
+            'data': {'weather': [{'description': 'Windy'}]}
+        }
+        message['message_key'] = message_key(message)
+        body = encode_message(message)
+        test_event = {'Records': [{'messageId': 'message-1', 'body': body}, {'messageId': 'message-2', 'body': body}]}
+
+        result = lambda_handler(test_event, {})
+        redelivery = lambda_handler({'Records': [{'messageId': 'message-3', 'body': body}]}, {})
+
+        self.assertEqual(result['batchItemFailures'], [])
+        self.assertEqual(redelivery['batchItemFailures'], [])
+        mock_s3_client.put_object.assert_called_once()
+        self.assertEqual(1, len(stored_observations(mock_s3_client.put_object.call_args)))
+        mock_sns_client.publish.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from ..common.observations import partition_value, read_observations
+except ImportError:
+    from common.observations import partition_value, read_observations
+
+logger = logging.getLogger()
+
+# Flattened OpenWeatherMap current weather, one row per observation
+PARQUET_SCHEMA = pa.schema([
+    ('city', pa.string()),
+    ('country', pa.string()),
+    ('city_id', pa.int64()),
+    ('dt', pa.timestamp('ms', tz='UTC')),
+    ('lon', pa.float64()),
+    ('lat', pa.float64()),
+    ('temp', pa.float64()),
+    ('feels_like', pa.float64()),
+    ('temp_min', pa.float64()),
+    ('temp_max', pa.float64()),
+    ('pressure', pa.int64()),
+    ('humidity', pa.int64()),
+    ('visibility', pa.int64()),
+    ('wind_speed', pa.float64()),
+    ('wind_deg', pa.int64()),
+    ('wind_gust', pa.float64()),
+    ('clouds', pa.int64()),
+    ('weather_id', pa.int64()),
+    ('weather_main', pa.string()),
+    ('weather_description', pa.string())
+])
+
+MANIFEST_NAME = '_manifest.json'
+
+# weather-data/date=2024-05-01/hour=13/country=uk/city=london/<container>-<seq>.jsonl.gz
+PARTITIONED_KEY = re.compile(r'/date=[^/]+/hour=[^/]+/country=(?P<country>[^/]+)/city=(?P<city>[^/]+)/')
+
+
+def _number(value, kind):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return kind(value)
+
+
+def _timestamp_ms(value):
+    seconds = _number(value, int)
+    return seconds * 1000 if seconds is not None else None
+
+
+def flatten_observation(observation, city, country):
+    """
+    Flatten an OpenWeatherMap observation into a row of PARQUET_SCHEMA
+    """
+    main = observation.get('main') or {}
+    wind = observation.get('wind') or {}
+    coord = observation.get('coord') or {}
+    weather = (observation.get('weather') or [{}])[0]
+    return {
+        'city': city,
+        'country': country,
+        'city_id': _number(observation.get('id'), int),
+        'dt': _timestamp_ms(observation.get('dt')),
+        'lon': _number(coord.get('lon'), float),
+        'lat': _number(coord.get('lat'), float),
+        'temp': _number(main.get('temp'), float),
+        'feels_like': _number(main.get('feels_like'), float),
+        'temp_min': _number(main.get('temp_min'), float),
+        'temp_max': _number(main.get('temp_max'), float),
+        'pressure': _number(main.get('pressure'), int),
+        'humidity': _number(main.get('humidity'), int),
+        'visibility': _number(observation.get('visibility'), int),
+        'wind_speed': _number(wind.get('speed'), float),
+        'wind_deg': _number(wind.get('deg'), int),
+        'wind_gust': _number(wind.get('gust'), float),
+        'clouds': _number((observation.get('clouds') or {}).get('all'), int),
+        'weather_id': _number(weather.get('id'), int),
+        'weather_main': weather.get('main'),
+        'weather_description': weather.get('description')
+    }
+
+
+def list_keys(s3_client, bucket, prefix):
+    objects = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get('Contents', []))
+    return objects
+
+
+def source_objects(s3_client, bucket, day, source_prefix='weather-data'):
+    """
+    Raw objects of a day: the partitioned NDJSON objects and the original per-message JSON objects
+    """
+    legacy_prefix = f"{source_prefix}/{day.replace('-', '/')}-"
+    return list_keys(s3_client, bucket, f"{source_prefix}/date={day}/") + list_keys(s3_client, bucket, legacy_prefix)
+
+
+def group_rows(s3_client, bucket, objects):
+    """
+    Read the raw objects and group their flattened rows by (country, city) partition
+    """
+    partitions = defaultdict(lambda: {'rows': [], 'sources': []})
+    for item in objects:
+        key = item['Key']
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        observations = read_observations(response['Body'].read(), response.get('ContentEncoding'), key)
+        match = PARTITIONED_KEY.search(key)
+        for observation in observations:
+            if match:
+                country, city = match.group('country'), match.group('city')
+            else:
+                # Original objects carry no location in their key
+                country = partition_value((observation.get('sys') or {}).get('country') or 'unknown')
+                city = partition_value(observation.get('name') or 'unknown')
+            partition = partitions[(country, city)]
+            partition['rows'].append(flatten_observation(observation, city, country))
+            if not partition['sources'] or partition['sources'][-1] != item:
+                partition['sources'].append(item)
+    return partitions
+
+
+def fingerprint(sources):
+    digest = hashlib.sha256()
+    for item in sorted(sources, key=lambda source: source['Key']):
+        digest.update(f"{item['Key']}:{item.get('Size')}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_table(rows):
+    """
+    Typed table of a partition, duplicate observations (same city and measurement time) collapsed
+    and rows sorted by measurement time so row group statistics prune time ranges
+    """
+    unique = {}
+    for row in rows:
+        unique[(row['city_id'] or row['city'], row['dt'])] = row
+    ordered = sorted(unique.values(), key=lambda row: (row['dt'] is None, row['dt'] or 0))
+    return pa.Table.from_pylist(ordered, schema=PARQUET_SCHEMA)
+
+
+def load_manifest(s3_client, bucket, key):
+    if not list_keys(s3_client, bucket, key):
+        return {}
+    return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def compact_day(s3_client, bucket, day, source_prefix='weather-data', target_prefix='weather-parquet',
+                row_group_size=100000, force=False):
+    """
+    Compact the raw objects of a day (YYYY-MM-DD) into one Parquet object per day/country/city partition.
+    Output keys are deterministic and partitions whose sources did not change are skipped, so re-running
+    a day rewrites the same objects instead of adding rows.
+    """
+    manifest_key = f"{target_prefix}/date={day}/{MANIFEST_NAME}"
+    manifest = {} if force else load_manifest(s3_client, bucket, manifest_key)
+    partitions = group_rows(s3_client, bucket, source_objects(s3_client, bucket, day, source_prefix))
+
+    summary = {'date': day, 'partitions': len(partitions), 'written': 0, 'skipped': 0, 'rows': 0}
+    for (country, city), partition in sorted(partitions.items()):
+        name = f"country={country}/city={city}"
+        sources = fingerprint(partition['sources'])
+        if manifest.get(name, {}).get('sources') == sources:
+            summary['skipped'] += 1
+            continue
+
+        table = build_table(partition['rows'])
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=row_group_size, compression='zstd')
+        key = f"{target_prefix}/date={day}/{name}/part-00000.parquet"
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=buffer.getvalue(),
+            ContentType='application/vnd.apache.parquet'
+        )
+        logger.info(f"Compacted {len(partition['sources'])} objects into {table.num_rows} rows at {key}")
+        manifest[name] = {'key': key, 'sources': sources, 'rows': table.num_rows}
+        summary['written'] += 1
+        summary['rows'] += table.num_rows
+
+    if summary['written']:
+        # The manifest is written last, a failed run is simply compacted again
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps(manifest, sort_keys=True),
+            ContentType='application/json'
+        )
+    return summary
+
+
+def main(argv=None):
+    """
+    Compact days of a local bucket, e.g. from src/lambda:
+    python -m weather_compactor.compaction --root ./local-s3 --bucket weather --date 2024-05-01
+    """
+    try:
+        from ..common.local_s3 import LocalS3Client
+    except ImportError:
+        from common.local_s3 import LocalS3Client
+
+    parser = argparse.ArgumentParser(description='Compact raw weather observations into Parquet')
+    parser.add_argument('--root', required=True, help='directory standing in for S3')
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--date', action='append', required=True, help='day to compact, YYYY-MM-DD')
+    parser.add_argument('--force', action='store_true', help='rewrite partitions whose sources did not change')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    s3_client = LocalS3Client(args.root)
+    for day in args.date:
+        datetime.strptime(day, '%Y-%m-%d')
+        print(json.dumps(compact_day(s3_client, args.bucket, day, force=args.force)))
+
+
+if __name__ == '__main__':
+    main()
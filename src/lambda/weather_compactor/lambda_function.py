@@ -0,0 +1,54 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+import logging
+
+try:
+    from ..common import aws_clients
+    from .compaction import compact_day
+except ImportError:
+    from common import aws_clients
+    from compaction import compact_day
+
+log_level_name = os.environ.get('LOG_LEVEL', 'INFO')
+log_level = getattr(logging, log_level_name.upper(), logging.INFO)
+logger = logging.getLogger()
+logger.setLevel(log_level)
+
+def lambda_handler(event, context):
+    """
+    Weather Compactor Lambda - Compacts the raw weather objects of a day into Parquet partitions.
+    The day defaults to yesterday (UTC), a 'date' or 'dates' key in the event compacts other days.
+    """
+
+    logger.info(f"Received event: {json.dumps(event)}")
+    try:
+        s3_bucket = os.environ['S3_BUCKET_NAME']
+        days = (event or {}).get('dates') or [(event or {}).get('date') or
+                                              (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')]
+        for day in days:
+            datetime.strptime(day, '%Y-%m-%d')
+
+        s3_client = aws_clients.client('s3')
+        summaries = [
+            compact_day(
+                s3_client,
+                s3_bucket,
+                day,
+                source_prefix=os.environ.get('SOURCE_PREFIX', 'weather-data'),
+                target_prefix=os.environ.get('PARQUET_PREFIX', 'weather-parquet'),
+                row_group_size=int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '100000')),
+                force=bool((event or {}).get('force'))
+            )
+            for day in days
+        ]
+        logger.info(f"Compaction summary: {json.dumps(summaries)}")
+        return {
+            'statusCode': 200,
+            'body': summaries
+        }
+
+    except Exception as e:
+        # Scheduled invocations are retried by Lambda and counted by the errors alarm
+        logger.error(f"Error compacting weather data: {str(e)}")
+        raise
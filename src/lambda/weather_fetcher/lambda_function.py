@@ -1,66 +1,132 @@
 import json
-import boto3
-import requests
 import os
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# AWS clients and the HTTP session resolve through these modules, so lambda_function.boto3.client and
+# lambda_function.requests.get can be patched. requests is not loaded when HTTP_CLIENT=urllib3.
+import boto3
+if os.environ.get('HTTP_CLIENT', 'requests') != 'urllib3':
+    import requests
+
+try:
+    from ..common import aws_clients, metrics, tracing
+    from ..common.messages import encode_message, message_key, store_payload
+    from ..common.single_flight import SingleFlight
+    from .resilience import (
+        TokenBucket, RetryBudget, RetryPolicy, CircuitBreaker, CircuitOpenError, UpstreamThrottledError, parse_retry_after
+    )
+    from .response_cache import (
+        ResponseCache, normalize_city_key, CACHE_HIT, CACHE_SHARED_HIT, CACHE_MISS, CACHE_COALESCED, CACHE_STALE
+    )
+    from .secret_cache import SecretCache
+    from .subscription_store import Schedule, subscription_store_from_url
+except ImportError:
+    from common import aws_clients, metrics, tracing
+    from common.messages import encode_message, message_key, store_payload
+    from common.single_flight import SingleFlight
+    from resilience import (
+        TokenBucket, RetryBudget, RetryPolicy, CircuitBreaker, CircuitOpenError, UpstreamThrottledError, parse_retry_after
+    )
+    from response_cache import (
+        ResponseCache, normalize_city_key, CACHE_HIT, CACHE_SHARED_HIT, CACHE_MISS, CACHE_COALESCED, CACHE_STALE
+    )
+    from secret_cache import SecretCache
+    from subscription_store import Schedule, subscription_store_from_url
 
 log_level_name = os.environ.get('LOG_LEVEL', 'INFO')
 log_level = getattr(logging, log_level_name.upper(), logging.INFO)
 logger = logging.getLogger()
 logger.setLevel(log_level)
+tracing.install_log_filter(logger)
+
+# The Weather API key is kept for SECRET_CACHE_TTL seconds instead of being read on every request
+secret_cache = SecretCache(ttl_seconds=int(os.environ.get('SECRET_CACHE_TTL', '300')))
+
+# Maximum number of entries accepted by one SendMessageBatch call
+SQS_BATCH_SIZE = 10
+
+# Weather responses are cached per normalized city for WEATHER_CACHE_TTL seconds
+response_cache = ResponseCache.from_environment()
+
+# Concurrent fetches of the same city within the container share one upstream call
+single_flight = SingleFlight()
+
+# Client-side protection of the Weather API plan: a token bucket per container (60 calls per minute
+# with the defaults) and retries of 429/5xx answers bounded by a retry budget
+rate_limiter = TokenBucket(
+    rate=float(os.environ.get('WEATHER_API_RATE_LIMIT', '1')),
+    capacity=int(os.environ.get('WEATHER_API_BURST', '60'))
+)
+retry_policy = RetryPolicy(
+    max_retries=int(os.environ.get('WEATHER_API_MAX_RETRIES', '2')),
+    base_delay=float(os.environ.get('WEATHER_API_RETRY_BASE_DELAY', '0.2')),
+    max_delay=float(os.environ.get('WEATHER_API_MAX_RETRY_DELAY', '5')),
+    budget=RetryBudget(ratio=float(os.environ.get('WEATHER_API_RETRY_BUDGET', '0.2')))
+)
+
+# Fail fast while the Weather API keeps failing or answering slowly. WEATHER_API_SLOW_CALL_MS also caps the
+# time an attempt waits for the Weather API, whatever TIMEOUT says.
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get('WEATHER_API_BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.environ.get('WEATHER_API_BREAKER_RESET', '30')),
+    slow_call_seconds=float(os.environ.get('WEATHER_API_SLOW_CALL_MS', '5000')) / 1000
+)
 
+# Recurring subscriptions notified by schedule_handler, e.g. dynamodb://weather-subscriptions
+subscription_store = subscription_store_from_url(os.environ.get('SUBSCRIPTION_STORE'))
+
+# EMF metric names of the response cache statuses
+CACHE_METRICS = {
+    CACHE_HIT: 'CacheHits',
+    CACHE_SHARED_HIT: 'CacheHits',
+    CACHE_MISS: 'CacheMisses',
+    CACHE_COALESCED: 'CacheCoalesced',
+    CACHE_STALE: 'CacheStale'
+}
+
+@metrics.instrumented('weather-fetcher')
+@tracing.traced('weather-fetcher', context_from=tracing.context_from_event)
 def lambda_handler(event, context):
     """
-    Weather Fetcher Lambda - Fetches weather data and sends to SQS
+    Weather Fetcher Lambda - Fetches weather data and sends to SQS.
+    An event with a 'batch' list fetches several cities and enqueues one message per entry.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
+    # The whole event is only serialized for debugging, the per-invocation EMF record has the figures
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received event: {json.dumps(event)}")
 
-    # Initialize AWS clients for secrets manager and SQS
-    secrets_client = boto3.client('secretsmanager')
-    sqs_client = boto3.client('sqs')
+    if 'batch' in event:
+        metrics.set_property('Mode', 'batch')
+        metrics.set_property('TraceId', tracing.current_trace_id())
+        return handle_batch(event['batch'])
+    metrics.set_property('Mode', 'single')
+    metrics.set_property('TraceId', tracing.current_trace_id())
 
     try:
-        # Get the Weather API key from Secrets Manager
-        secret_name = os.environ['WEATHER_API_SECRET_NAME']
-        response = secrets_client.get_secret_value(SecretId=secret_name)
-        api_key = response['SecretString']
-
-        # Extract city name and country code from the input event and form query parameters
+        # Extract city name and country code from the input event
         city_name = event['city_name']
         country_code = event['country_code']
-        city = f"{city_name},{country_code}"
-        query_params = {'q': city, 'appid': api_key}
-        email = event.get('email','')
-        phone_number = event.get('phone_number','')
-        notification_type = event.get('notification_type','')
 
-        # Prepare a weather request
-        api_url = os.environ['WEATHER_API_URL']
-        timeout = int(os.environ.get('TIMEOUT', '30'))
+        weather = fetch_weather(city_name, country_code)
 
-        logger.info(f"Making GET request to: {api_url} for {city}")
-
-        weatherResponse = requests.get(api_url, params=query_params, timeout=timeout)
-        weatherResponse.raise_for_status()
         # Populate response
-        response = {
-            'status_code': weatherResponse.status_code,
-            'notification_type': notification_type,
-            'email': email,
-            'phone_number': phone_number,
-            'city_name': city_name,
-            'data': weatherResponse.json(),
-            'response_time_ms': int(weatherResponse.elapsed.total_seconds() * 1000)
-        }
+        response = build_message(event, weather)
 
-        logger.info(f"Response: {response}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Response: {json.dumps(response)}")
         # Prepare SQS request
         queue_url = os.environ['SQS_QUEUE_URL']
-        sqs = boto3.client('sqs')
-        sqs.send_message(
-            QueueUrl = queue_url,
-            MessageBody = json.dumps(response)
-        )
+        sqs_client = aws_clients.client('sqs')
+        body = message_body(response)
+        with metrics.timer('SqsSend'), tracing.span('sqs.send_message'):
+            sqs_client.send_message(
+                QueueUrl = queue_url,
+                MessageBody = body,
+                MessageAttributes = tracing.message_attributes()
+            )
+        metrics.count('MessagesQueued')
 
 
         # Return weatherResponse and metadata
@@ -68,14 +134,390 @@ def lambda_handler(event, context):
 
     except Exception as e:
         logger.error(f"Error: {str(e)}")
+        return error_response(e)
+
+# Fetch every distinct city of a batch once, then enqueue one message per entry
+def handle_batch(entries):
+    try:
+        max_batch_size = int(os.environ.get('MAX_BATCH_SIZE', '500'))
+        if not isinstance(entries, list) or not entries:
+            raise ValueError('batch must be a non-empty list')
+        if len(entries) > max_batch_size:
+            raise ValueError(f"batch has {len(entries)} entries, the limit is {max_batch_size}")
+        queue_url = os.environ['SQS_QUEUE_URL']
+        metrics.record('BatchSize', len(entries), metrics.COUNT)
+
+        results = []
+        cities = {}
+        for index, entry in enumerate(entries):
+            result = {'index': index, 'city_name': entry.get('city_name') if isinstance(entry, dict) else None}
+            results.append(result)
+            try:
+                cache_key = normalize_city_key(entry['city_name'], entry['country_code'])
+            except (KeyError, TypeError, AttributeError) as e:
+                result.update(status='error', error=f"Invalid entry, missing or malformed {str(e)}")
+                continue
+            # Entries for the same normalized city share one fetch
+            cities.setdefault(cache_key, []).append(index)
+
+        weather_by_city = fetch_cities({
+            cache_key: (entries[indexes[0]]['city_name'], entries[indexes[0]]['country_code'])
+            for cache_key, indexes in cities.items()
+        })
+
+        messages = []
+        for cache_key, indexes in cities.items():
+            weather = weather_by_city[cache_key]
+            for index in indexes:
+                if isinstance(weather, Exception):
+                    results[index].update(status='error', error=str(weather))
+                else:
+                    results[index]['cache_status'] = weather['cache_status']
+                    messages.append((index, build_message(entries[index], weather)))
+
+        send_messages(queue_url, messages, results)
+
+        queued = sum(1 for result in results if result.get('status') == 'queued')
+        metrics.record('CitiesFetched', len(cities), metrics.COUNT)
+        metrics.count('MessagesQueued', queued)
+        metrics.count('MessagesFailed', len(results) - queued)
+        logger.info(f"Batch of {len(entries)} entries: {len(cities)} cities fetched, {queued} messages queued")
         return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': 'Failed to fetch weather data',
-                'details': str(e)
-            })
+            'status_code': 200,
+            'cities_fetched': len(cities),
+            'queued': queued,
+            'failed': len(results) - queued,
+            'results': results
         }
+
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        return error_response(e)
+
+@metrics.instrumented('weather-scheduler')
+@tracing.traced('weather-scheduler')
+def schedule_handler(event, context):
+    """
+    Weather Scheduler Lambda - Invoked on a schedule, notifies the subscriptions that are due.
+    Each city is fetched once and its subscribers are fanned out through SQS to the weather processor.
+    """
+    metrics.set_property('Mode', 'schedule')
+    metrics.set_property('TraceId', tracing.current_trace_id())
+    try:
+        return handle_schedule(time.time())
+    except Exception as e:
+        # Scheduled invocations are retried by Lambda and counted by the errors alarm
+        logger.error(f"Error running the subscription schedule: {str(e)}")
+        raise
+
+# Fetch every city with due subscriptions once and queue its subscribers, a few recipients per message
+def handle_schedule(now):
+    queue_url = os.environ['SQS_QUEUE_URL']
+    # Cities beyond the limit stay due for the next run, which keeps a run within the Weather API plan
+    max_cities = int(os.environ.get('SCHEDULE_MAX_CITIES', '50'))
+    recipients_per_message = int(os.environ.get('SCHEDULE_RECIPIENTS_PER_MESSAGE', '50'))
+
+    due = subscription_store.due(now)
+    cities = {}
+    for subscription in due:
+        cache_key = normalize_city_key(subscription.city_name, subscription.country_code)
+        if cache_key in cities or len(cities) < max_cities:
+            cities.setdefault(cache_key, []).append(subscription)
+    scheduled = sum(len(subscriptions) for subscriptions in cities.values())
+
+    weather_by_city = fetch_cities({
+        cache_key: (subscriptions[0].city_name, subscriptions[0].country_code)
+        for cache_key, subscriptions in cities.items()
+    })
+
+    messages = []
+    chunks = []
+    cities_failed = 0
+    for cache_key, subscriptions in cities.items():
+        weather = weather_by_city[cache_key]
+        if isinstance(weather, Exception):
+            # The subscriptions stay due and are tried again by the next run
+            cities_failed += 1
+            continue
+        for start in range(0, len(subscriptions), recipients_per_message):
+            chunk = subscriptions[start:start + recipients_per_message]
+            entry = {
+                'city_name': chunk[0].city_name,
+                'country_code': chunk[0].country_code,
+                'recipients': [subscription.recipient() for subscription in chunk],
+                # The observation of a city is stored once, whatever the number of its messages
+                'store_observation': start == 0
+            }
+            messages.append((len(chunks), build_message(entry, weather)))
+            chunks.append(chunk)
+
+    results = [{'index': index} for index in range(len(chunks))]
+    send_messages(queue_url, messages, results)
+
+    notified = 0
+    for result, chunk in zip(results, chunks):
+        if result.get('status') != 'queued':
+            continue
+        for subscription in chunk:
+            subscription_store.advance(subscription, Schedule(subscription.schedule).next_run(subscription.next_run_at, now))
+            notified += 1
+
+    queued = sum(1 for result in results if result.get('status') == 'queued')
+    metrics.count('SubscriptionsDue', len(due))
+    metrics.count('SubscriptionsNotified', notified)
+    metrics.count('SubscriptionsDeferred', len(due) - scheduled)
+    metrics.record('CitiesFetched', len(cities), metrics.COUNT)
+    metrics.count('MessagesQueued', queued)
+    logger.info(
+        f"Schedule run: {len(due)} subscriptions due, {len(cities)} cities fetched ({cities_failed} failed), "
+        f"{queued} messages queued for {notified} subscriptions, {len(due) - scheduled} deferred"
+    )
+    return {
+        'status_code': 200,
+        'due': len(due),
+        'cities_fetched': len(cities),
+        'cities_failed': cities_failed,
+        'queued': queued,
+        'notified': notified,
+        'deferred': len(due) - scheduled
+    }
+
+# Fetch several cities concurrently, failures are returned in place of the weather
+def fetch_cities(cities):
+    if not cities:
+        return {}
+
+    def fetch(city):
+        try:
+            return fetch_weather(*city)
+        except Exception as e:
+            logger.error(f"Error fetching weather for {city[0]},{city[1]}: {str(e)}")
+            return e
+
+    max_workers = min(int(os.environ.get('FETCH_CONCURRENCY', '8')), len(cities))
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        return dict(zip(cities.keys(), executor.map(metrics.bound(fetch), cities.values())))
+
+# Send (index, message) pairs with send_message_batch, 10 messages per call
+def send_messages(queue_url, messages, results):
+    sqs_client = aws_clients.client('sqs')
+    for start in range(0, len(messages), SQS_BATCH_SIZE):
+        chunk = messages[start:start + SQS_BATCH_SIZE]
+        try:
+            with metrics.timer('SqsSend'), tracing.span('sqs.send_message_batch', messages=len(chunk)):
+                attributes = tracing.message_attributes()
+                entries = [
+                    {'Id': str(index), 'MessageBody': message_body(message), 'MessageAttributes': attributes}
+                    for index, message in chunk
+                ]
+                response = sqs_client.send_message_batch(QueueUrl = queue_url, Entries = entries)
+        except Exception as e:
+            logger.error(f"Error sending messages to SQS: {str(e)}")
+            for index, _ in chunk:
+                results[index].update(status='error', error=str(e))
+            continue
+        for successful in response.get('Successful', []):
+            results[int(successful['Id'])]['status'] = 'queued'
+        for failed in response.get('Failed', []):
+            results[int(failed['Id'])].update(status='error', error=failed.get('Message', failed['Code']))
+
+# Message sent to the weather processor for one request entry
+def build_message(entry, weather):
+    message = {
+        'status_code': weather['status_code'],
+        'notification_type': entry.get('notification_type',''),
+        'email': entry.get('email',''),
+        'phone_number': entry.get('phone_number',''),
+        'city_name': entry['city_name'],
+        'country_code': entry['country_code'],
+        'data': weather['data'],
+        'response_time_ms': weather['response_time_ms'],
+        'cache_status': weather['cache_status']
+    }
+    if entry.get('recipients'):
+        message['recipients'] = entry['recipients']
+    if entry.get('store_observation') is False:
+        message['store_observation'] = False
+    # Lets the processor recognise the same message delivered or sent twice
+    message['message_key'] = message_key(message)
+    return message
+
+# Serialize a message for SQS, in the compact envelope unless MESSAGE_FORMAT is 'legacy'
+def message_body(message):
+    if os.environ.get('MESSAGE_FORMAT', 'compact') == 'legacy':
+        return json.dumps(message)
+
+    data_ref = None
+    if os.environ.get('MESSAGE_CLAIM_CHECK', 'false').lower() == 'true':
+        # Claim-check mode: the weather data goes to S3 once and the message only carries its location
+        data_ref = store_payload(os.environ['S3_BUCKET_NAME'], message['data'])
+    return encode_message(
+        message,
+        compression=os.environ.get('MESSAGE_COMPRESSION', 'zlib'),
+        compression_threshold=int(os.environ.get('MESSAGE_COMPRESSION_THRESHOLD', '2048')),
+        data_ref=data_ref
+    )
+
+def error_response(e):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if isinstance(e, UpstreamThrottledError):
+        status_code = 429
+        error = 'Weather API rate limit exceeded'
+        if e.retry_after is not None:
+            headers['Retry-After'] = str(int(e.retry_after))
+    elif isinstance(e, CircuitOpenError):
+        status_code = 503
+        error = 'Weather API temporarily unavailable'
+    else:
+        status_code = 500
+        error = 'Failed to fetch weather data'
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': json.dumps({
+            'error': error,
+            'details': str(e)
+        })
+    }
+
+# Get the current weather of a city, from the response cache when possible
+def fetch_weather(city_name, country_code):
+    cache_key = normalize_city_key(city_name, country_code)
+    started = time.perf_counter()
+    data, cache_status = response_cache.get(cache_key)
+    if cache_status != CACHE_MISS:
+        metrics.count(CACHE_METRICS[cache_status])
+        logger.debug(f"Weather for {cache_key} served from cache ({cache_status})")
+        return {
+            'status_code': 200,
+            'data': data,
+            'response_time_ms': int((time.perf_counter() - started) * 1000),
+            'cache_status': cache_status
+        }
+
+    def load():
+        weatherResponse = request_weather(f"{city_name},{country_code}")
+        data = weatherResponse.json()
+        response_cache.put(cache_key, data)
+        return {
+            'status_code': weatherResponse.status_code,
+            'data': data,
+            'response_time_ms': int(weatherResponse.elapsed.total_seconds() * 1000)
+        }
+
+    try:
+        weather, shared = single_flight.do(cache_key, load)
+    except Exception as e:
+        # Serve the last-known-good observation rather than failing while the upstream is unavailable
+        data = response_cache.get_stale(cache_key)
+        if data is None:
+            raise
+        logger.warning(f"Serving stale weather for {cache_key}: {str(e)}")
+        metrics.count(CACHE_METRICS[CACHE_STALE])
+        return {
+            'status_code': 200,
+            'data': data,
+            'response_time_ms': int((time.perf_counter() - started) * 1000),
+            'cache_status': CACHE_STALE
+        }
+    if shared:
+        logger.debug(f"Weather for {cache_key} shared with a concurrent fetch")
+    metrics.count(CACHE_METRICS[CACHE_COALESCED if shared else cache_status])
+    return dict(weather, cache_status=CACHE_COALESCED if shared else cache_status)
+
+# Weather API key, cached across invocations
+def read_api_key(secret_name):
+    with metrics.timer('SecretFetch'):
+        api_key, hit = secret_cache.lookup(secret_name)
+    metrics.count('SecretCacheHit' if hit else 'SecretCacheMiss')
+    return api_key
+
+# Call the Weather API for a "city,country" query
+def request_weather(city):
+    secret_name = os.environ['WEATHER_API_SECRET_NAME']
+    api_key = read_api_key(secret_name)
+
+    # Prepare a weather request
+    api_url = os.environ['WEATHER_API_URL']
+    # An attempt slower than the breaker's slow-call threshold is a failure anyway, it is not waited for longer
+    timeout = min(float(os.environ.get('TIMEOUT', '30')), circuit_breaker.slow_call_seconds)
+
+    logger.debug(f"Making GET request to: {api_url} for {city}")
+
+    max_wait = float(os.environ.get('WEATHER_API_MAX_WAIT', '1'))
+    http_session = aws_clients.http_session()
+
+    # Duration of the last HTTP attempt, None until one is made. Backoff sleeps and rate limiter waits
+    # are not upstream latency, so they do not count towards a slow call.
+    upstream_seconds = None
+
+    def send():
+        nonlocal upstream_seconds
+        if not rate_limiter.acquire(max_wait):
+            metrics.count('UpstreamThrottled')
+            raise UpstreamThrottledError('Weather API client-side rate limit reached')
+        started = time.perf_counter()
+        try:
+            with metrics.timer('UpstreamCall'), tracing.span('weather-api.get', city=city):
+                return http_session.get(api_url, params={'q': city, 'appid': api_key}, timeout=timeout)
+        finally:
+            upstream_seconds = time.perf_counter() - started
+
+    def execute():
+        # Every attempt after the first one of an execute() is a retry
+        attempts = 0
+        last_response = None
+
+        def attempt():
+            nonlocal attempts, last_response
+            attempts += 1
+            last_response = send()
+            return last_response
+
+        try:
+            return retry_policy.execute(attempt)
+        except UpstreamThrottledError:
+            if last_response is None:
+                raise
+            # A retry refused by the local rate limiter, the answer that asked for it is the outcome
+            return last_response
+        finally:
+            metrics.count('UpstreamRetries', max(attempts - 1, 0))
+
+    if not circuit_breaker.allow():
+        metrics.count('CircuitOpen')
+        raise CircuitOpenError('Weather API circuit breaker is open')
+
+    upstream_failed = True
+    try:
+        weatherResponse = execute()
+        if weatherResponse.status_code == 401:
+            # The cached key may have been rotated, read it again and retry once
+            logger.warning("Weather API rejected the cached key, refreshing it from Secrets Manager")
+            secret_cache.invalidate(secret_name)
+            api_key = read_api_key(secret_name)
+            weatherResponse = execute()
+        upstream_failed = weatherResponse.status_code >= 500 or weatherResponse.status_code == 429
+    finally:
+        if upstream_seconds is None:
+            # Refused by the local rate limiter before any call, which says nothing about the upstream health.
+            # A retry refused after a 429 or 5xx answer is still recorded as a failure.
+            circuit_breaker.release()
+        else:
+            circuit_breaker.record(upstream_failed, upstream_seconds)
+
+    if weatherResponse.status_code == 429:
+        raise UpstreamThrottledError(
+            'Weather API rate limit exceeded',
+            retry_after=parse_retry_after(weatherResponse.headers.get('Retry-After'))
+        )
+    weatherResponse.raise_for_status()
+    logger.debug(
+        f"Secret cache stats: {secret_cache.stats()}, response cache stats: {response_cache.stats()}, "
+        f"single flight stats: {single_flight.stats()}, retries: {retry_policy.retries}, "
+        f"throttled: {rate_limiter.throttled}, circuit breaker: {circuit_breaker.state}"
+    )
+    return weatherResponse
@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+
+# Upstream answers worth retrying: rate limited or a server side failure
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class UpstreamThrottledError(Exception):
+    """
+    Raised when the Weather API rate limit, local or upstream, does not allow the call
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the Weather API while the circuit breaker is open
+    """
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter: allows `rate` calls per second on average with bursts of up to `capacity`
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self.throttled = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait=0):
+        """
+        Take a token, waiting up to max_wait seconds for one. Returns False when none became available.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = self._clock() + max_wait
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if self._clock() + wait > deadline:
+                with self._lock:
+                    self.throttled += 1
+                return False
+            self._sleep(wait)
+
+    def reset(self):
+        with self._lock:
+            self._tokens = float(self.capacity)
+            self._updated = self._clock()
+            self.throttled = 0
+
+
+class RetryBudget:
+    """
+    Limits retries to a ratio of the calls made, so a struggling upstream does not get multiplied load
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 1)
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+
+class RetryPolicy:
+    """
+    Retries 429 and 5xx answers with exponential backoff and full jitter, honoring Retry-After
+    """
+
+    def __init__(self, max_retries=2, base_delay=0.2, max_delay=5.0, budget=None, sleep=time.sleep, jitter=random.random):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._sleep = sleep
+        self._jitter = jitter
+        self.retries = 0
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Seconds to wait before the next attempt, None when the upstream asks to wait longer than max_delay
+        """
+        delay = self._jitter() * min(self.max_delay, self.base_delay * (2 ** attempt))
+        requested = parse_retry_after(retry_after)
+        if requested is not None:
+            if requested > self.max_delay:
+                return None
+            delay = max(delay, requested)
+        return delay
+
+    def execute(self, send):
+        """
+        Call send() until it returns a response that is not retryable or the retries are used up
+        """
+        if self.budget is not None:
+            self.budget.deposit()
+        attempt = 0
+        while True:
+            response = send()
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                return response
+            delay = self.backoff(attempt, response.headers.get('Retry-After'))
+            if delay is None or (self.budget is not None and not self.budget.try_spend()):
+                return response
+            self.retries += 1
+            attempt += 1
+            self._sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive failed or slow upstream calls. After
+    `reset_timeout` seconds a single trial call is let through to probe the upstream.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, slow_call_seconds=5.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        Whether a call may go to the upstream now
+        """
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, failed, duration_seconds):
+        """
+        Record the outcome of an allowed call, slow calls count as failures
+        """
+        failed = failed or duration_seconds > self.slow_call_seconds
+        with self._lock:
+            if not failed:
+                self._state = self.CLOSED
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                    self._state = self.OPEN
+                    self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def release(self):
+        """
+        Give back an allowed call that never reached the upstream, without recording an outcome
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+            self.rejected = 0
+
+
+def parse_retry_after(value):
+    """
+    Seconds requested by a Retry-After header, given either as a number of seconds or as an HTTP date
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    # The HTTP-date form is rare, its parser pulls in the email package so it is imported on use
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
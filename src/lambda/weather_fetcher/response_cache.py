@@ -0,0 +1,115 @@
+import logging
+import os
+import time
+
+try:
+    from ..common.cache import LRUCache
+    from ..common.observations import normalize_city_key
+    from ..common.stores import store_from_url
+except ImportError:
+    from common.cache import LRUCache
+    from common.observations import normalize_city_key
+    from common.stores import store_from_url
+
+logger = logging.getLogger()
+
+CACHE_HIT = 'hit'
+CACHE_SHARED_HIT = 'shared_hit'
+CACHE_MISS = 'miss'
+# Served by a concurrent upstream call for the same city rather than by the cache
+CACHE_COALESCED = 'coalesced'
+# Last-known-good data served past its TTL because the upstream is unavailable
+CACHE_STALE = 'stale'
+
+
+class ResponseCache:
+    """
+    Two-tier cache of OpenWeatherMap responses: an LRU kept by the warm container in front of
+    an optional store shared by all containers. Entries stay available for `stale_seconds` after
+    their TTL as a fallback for when the upstream fails.
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=256, shared_store=None, stale_seconds=3600, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.local = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds + stale_seconds)
+        self.shared_store = shared_store
+        self._clock = clock
+        self.shared_hits = 0
+        self.stale_hits = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            ttl_seconds=int(os.environ.get('WEATHER_CACHE_TTL', '300')),
+            max_entries=int(os.environ.get('WEATHER_CACHE_MAX_ENTRIES', '256')),
+            shared_store=store_from_url(os.environ.get('WEATHER_CACHE_STORE')),
+            stale_seconds=int(os.environ.get('WEATHER_CACHE_STALE_TTL', '3600'))
+        )
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    def get(self, key):
+        """
+        Return the fresh cached weather data for a normalized key with its cache status, data is None on a miss
+        """
+        if not self.enabled:
+            return None, CACHE_MISS
+
+        entry = self.local.get(key)
+        if entry is not None and self._age(entry) < self.ttl_seconds:
+            return entry['data'], CACHE_HIT
+
+        entry = self._get_shared(key)
+        if entry is not None and self._age(entry) < self.ttl_seconds:
+            self.local.put(key, entry, ttl_seconds=self.ttl_seconds + self.stale_seconds - self._age(entry))
+            self.shared_hits += 1
+            return entry['data'], CACHE_SHARED_HIT
+
+        return None, CACHE_MISS
+
+    def get_stale(self, key):
+        """
+        Return the last-known-good data for a key, even past its TTL, or None
+        """
+        if not self.enabled:
+            return None
+        entry = self.local.get(key) or self._get_shared(key)
+        if entry is None or self._age(entry) >= self.ttl_seconds + self.stale_seconds:
+            return None
+        self.stale_hits += 1
+        return entry['data']
+
+    def put(self, key, data):
+        if not self.enabled:
+            return
+        entry = {'data': data, 'fetched_at': self._clock()}
+        self.local.put(key, entry)
+        if self.shared_store is not None:
+            try:
+                self.shared_store.put(f"weather:{key}", entry, ttl_seconds=self.ttl_seconds + self.stale_seconds)
+            except Exception as e:
+                logger.warning(f"Shared weather cache write failed: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+        self.shared_hits = 0
+        self.stale_hits = 0
+
+    def stats(self):
+        return dict(self.local.stats(), shared_hits=self.shared_hits, stale_hits=self.stale_hits)
+
+    def _age(self, entry):
+        return self._clock() - entry['fetched_at']
+
+    def _get_shared(self, key):
+        if self.shared_store is None:
+            return None
+        try:
+            return self.shared_store.get(f"weather:{key}")
+        except Exception as e:
+            # The shared tier is an optimization, a failing store must not fail the request
+            logger.warning(f"Shared weather cache read failed: {str(e)}")
+            return None
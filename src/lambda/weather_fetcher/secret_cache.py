@@ -0,0 +1,83 @@
+import threading
+import time
+
+try:
+    from ..common import aws_clients
+except ImportError:
+    from common import aws_clients
+
+
+class SecretCache:
+    """
+    In-process cache of Secrets Manager values with a time-to-live, shared by warm invocations
+    """
+
+    def __init__(self, ttl_seconds=300, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Counters have their own lock, so cache hits never wait for a Secrets Manager call
+        self._stats_lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, secret_id):
+        """
+        Return the secret string, calling Secrets Manager only when the cached value is missing or expired
+        """
+        return self.lookup(secret_id)[0]
+
+    def lookup(self, secret_id):
+        """
+        (secret string, True when it came from the cache)
+        """
+        entry = self._entries.get(secret_id)
+        if entry is not None and entry[1] > self._clock():
+            self._count_hit()
+            return entry[0], True
+
+        with self._lock:
+            # Another thread may have refreshed the secret while we were waiting for the lock
+            entry = self._entries.get(secret_id)
+            if entry is not None and entry[1] > self._clock():
+                self._count_hit()
+                return entry[0], True
+
+            response = aws_clients.client('secretsmanager').get_secret_value(SecretId=secret_id)
+            value = response['SecretString']
+            self._entries[secret_id] = (value, self._clock() + self.ttl_seconds)
+            with self._stats_lock:
+                self.misses += 1
+            return value, False
+
+    def invalidate(self, secret_id):
+        """
+        Force the next get() to read the secret again, e.g. after the key was rotated
+        """
+        with self._lock:
+            removed = self._entries.pop(secret_id, None) is not None
+        if removed:
+            with self._stats_lock:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+    def _count_hit(self):
+        with self._stats_lock:
+            self.hits += 1
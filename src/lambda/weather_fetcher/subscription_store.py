@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+try:
+    from ..common import aws_clients
+except ImportError:
+    from common import aws_clients
+
+CHANNELS = ('sms', 'email')
+
+RATE_PATTERN = re.compile(r'^rate\((\d+) (minute|minutes|hour|hours|day|days)\)$')
+DAILY_PATTERN = re.compile(r'^daily\(([01]\d|2[0-3]):([0-5]\d)\)$')
+RATE_UNITS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Schedule:
+    """
+    When a subscription is notified: 'rate(30 minutes)' every interval, or 'daily(07:30)' once a day at a UTC time
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        rate = RATE_PATTERN.match(expression)
+        daily = DAILY_PATTERN.match(expression)
+        if rate is not None and int(rate.group(1)) > 0:
+            self.interval = int(rate.group(1)) * RATE_UNITS[rate.group(2).rstrip('s')]
+            self.time_of_day = None
+        elif daily is not None:
+            self.interval = None
+            self.time_of_day = (int(daily.group(1)), int(daily.group(2)))
+        else:
+            raise ValueError(f"Unsupported schedule {expression}, expected rate(<n> minutes|hours|days) or daily(HH:MM)")
+
+    def next_run(self, previous, now):
+        """
+        First run after `now` in the cadence of `previous`, runs missed while the scheduler was late are skipped
+        """
+        if self.interval is not None:
+            missed = int((now - previous) // self.interval) + 1 if now >= previous else 1
+            return previous + missed * self.interval
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        run = moment.replace(hour=self.time_of_day[0], minute=self.time_of_day[1], second=0, microsecond=0)
+        if run.timestamp() <= now:
+            run += timedelta(days=1)
+        return run.timestamp()
+
+
+class Subscription(namedtuple('Subscription', [
+    'subscription_id', 'city_name', 'country_code', 'channel', 'endpoint', 'schedule', 'next_run_at'
+])):
+    """
+    Recurring notification of the weather of a city to one SMS or email endpoint
+    """
+
+    @classmethod
+    def create(cls, city_name, country_code, channel, endpoint, schedule, first_run_at=None, subscription_id=None):
+        if channel not in CHANNELS:
+            raise ValueError(f"Unsupported channel {channel}")
+        Schedule(schedule)
+        return cls(
+            subscription_id or uuid.uuid4().hex,
+            city_name,
+            country_code,
+            channel,
+            endpoint,
+            schedule,
+            first_run_at if first_run_at is not None else time.time()
+        )
+
+    def recipient(self):
+        """
+        Contact fields of the notification, in the shape of an API request
+        """
+        return {
+            'notification_type': self.channel,
+            'email': self.endpoint if self.channel == 'email' else '',
+            'phone_number': self.endpoint if self.channel == 'sms' else ''
+        }
+
+
+class SubscriptionStore:
+    """
+    Scheduled subscriptions, queried by the scheduler for the ones that are due
+    """
+
+    def put(self, subscription):
+        raise NotImplementedError
+
+    def delete(self, subscription_id):
+        raise NotImplementedError
+
+    def due(self, now):
+        """
+        Subscriptions whose next run is at or before `now`, the longest overdue first
+        """
+        raise NotImplementedError
+
+    def advance(self, subscription, next_run_at):
+        """
+        Move the next run of a subscription, unless it changed since it was read
+        """
+        raise NotImplementedError
+
+
+class MemorySubscriptionStore(SubscriptionStore):
+    """
+    Process-local subscriptions, used by tests and local runs
+    """
+
+    def __init__(self, subscriptions=()):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        for subscription in subscriptions:
+            self.put(subscription)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def put(self, subscription):
+        with self._lock:
+            self._subscriptions[subscription.subscription_id] = subscription
+
+    def delete(self, subscription_id):
+        with self._lock:
+            self._subscriptions.pop(subscription_id, None)
+
+    def get(self, subscription_id):
+        return self._subscriptions.get(subscription_id)
+
+    def due(self, now):
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        return sorted(
+            (subscription for subscription in subscriptions if subscription.next_run_at <= now),
+            key=lambda subscription: subscription.next_run_at
+        )
+
+    def advance(self, subscription, next_run_at):
+        with self._lock:
+            current = self._subscriptions.get(subscription.subscription_id)
+            if current is None or current.next_run_at != subscription.next_run_at:
+                return False
+            self._subscriptions[subscription.subscription_id] = current._replace(next_run_at=next_run_at)
+            return True
+
+
+class DynamoDBSubscriptionStore(SubscriptionStore):
+    """
+    Subscriptions in a DynamoDB table keyed by 'subscription_id'. Due subscriptions are found with a
+    filtered scan, which reads the whole table once per scheduler run.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def put(self, subscription):
+        aws_clients.client('dynamodb').put_item(TableName=self.table_name, Item={
+            'subscription_id': {'S': subscription.subscription_id},
+            'city_name': {'S': subscription.city_name},
+            'country_code': {'S': subscription.country_code},
+            'channel': {'S': subscription.channel},
+            'endpoint': {'S': subscription.endpoint},
+            'schedule': {'S': subscription.schedule},
+            'next_run_at': {'N': repr(float(subscription.next_run_at))}
+        })
+
+    def delete(self, subscription_id):
+        aws_clients.client('dynamodb').delete_item(
+            TableName=self.table_name,
+            Key={'subscription_id': {'S': subscription_id}}
+        )
+
+    def due(self, now):
+        paginator = aws_clients.client('dynamodb').get_paginator('scan')
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            FilterExpression='next_run_at <= :now',
+            ExpressionAttributeValues={':now': {'N': repr(float(now))}}
+        )
+        subscriptions = [
+            Subscription(
+                item['subscription_id']['S'],
+                item['city_name']['S'],
+                item['country_code']['S'],
+                item['channel']['S'],
+                item['endpoint']['S'],
+                item['schedule']['S'],
+                float(item['next_run_at']['N'])
+            )
+            for page in pages
+            for item in page.get('Items', [])
+        ]
+        return sorted(subscriptions, key=lambda subscription: subscription.next_run_at)
+
+    def advance(self, subscription, next_run_at):
+        client = aws_clients.client('dynamodb')
+        try:
+            # Conditional, so overlapping scheduler runs advance a subscription only once
+            client.update_item(
+                TableName=self.table_name,
+                Key={'subscription_id': {'S': subscription.subscription_id}},
+                UpdateExpression='SET next_run_at = :next',
+                ConditionExpression='next_run_at = :previous',
+                ExpressionAttributeValues={
+                    ':next': {'N': repr(float(next_run_at))},
+                    ':previous': {'N': repr(float(subscription.next_run_at))}
+                }
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+
+def subscription_store_from_url(url):
+    """
+    Build a subscription store from a URL such as memory:// or dynamodb://table-name
+    """
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return MemorySubscriptionStore()
+    if parsed.scheme == 'dynamodb':
+        return DynamoDBSubscriptionStore(parsed.netloc)
+    raise ValueError(f"Unsupported subscription store URL: {url}")
+
+
+def main(argv=None):
+    """
+    Manage the scheduled subscriptions of a store, e.g. from src/lambda:
+    python -m weather_fetcher.subscription_store --store dynamodb://weather-subscriptions add --city London \
+        --country uk --channel sms --endpoint +1234567890 --schedule 'daily(07:30)'
+    """
+    parser = argparse.ArgumentParser(description='Manage scheduled weather subscriptions')
+    parser.add_argument('--store', default=os.environ.get('SUBSCRIPTION_STORE'), help='store URL, SUBSCRIPTION_STORE by default')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='register a subscription')
+    add.add_argument('--city', required=True)
+    add.add_argument('--country', default='')
+    add.add_argument('--channel', required=True, choices=CHANNELS)
+    add.add_argument('--endpoint', required=True)
+    add.add_argument('--schedule', required=True, help="rate(<n> minutes|hours|days) or daily(HH:MM)")
+    add.add_argument('--first-run-at', type=float, help='epoch seconds of the first notification, now by default')
+    remove = commands.add_parser('remove', help='remove a subscription')
+    remove.add_argument('--subscription-id', required=True)
+    args = parser.parse_args(argv)
+
+    # A memory store would be gone as soon as the command returns
+    if not args.store or urlparse(args.store).scheme == 'memory':
+        parser.error('--store or SUBSCRIPTION_STORE is required')
+    store = subscription_store_from_url(args.store)
+    if args.command == 'add':
+        try:
+            subscription = Subscription.create(
+                args.city, args.country, args.channel, args.endpoint, args.schedule, first_run_at=args.first_run_at
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        store.put(subscription)
+        print(json.dumps(subscription._asdict(), ensure_ascii=False))
+    else:
+        store.delete(args.subscription_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    from ..common.observations import normalize_city_key
+    from ..common.stores import MemoryStore, store_from_url
+    from .rules import observation_fields
+except ImportError:
+    from common.observations import normalize_city_key
+    from common.stores import MemoryStore, store_from_url
+    from rules import observation_fields
+
+logger = logging.getLogger()
+
+SUPPRESSED_UNCHANGED = 'unchanged'
+SUPPRESSED_COOLDOWN = 'cooldown'
+
+# Striped locks, so records of different cities are checked in parallel
+LOCK_STRIPES = 64
+
+
+def observation_state(data, message_id=None, now=None):
+    """
+    What a notification or a stored object says about an observation: its description and field values
+    """
+    weather = data.get('weather') or [{}]
+    return {
+        'observed_at': data.get('dt'),
+        'description': weather[0].get('description'),
+        'values': observation_fields(data),
+        'message_id': message_id,
+        'at': now
+    }
+
+
+def significant_change(previous, current, thresholds):
+    """
+    True when the description changed or a field moved by at least its threshold
+    """
+    if previous.get('description') != current.get('description'):
+        return True
+    for field, threshold in thresholds.items():
+        before = previous['values'].get(field)
+        after = current['values'].get(field)
+        if before is None or after is None:
+            if before != after:
+                return True
+        elif abs(after - before) >= threshold:
+            return True
+    return False
+
+
+class ChangeDetector:
+    """
+    Last state notified to each recipient of a city, and last observation stored for each city, so that
+    observations saying nothing new are not notified or stored again. A change is significant when the
+    description changes or a field moves by its threshold in `thresholds`, e.g. {"temp": 2}. Within
+    `cooldown_seconds` of a notification, a recipient is not notified again even of a significant change.
+    State expires after `state_ttl_seconds`, the next observation is then notified and stored.
+    """
+
+    def __init__(self, store=None, enabled=True, thresholds=None, cooldown_seconds=0, skip_unchanged_storage=False,
+                 state_ttl_seconds=86400, clock=time.time):
+        self.store = store if store is not None else MemoryStore()
+        self.enabled = enabled
+        self.thresholds = dict(thresholds or {})
+        self.cooldown_seconds = cooldown_seconds
+        self.skip_unchanged_storage = skip_unchanged_storage
+        self.state_ttl_seconds = state_ttl_seconds
+        self._clock = clock
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._stats_lock = threading.Lock()
+        self.suppressed = {SUPPRESSED_UNCHANGED: 0, SUPPRESSED_COOLDOWN: 0}
+        self.skipped_writes = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            store=store_from_url(os.environ.get('CHANGE_STATE_STORE')),
+            enabled=os.environ.get('CHANGE_DETECTION', 'false').lower() == 'true',
+            thresholds=json.loads(os.environ.get('CHANGE_THRESHOLDS') or '{}'),
+            cooldown_seconds=float(os.environ.get('CHANGE_COOLDOWN_SECONDS', '900')),
+            skip_unchanged_storage=os.environ.get('CHANGE_SKIP_UNCHANGED_STORAGE', 'false').lower() == 'true',
+            state_ttl_seconds=int(os.environ.get('CHANGE_STATE_TTL', '86400'))
+        )
+
+    def should_store(self, city_name, country_code, data, message_id=None):
+        """
+        False when the observation does not change significantly the last one stored for the city
+        """
+        if not self.enabled or not self.skip_unchanged_storage:
+            return True
+        key = f"change:stored:{normalize_city_key(city_name, country_code)}"
+        current = observation_state(data, message_id, self._clock())
+        with self._lock_of(key):
+            previous = self._get(key)
+            if previous is not None and not self._redelivered(previous, current) and \
+                    not self._newer_and_significant(previous, current):
+                with self._stats_lock:
+                    self.skipped_writes += 1
+                return False
+            self._put(key, current)
+        return True
+
+    def suppression(self, notification, country_code, data, message_id=None):
+        """
+        Why the notification says nothing new to its recipient, 'unchanged' or 'cooldown', None when it
+        has to be sent. A redelivery of the SQS message is sent again, unless another message was notified
+        since. The same request sent twice is a different message, and is suppressed.
+        """
+        if not self.enabled:
+            return None
+        city_key = normalize_city_key(notification.city_name, country_code)
+        key = f"change:notified:{city_key}:{notification.protocol}:{notification.endpoint}"
+        now = self._clock()
+        current = observation_state(data, message_id, now)
+        with self._lock_of(key):
+            previous = self._get(key)
+            reason = None
+            if previous is not None and not self._redelivered(previous, current):
+                if not self._newer_and_significant(previous, current):
+                    reason = SUPPRESSED_UNCHANGED
+                elif now - previous['at'] < self.cooldown_seconds:
+                    reason = SUPPRESSED_COOLDOWN
+            if reason is None:
+                self._put(key, current)
+                return None
+        with self._stats_lock:
+            self.suppressed[reason] += 1
+        return reason
+
+    def clear(self):
+        # Only process-local state is forgotten, a shared store keeps its state
+        if isinstance(self.store, MemoryStore):
+            self.store = MemoryStore()
+        with self._stats_lock:
+            self.suppressed = {SUPPRESSED_UNCHANGED: 0, SUPPRESSED_COOLDOWN: 0}
+            self.skipped_writes = 0
+
+    def stats(self):
+        return dict(self.suppressed, skipped_writes=self.skipped_writes)
+
+    def _newer_and_significant(self, previous, current):
+        # An observation older than the last one is old news
+        if previous['observed_at'] is not None and current['observed_at'] is not None \
+                and current['observed_at'] < previous['observed_at']:
+            return False
+        return significant_change(previous, current, self.thresholds)
+
+    def _redelivered(self, previous, current):
+        return current['message_id'] is not None and previous.get('message_id') == current['message_id']
+
+    def _lock_of(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def _get(self, key):
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            # Without its state an observation is treated as new, a repeated notification beats a lost one
+            logger.warning(f"Change state read failed for {key}: {str(e)}")
+            return None
+
+    def _put(self, key, state):
+        try:
+            self.store.put(key, state, ttl_seconds=self.state_ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Change state write failed for {key}: {str(e)}")
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+try:
+    from ..common.cache import LRUCache
+    from ..common.stores import store_from_url
+except ImportError:
+    from common.cache import LRUCache
+    from common.stores import store_from_url
+
+logger = logging.getLogger()
+
+# The observation of the message is stored in S3
+STAGE_STORED = 'stored'
+
+
+def notification_stage(protocol, endpoint):
+    """
+    Stage of a sent notification, the endpoint is hashed so recipients are not written to the store
+    """
+    return 'sent:' + hashlib.sha256(f"{protocol}:{endpoint}".encode('utf-8')).hexdigest()[:16]
+
+
+class ProcessedMessages:
+    """
+    Stages already completed for each message key, so a redelivered message skips the work that was
+    done before. A bounded in-memory seen-set answers redeliveries to the same container and an
+    optional shared store answers them across containers.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=86400, store=None, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._seen = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds, clock=clock)
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            max_entries=int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', '10000')),
+            ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL', '86400')),
+            store=store_from_url(os.environ.get('IDEMPOTENCY_STORE'))
+        )
+
+    def completed(self, key):
+        """
+        Stages completed for the message key, an empty set for a message seen for the first time
+        """
+        stages = self._seen.get(key)
+        if stages is not None:
+            return stages
+        stages = frozenset(self._load(key) or ())
+        if stages:
+            self._seen.put(key, stages)
+        return stages
+
+    def mark(self, key, *stages):
+        with self._lock:
+            completed = self.completed(key) | frozenset(stages)
+            self._seen.put(key, completed)
+        self._save(key, completed)
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def clear(self):
+        self._seen.clear()
+        with self._lock:
+            self.skipped = 0
+
+    def stats(self):
+        stats = self._seen.stats()
+        stats['skipped'] = self.skipped
+        return stats
+
+    def _load(self, key):
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(f"processed:{key}")
+        except Exception as e:
+            logger.warning(f"Idempotency store read failed: {str(e)}")
+            return None
+
+    def _save(self, key, stages):
+        if self.store is None:
+            return
+        try:
+            self.store.put(f"processed:{key}", sorted(stages), ttl_seconds=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Idempotency store write failed: {str(e)}")
+
+
+class BatchProgress:
+    """
+    Idempotency bookkeeping of one batch: the key carried by each message, the records that repeat
+    the key of an earlier record of the same batch and the stages completed by this batch
+    """
+
+    def __init__(self, processed_messages):
+        self.processed_messages = processed_messages
+        self._lock = threading.Lock()
+        self._owners = {}
+        self._pending = {}
+        self.keys = {}
+        self.duplicates = {}
+
+    def begin(self, message_id, key):
+        """
+        Stages already completed for the message, or None when another record of the batch carries the same key
+        """
+        with self._lock:
+            owner = self._owners.setdefault(key, message_id)
+            if owner != message_id:
+                self.duplicates[message_id] = owner
+                return None
+            self.keys[message_id] = key
+        return self.processed_messages.completed(key)
+
+    def complete(self, message_id, *stages):
+        with self._lock:
+            if message_id in self.keys:
+                self._pending.setdefault(message_id, set()).update(stages)
+
+    def discard(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._pending.pop(message_id, None)
+
+    def commit(self):
+        """
+        Record the stages completed by the batch, one write per message
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for message_id, stages in pending.items():
+            self.processed_messages.mark(self.keys[message_id], *stages)
@@ -1,133 +1,305 @@
 import json
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 
+# AWS clients resolve through boto3.client, so lambda_function.boto3.client can be patched
+import boto3
+
+try:
+    from ..common import aws_clients, metrics, tracing
+    from ..common.messages import decode_message, load_payload
+    from .change_detection import SUPPRESSED_COOLDOWN, SUPPRESSED_UNCHANGED, ChangeDetector
+    from .idempotency import STAGE_STORED, BatchProgress, ProcessedMessages, notification_stage
+    from .notifications import NotificationDispatcher, alert_notifications, build_notifications
+    from .rules import RuleIndex
+    from .storage import ObservationWriter
+    from .subscriptions import SubscriptionIndex
+except ImportError:
+    from common import aws_clients, metrics, tracing
+    from common.messages import decode_message, load_payload
+    from change_detection import SUPPRESSED_COOLDOWN, SUPPRESSED_UNCHANGED, ChangeDetector
+    from idempotency import STAGE_STORED, BatchProgress, ProcessedMessages, notification_stage
+    from notifications import NotificationDispatcher, alert_notifications, build_notifications
+    from rules import RuleIndex
+    from storage import ObservationWriter
+    from subscriptions import SubscriptionIndex
+
 log_level_name = os.environ.get('LOG_LEVEL', 'INFO')
 log_level = getattr(logging, log_level_name.upper(), logging.INFO)
 logger = logging.getLogger()
 logger.setLevel(log_level)
+tracing.install_log_filter(logger)
+
+# Trace ids listed in the EMF record of an invocation
+MAX_RECORDED_TRACE_IDS = 100
+
+# Subscribers of the SNS topic, listed once per SUBSCRIPTION_CACHE_TTL instead of on every notification
+subscription_index = SubscriptionIndex.from_environment()
+
+# Stages completed per message key, so redelivered messages are not stored or notified twice
+processed_messages = ProcessedMessages.from_environment()
+
+# Last state notified to each recipient and stored for each city, observations saying nothing new are suppressed
+change_detector = ChangeDetector.from_environment()
+
+SUPPRESSION_METRICS = {
+    SUPPRESSED_UNCHANGED: 'NotificationsUnchanged',
+    SUPPRESSED_COOLDOWN: 'NotificationsInCooldown'
+}
+
+# Alert rules of the subscribers, indexed per city and evaluated against each observation
+alert_rules = RuleIndex.from_environment()
 
+# 'both' notifies the recipients of each message and the alert rules that fire, 'always' only the recipients
+# and 'rules' only the alert rules, except for scheduled messages whose recipients are always notified
+def notification_mode():
+    return os.environ.get('NOTIFICATION_MODE') or 'both'
+
+@metrics.instrumented('weather-processor')
 def lambda_handler(event, context):
     """
-    Weather Processor Lambda - Processes weather data from SQS then stores in S3 and send notification to SNS
+    Weather Processor Lambda - Processes a batch of weather data from SQS then stores in S3 and send notification to SNS.
+    Records that fail are reported in batchItemFailures so SQS only redelivers those messages.
     """
 
-    logger.info(f"Received event: {json.dumps(event)}")
-    # Initialize AWS clients
-    s3_client = boto3.client('s3')
-    sns_client = boto3.client('sns')
-
+    # The whole SQS batch is only serialized for debugging, the per-invocation EMF record has the figures
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received event: {json.dumps(event)}")
     s3_bucket = os.environ['S3_BUCKET_NAME']
     sns_topic_arn = os.environ['SNS_TOPIC_ARN']
+    record_concurrency = int(os.environ.get('RECORD_CONCURRENCY', '4'))
+
+    # Reuse the container-wide AWS clients
+    s3_client = aws_clients.client('s3')
+    sns_client = aws_clients.client('sns')
+
+    records = event['Records']
+    metrics.record('BatchSize', len(records), metrics.COUNT)
+    trace_ids = []
+    for record in records:
+        trace = tracing.context_from_message_attributes(record.get('messageAttributes'))
+        if trace is not None and trace.trace_id not in trace_ids and len(trace_ids) < MAX_RECORDED_TRACE_IDS:
+            trace_ids.append(trace.trace_id)
+    metrics.set_property('TraceIds', trace_ids)
+
+    # Notifications of the whole batch are collected, deduplicated and sent together
+    dispatcher = NotificationDispatcher(
+        sns_client,
+        sns_topic_arn,
+        subscription_index,
+        max_workers=int(os.environ.get('NOTIFICATION_CONCURRENCY', '8')),
+        publish_batch=os.environ.get('SNS_PUBLISH_BATCH', 'false').lower() == 'true'
+    )
+
+    # Observations are buffered per partition and written as a few compressed objects per batch
+    writer = ObservationWriter(
+        s3_client,
+        s3_bucket,
+        compression=os.environ.get('S3_COMPRESSION', 'gzip'),
+        max_records=int(os.environ.get('S3_FLUSH_RECORDS', '1000')),
+        max_bytes=int(os.environ.get('S3_FLUSH_BYTES', str(5 * 1024 * 1024))),
+        max_age_seconds=float(os.environ.get('S3_FLUSH_SECONDS', '60'))
+    )
+
+    progress = BatchProgress(processed_messages)
+
+    def process(record):
+        return process_record(record, sns_client, sns_topic_arn, writer, dispatcher, progress)
+
+    # Process the records of the batch, in parallel when more than one worker is configured
+    if record_concurrency > 1 and len(records) > 1:
+        with ThreadPoolExecutor(max_workers=min(record_concurrency, len(records))) as executor:
+            results = list(executor.map(metrics.bound(process), records))
+    else:
+        results = [process(record) for record in records]
 
-    processed_messages = []
+    # Observations that could not be stored are retried without notifying
+    writer.flush()
+    failed_message_ids = set(writer.failures)
+    dispatcher.discard(failed_message_ids)
+    progress.discard(failed_message_ids)
+    for message_id, error in writer.failures.items():
+        publish_error(sns_client, sns_topic_arn, message_id, error)
 
+    # A message whose notification could not be sent is retried as well
+    notification_outcomes = dispatcher.dispatch()
+    for outcome in notification_outcomes:
+        if outcome['status'] == 'sent':
+            for message_id in outcome['message_ids']:
+                progress.complete(message_id, notification_stage(outcome['protocol'], outcome['endpoint']))
+        if outcome['status'] == 'failed':
+            for message_id in outcome['message_ids']:
+                if message_id not in failed_message_ids:
+                    failed_message_ids.add(message_id)
+                    publish_error(sns_client, sns_topic_arn, message_id, outcome['error'])
+    if notification_outcomes:
+        sent = sum(1 for outcome in notification_outcomes if outcome['status'] == 'sent')
+        metrics.count('NotificationsSent', sent)
+        metrics.count('NotificationsFailed', len(notification_outcomes) - sent)
+        logger.info(f"Sent {sent} of {len(notification_outcomes)} distinct notifications")
+
+    # Remember what this batch completed, a redelivery only redoes the rest
+    progress.commit()
+
+    # Report only the failed messages so the rest of the batch is deleted from the queue,
+    # a record repeating another record of the batch shares its outcome
+    failed_message_ids.update(
+        record.get('messageId') for record, succeeded in zip(records, results) if not succeeded
+    )
+    failed_message_ids.update(
+        message_id for message_id, owner in progress.duplicates.items() if owner in failed_message_ids
+    )
+    batch_item_failures = [
+        {'itemIdentifier': record.get('messageId')}
+        for record in records
+        if record.get('messageId') in failed_message_ids
+    ]
+    metrics.count('RecordsFailed', len(batch_item_failures))
+    if batch_item_failures:
+        logger.warning(f"{len(batch_item_failures)} of {len(records)} records failed")
+
+    return {
+        'statusCode': 200,
+        'body': event,
+        'batchItemFailures': batch_item_failures
+    }
+
+# Buffer the observation of a single SQS record and queue its notifications, returns False when the record has to be retried
+def process_record(record, sns_client, sns_topic_arn, writer, dispatcher=None, progress=None):
+    message_id = record.get('messageId')
+    # The record continues the trace of the request that queued it
+    with tracing.span(
+        'weather-processor.record',
+        parent=tracing.context_from_message_attributes(record.get('messageAttributes')),
+        message_id=message_id
+    ) as span:
+        sent_timestamp = (record.get('attributes') or {}).get('SentTimestamp')
+        if sent_timestamp is not None:
+            queue_dwell = max(span.start * 1000 - int(sent_timestamp), 0)
+            span.set_attribute('queue_dwell_ms', round(queue_dwell, 3))
+            metrics.record('QueueDwell', round(queue_dwell, 3))
+        return _process_record(record, message_id, sns_client, sns_topic_arn, writer, dispatcher, progress)
+
+def _process_record(record, message_id, sns_client, sns_topic_arn, writer, dispatcher, progress):
     try:
-        # Generate S3 key with date partitioning
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S:%f')
-        date_str = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y/%m/%d-%H-%M-%S-%f')
-        s3_key = f"weather-data/{date_str}.json"
-
-        # Extract data from input event
-        weather_body_string = event['Records'][0]['body']
-        weather_body_json = json.loads(weather_body_string)
+        # Extract data from the record, both the original and the compact message formats are accepted
+        weather_body_json = decode_message(record['body'], load_data=load_payload)
         weather_body_data = weather_body_json['data']
-        formatted_data = json.dumps(weather_body_data, indent=2)
-
-        # Store processed data in S3
-        s3_client.put_object(
-            Bucket=s3_bucket,
-            Key=s3_key,
-            Body=formatted_data,
-            ContentType='application/json'
-        )
-        handle_notification(weather_body_json, sns_topic_arn)
-
-        return {
-            'statusCode': 200,
-            'body': event
-        }
 
-    except Exception as e:
-        logger.error(f"Error processing weather data: {str(e)}")
-
-        # Send error notification
-        try:
-            error_message = {
-                'error': 'Weather processing failed',
-                'details': str(e),
-                'timestamp': datetime.now().isoformat()
-            }
-
-            sns_client.publish(
-                TopicArn=sns_topic_arn,
-                Subject="Weather Processing Error",
-                Message=json.dumps(error_message, indent=2)
-            )
-        except:
-            pass  # Don't fail if notification fails
-        raise
-
-# Send a notification based on a notification type
-def handle_notification(weather_body, sns_topic_arn):
-    notification_type = weather_body['notification_type']
-    body_message =  weather_body['data']['weather'][0]['description']
-    city_name = weather_body['city_name']
-    subject_text = f"Weather condition for {city_name}"
-    if notification_type == 'sms' or notification_type == 'both':
-        sns_client = boto3.client('sns')
-        phone_number = weather_body['phone_number']
-        handle_subscription(sns_topic_arn, sns_client, 'sms', phone_number)
+        # Work already done for this message by an earlier delivery is skipped
+        completed_stages = frozenset()
+        if progress is not None:
+            completed_stages = progress.begin(message_id, weather_body_json.get('message_key') or message_id)
+            if completed_stages is None:
+                logger.info(f"Message {message_id} repeats message {progress.duplicates[message_id]} of the batch")
+                progress.processed_messages.record_skip()
+                metrics.count('DuplicateRecords')
+                return True
+            if completed_stages:
+                logger.info(f"Message {message_id} was processed before, skipping {len(completed_stages)} completed stages")
+                progress.processed_messages.record_skip()
+                metrics.count('RedeliveredRecords')
 
-        sns_client.publish(
-            TopicArn=sns_topic_arn,
-            Message=f"{subject_text} - {body_message}",
-            MessageAttributes={
-                'AWS.SNS.SMS.SenderID': {
-                    'DataType': 'String',
-                    'StringValue': 'WEATHER'
-                },
-                'AWS.SNS.SMS.SMSType': {
-                    'DataType': 'String',
-                    'StringValue': 'Transactional'
-                }
-            }
+        # Buffer the observation for S3, the messages of a scheduled city after the first one only notify
+        if STAGE_STORED not in completed_stages and weather_body_json.get('store_observation', True):
+            if change_detector.should_store(
+                weather_body_json['city_name'],
+                weather_body_json.get('country_code'),
+                weather_body_data,
+                message_id=message_id
+            ):
+                writer.add(
+                    weather_body_data,
+                    weather_body_json['city_name'],
+                    country_code=weather_body_json.get('country_code'),
+                    message_id=message_id,
+                    trace=tracing.current_context()
+                )
+            else:
+                metrics.count('ObservationsUnchanged')
+            if progress is not None:
+                progress.complete(message_id, STAGE_STORED)
+        handle_notification(
+            weather_body_json,
+            sns_topic_arn,
+            dispatcher=dispatcher,
+            message_id=message_id,
+            completed_stages=completed_stages
         )
-    if notification_type == 'email' or notification_type == 'both':
-        sns_client = boto3.client('sns')
-        email = weather_body['email']
+        return True
 
-        handle_subscription(sns_topic_arn, sns_client, 'email', email)
+    except Exception as e:
+        logger.error(f"Error processing weather data for message {message_id}: {str(e)}")
+        publish_error(sns_client, sns_topic_arn, message_id, str(e))
+        return False
+
+# Send an error notification for a message that could not be processed
+def publish_error(sns_client, sns_topic_arn, message_id, details):
+    try:
+        error_message = {
+            'error': 'Weather processing failed',
+            'message_id': message_id,
+            'details': details,
+            'timestamp': datetime.now().isoformat()
+        }
 
         sns_client.publish(
-            TopicArn = sns_topic_arn,
-            Subject = subject_text,
-            Message = f"Weather Condition for {city_name} - {body_message}",
-            MessageStructure = 'text',
-            MessageAttributes = {
-                'email': {
-                    'DataType': 'String',
-                    'StringValue': email
-                }
-            }
+            TopicArn=sns_topic_arn,
+            Subject="Weather Processing Error",
+            Message=json.dumps(error_message, indent=2)
         )
+    except:
+        pass  # Don't fail if notification fails
 
-def handle_subscription( sns_topic_arn, sns_client, protocol, endpoint):
-    response = sns_client.list_subscriptions_by_topic(TopicArn=sns_topic_arn)
-    is_subscribed = False
-    for subscription in response['Subscriptions']:
-        if subscription['Protocol'] == protocol and subscription['Endpoint'] == endpoint :
-            is_subscribed = True
-            break
-
-    if not is_subscribed :
-        sns_client.subscribe(
-            TopicArn = sns_topic_arn,
-            Protocol = protocol,
-            Endpoint = endpoint
+# Send a notification based on a notification type, or queue it on the dispatcher of the batch
+def handle_notification(weather_body, sns_topic_arn, dispatcher=None, message_id=None, completed_stages=frozenset()):
+    mode = notification_mode()
+    message_key = weather_body.get('message_key') or message_id
+    notifications = []
+    if mode != 'rules' or weather_body.get('recipients'):
+        notifications = [
+            notification for notification in build_notifications(weather_body)
+            if notification_stage(notification.protocol, notification.endpoint) not in completed_stages
+        ]
+        # Scheduled subscribers asked for a cadence, the recipients of requests only hear about changes
+        if not weather_body.get('recipients'):
+            notifications = [
+                notification for notification in notifications
+                if not suppressed(notification, weather_body, message_id)
+            ]
+    if mode != 'always' and alert_rules.enabled:
+        # A redelivered message gets the alerts it fired the first time, the ones already sent are skipped
+        with metrics.timer('RuleEvaluation'):
+            fired = alert_rules.evaluate(
+                weather_body['city_name'],
+                weather_body.get('country_code'),
+                weather_body['data'],
+                message_key=message_key
+            )
+        metrics.count('RulesFired', len(fired))
+        notifications.extend(
+            notification for notification in alert_notifications(weather_body['city_name'], fired)
+            if notification_stage(notification.protocol, notification.endpoint) not in completed_stages
         )
+    trace = tracing.current_context()
+    if dispatcher is not None:
+        for notification in notifications:
+            dispatcher.add(notification, message_id, trace=trace)
+        return
 
+    dispatcher = NotificationDispatcher(aws_clients.client('sns'), sns_topic_arn, subscription_index, max_workers=1)
+    for notification in notifications:
+        dispatcher.add(notification, message_id, trace=trace)
+    for outcome in dispatcher.dispatch():
+        if outcome['status'] == 'failed':
+            raise RuntimeError(f"{outcome['protocol']} notification for {outcome['city_name']} failed: {outcome['error']}")
 
-
+# True when the notification says nothing new to its recipient
+def suppressed(notification, weather_body, message_id):
+    reason = change_detector.suppression(notification, weather_body.get('country_code'), weather_body['data'], message_id)
+    if reason is not None:
+        metrics.count(SUPPRESSION_METRICS[reason])
+        return True
+    return False
@@ -0,0 +1,266 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from ..common import metrics, tracing
+except ImportError:
+    from common import metrics, tracing
+
+logger = logging.getLogger()
+
+
+def email_filter_policy(address):
+    """
+    Filter policy matching the messages published for one email address
+    """
+    return json.dumps({'email': [address]})
+
+# Maximum number of entries accepted by one PublishBatch call
+PUBLISH_BATCH_SIZE = 10
+
+SMS_MESSAGE_ATTRIBUTES = {
+    'AWS.SNS.SMS.SenderID': {
+        'DataType': 'String',
+        'StringValue': 'WEATHER'
+    },
+    'AWS.SNS.SMS.SMSType': {
+        'DataType': 'String',
+        'StringValue': 'Transactional'
+    }
+}
+
+
+class Notification(namedtuple('Notification', ['protocol', 'endpoint', 'city_name', 'description'])):
+    """
+    One message to one recipient, identical notifications compare equal so they are sent once
+    """
+
+    def subject(self):
+        return f"Weather condition for {self.city_name}"
+
+    def to_topic(self):
+        """
+        SMS are sent straight to their phone number, emails go through the topic the address is subscribed to
+        """
+        return self.protocol != 'sms'
+
+    def subscription_attributes(self):
+        """
+        Filter policy of the topic subscription, so an address only receives the messages published for it
+        """
+        return {'FilterPolicy': email_filter_policy(self.endpoint)}
+
+    def publish_request(self):
+        """
+        Arguments of the SNS publish call for this notification, without the topic
+        """
+        if self.protocol == 'sms':
+            return {
+                'PhoneNumber': self.endpoint,
+                'Message': f"{self.subject()} - {self.description}",
+                'MessageAttributes': SMS_MESSAGE_ATTRIBUTES
+            }
+        return {
+            'Subject': self.subject(),
+            'Message': f"Weather Condition for {self.city_name} - {self.description}",
+            'MessageStructure': 'text',
+            'MessageAttributes': {
+                'email': {
+                    'DataType': 'String',
+                    'StringValue': self.endpoint
+                }
+            }
+        }
+
+
+def build_notifications(weather_body):
+    """
+    Notifications requested by a weather message, based on its notification type. Scheduled messages
+    carry a list of recipients, each with its own notification type.
+    """
+    description = weather_body['data']['weather'][0]['description']
+    city_name = weather_body['city_name']
+    notifications = []
+    for recipient in weather_body.get('recipients') or [weather_body]:
+        notification_type = recipient['notification_type']
+        if notification_type == 'sms' or notification_type == 'both':
+            notifications.append(Notification('sms', recipient['phone_number'], city_name, description))
+        if notification_type == 'email' or notification_type == 'both':
+            notifications.append(Notification('email', recipient['email'], city_name, description))
+    return notifications
+
+
+def alert_notifications(city_name, fired):
+    """
+    Notifications of the alert rules that fired on an observation, one per rule
+    """
+    return [Notification(rule.channel, rule.endpoint, city_name, rule.describe(value)) for rule, value in fired]
+
+
+def traced_request(notification, traces):
+    """
+    Publish arguments of a notification carrying the trace context of its first message
+    """
+    request = notification.publish_request()
+    if traces:
+        request['MessageAttributes'] = dict(request['MessageAttributes'], **tracing.message_attributes(traces[0]))
+    return request
+
+
+def record_delivery(traces):
+    """
+    Time from the earliest request of a notification to its publication, the end-to-end latency
+    """
+    request_times = [trace.request_time for trace in traces if trace.request_time is not None]
+    if request_times:
+        metrics.record('RequestToNotification', round(max(time.time() * 1000 - min(request_times), 0), 3))
+
+
+class NotificationDispatcher:
+    """
+    Collects the notifications of a batch of messages, drops duplicates and sends them in parallel,
+    through a bounded thread pool or with PublishBatch
+    """
+
+    def __init__(self, sns_client, sns_topic_arn, subscription_index, max_workers=8, publish_batch=False):
+        self.sns_client = sns_client
+        self.sns_topic_arn = sns_topic_arn
+        self.subscription_index = subscription_index
+        self.max_workers = max(max_workers, 1)
+        self.publish_batch = publish_batch
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._traces = {}
+
+    def add(self, notification, message_id=None, trace=None):
+        with self._lock:
+            self._pending.setdefault(notification, []).append(message_id)
+            if trace is not None:
+                self._traces[message_id] = trace
+
+    def discard(self, message_ids):
+        """
+        Drop the pending notifications of messages that failed, unless another message still needs them
+        """
+        with self._lock:
+            for notification, pending_ids in list(self._pending.items()):
+                remaining = [message_id for message_id in pending_ids if message_id not in message_ids]
+                if remaining:
+                    self._pending[notification] = remaining
+                else:
+                    del self._pending[notification]
+
+    def dispatch(self):
+        """
+        Send the pending notifications and return one outcome per distinct notification
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending = {}
+            traces = self._traces
+            self._traces = {}
+        if not pending:
+            return []
+
+        notifications = [notification for notification, _ in pending]
+        # A notification continues the traces of the messages that asked for it
+        notification_traces = [
+            [traces[message_id] for message_id in message_ids if message_id in traces] for _, message_ids in pending
+        ]
+        if self.publish_batch:
+            errors = self._send_batches(notifications, notification_traces)
+        else:
+            errors = self._map(lambda item: self._send(*item), list(zip(notifications, notification_traces)))
+
+        outcomes = []
+        for (notification, message_ids), error in zip(pending, errors):
+            outcome = {
+                'protocol': notification.protocol,
+                'endpoint': notification.endpoint,
+                'city_name': notification.city_name,
+                'status': 'sent' if error is None else 'failed',
+                'message_ids': message_ids
+            }
+            if error is not None:
+                outcome['error'] = error
+            outcomes.append(outcome)
+        return outcomes
+
+    def _map(self, fn, items):
+        if self.max_workers == 1 or len(items) == 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(metrics.bound(fn), items))
+
+    def _subscribe(self, notification):
+        with metrics.timer('SubscriptionCheck'):
+            self.subscription_index.ensure_subscribed(
+                self.sns_client, self.sns_topic_arn, notification.protocol, notification.endpoint,
+                attributes=notification.subscription_attributes()
+            )
+
+    def _send(self, notification, traces=()):
+        try:
+            request = traced_request(notification, traces)
+            if notification.to_topic():
+                self._subscribe(notification)
+                request['TopicArn'] = self.sns_topic_arn
+            with metrics.timer('SnsPublish'), tracing.span(
+                'sns.publish', parent=traces[0] if traces else None, links=traces[1:], protocol=notification.protocol
+            ):
+                self.sns_client.publish(**request)
+            record_delivery(traces)
+            return None
+        except Exception as e:
+            logger.error(f"Error sending {notification.protocol} notification for {notification.city_name}: {str(e)}")
+            return str(e)
+
+    def _send_batches(self, notifications, notification_traces):
+        def prepare(index):
+            notification = notifications[index]
+            if not notification.to_topic():
+                # PublishBatch only publishes to a topic, phone numbers get one publish each
+                return self._send(notification, notification_traces[index])
+            try:
+                self._subscribe(notification)
+                return None
+            except Exception as e:
+                return str(e)
+
+        errors = self._map(prepare, list(range(len(notifications))))
+        ready = [index for index, error in enumerate(errors) if error is None and notifications[index].to_topic()]
+        chunks = [ready[start:start + PUBLISH_BATCH_SIZE] for start in range(0, len(ready), PUBLISH_BATCH_SIZE)]
+
+        def publish(chunk):
+            entries = [
+                dict(traced_request(notifications[index], notification_traces[index]), Id=str(index)) for index in chunk
+            ]
+            traces = [trace for index in chunk for trace in notification_traces[index]]
+            try:
+                with metrics.timer('SnsPublish'), tracing.span(
+                    'sns.publish_batch', parent=traces[0] if traces else None, links=traces[1:], entries=len(chunk)
+                ):
+                    response = self.sns_client.publish_batch(
+                        TopicArn=self.sns_topic_arn,
+                        PublishBatchRequestEntries=entries
+                    )
+            except Exception as e:
+                logger.error(f"Error publishing notification batch: {str(e)}")
+                return {index: str(e) for index in chunk}
+            failures = {
+                int(failed['Id']): failed.get('Message', failed['Code'])
+                for failed in response.get('Failed', [])
+            }
+            for index in chunk:
+                if index not in failures:
+                    record_delivery(notification_traces[index])
+            return failures
+
+        for failures in self._map(publish, chunks):
+            for index, error in failures.items():
+                errors[index] = error
+        return errors
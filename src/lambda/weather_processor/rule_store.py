@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import urlparse
+
+try:
+    from ..common import aws_clients
+except ImportError:
+    from common import aws_clients
+
+
+class RuleStore:
+    """
+    Alert rules as one item per rule, keyed by city and rule id, so that adding or removing a rule never
+    rewrites the other rules of its city
+    """
+
+    def rules(self, city_key):
+        """
+        Rules of a city, as dicts
+        """
+        raise NotImplementedError
+
+    def put(self, city_key, rule_id, rule):
+        raise NotImplementedError
+
+    def delete(self, city_key, rule_id):
+        """
+        Remove a rule, returns False when it did not exist
+        """
+        raise NotImplementedError
+
+
+class MemoryRuleStore(RuleStore):
+    """
+    Process-local rules, used by tests and local runs
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cities = {}
+
+    def rules(self, city_key):
+        with self._lock:
+            return [json.loads(rule) for rule in self._cities.get(city_key, {}).values()]
+
+    def put(self, city_key, rule_id, rule):
+        with self._lock:
+            self._cities.setdefault(city_key, {})[rule_id] = json.dumps(rule)
+
+    def delete(self, city_key, rule_id):
+        with self._lock:
+            return self._cities.get(city_key, {}).pop(rule_id, None) is not None
+
+
+class FileRuleStore(RuleStore):
+    """
+    Local rules, one directory per city and one JSON file per rule
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _city_directory(self, city_key):
+        return os.path.join(self.directory, hashlib.sha256(city_key.encode('utf-8')).hexdigest())
+
+    def _path(self, city_key, rule_id):
+        return os.path.join(self._city_directory(city_key), hashlib.sha256(rule_id.encode('utf-8')).hexdigest() + '.json')
+
+    def rules(self, city_key):
+        directory = self._city_directory(city_key)
+        if not os.path.isdir(directory):
+            return []
+        rules = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), encoding='utf-8') as rule_file:
+                    rules.append(json.load(rule_file))
+        return rules
+
+    def put(self, city_key, rule_id, rule):
+        path = self._path(city_key, rule_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as rule_file:
+            json.dump(rule, rule_file)
+        os.replace(temp_path, path)
+
+    def delete(self, city_key, rule_id):
+        try:
+            os.remove(self._path(city_key, rule_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+class DynamoDBRuleStore(RuleStore):
+    """
+    Rules in a DynamoDB table with 'city_key' as partition key and 'rule_id' as sort key. The rules of
+    a city are read with one paginated query, whatever the number of rules of other cities.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def rules(self, city_key):
+        paginator = aws_clients.client('dynamodb').get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression='city_key = :city',
+            ExpressionAttributeValues={':city': {'S': city_key}}
+        )
+        return [json.loads(item['rule']['S']) for page in pages for item in page.get('Items', [])]
+
+    def put(self, city_key, rule_id, rule):
+        aws_clients.client('dynamodb').put_item(TableName=self.table_name, Item={
+            'city_key': {'S': city_key},
+            'rule_id': {'S': rule_id},
+            'rule': {'S': json.dumps(rule)}
+        })
+
+    def delete(self, city_key, rule_id):
+        response = aws_clients.client('dynamodb').delete_item(
+            TableName=self.table_name,
+            Key={'city_key': {'S': city_key}, 'rule_id': {'S': rule_id}},
+            ReturnValues='ALL_OLD'
+        )
+        return 'Attributes' in response
+
+
+def rule_store_from_url(url):
+    """
+    Build a rule store from a URL such as memory://, file:///tmp/rules or dynamodb://table-name.
+    Returns None when no URL is configured.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryRuleStore()
+    if parsed.scheme == 'file':
+        return FileRuleStore(parsed.netloc + parsed.path)
+    if parsed.scheme == 'dynamodb':
+        return DynamoDBRuleStore(parsed.netloc)
+    raise ValueError(f"Unsupported rule store URL: {url}")
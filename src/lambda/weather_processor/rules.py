@@ -0,0 +1,370 @@
+"""
+Alert rules of subscribers, such as "temp below 0", "wind above 60" or "condition in thunderstorm,snow",
+evaluated against each observation of a city. Rules are indexed per city and per field, with the
+thresholds of a field kept sorted, so an observation only looks at the fields that changed since the
+previous observation of its city and finds the rules it crossed by bisection.
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+try:
+    from ..common.observations import normalize_city_key
+    from ..common.stores import MemoryStore, store_from_url
+    from .rule_store import rule_store_from_url
+except ImportError:
+    from common.observations import normalize_city_key
+    from common.stores import MemoryStore, store_from_url
+    from rule_store import rule_store_from_url
+
+logger = logging.getLogger()
+
+CHANNELS = ('sms', 'email')
+
+BELOW = 'below'
+ABOVE = 'above'
+IN = 'in'
+
+# Striped locks, so observations of different cities are evaluated in parallel
+LOCK_STRIPES = 64
+
+# Fields rules can test, with the unit of their values
+FIELDS = {
+    'temp': '°C',
+    'feels_like': '°C',
+    'humidity': '%',
+    'pressure': ' hPa',
+    'wind': ' km/h',
+    'condition': ''
+}
+NUMERIC_FIELDS = ('temp', 'feels_like', 'humidity', 'pressure', 'wind')
+
+
+def observation_fields(data):
+    """
+    Values of the rule fields in an OpenWeatherMap response: temperatures in °C, wind in km/h and the
+    lowercased main condition, such as 'rain' or 'thunderstorm'
+    """
+    main = data.get('main') or {}
+    fields = {}
+    for field in ('temp', 'feels_like'):
+        if main.get(field) is not None:
+            fields[field] = round(main[field] - 273.15, 2)
+    for field in ('humidity', 'pressure'):
+        if main.get(field) is not None:
+            fields[field] = main[field]
+    wind_speed = (data.get('wind') or {}).get('speed')
+    if wind_speed is not None:
+        fields['wind'] = round(wind_speed * 3.6, 2)
+    weather = data.get('weather') or []
+    if weather and weather[0].get('main'):
+        fields['condition'] = weather[0]['main'].lower()
+    return fields
+
+
+class Rule(namedtuple('Rule', [
+    'rule_id', 'city_name', 'country_code', 'field', 'operator', 'value', 'channel', 'endpoint'
+])):
+    """
+    Alert of one SMS or email endpoint when a field of its city goes below or above a threshold,
+    or into one of a set of conditions
+    """
+
+    @classmethod
+    def from_dict(cls, rule):
+        field = rule['field']
+        operator = rule['operator']
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported rule field {field}")
+        if rule['channel'] not in CHANNELS:
+            raise ValueError(f"Unsupported channel {rule['channel']}")
+        if operator in (BELOW, ABOVE) and field in NUMERIC_FIELDS:
+            value = float(rule['value'])
+        elif operator == IN and field == 'condition':
+            values = rule['value'].split(',') if isinstance(rule['value'], str) else rule['value']
+            value = tuple(sorted({str(condition).strip().lower() for condition in values if str(condition).strip()}))
+            if not value:
+                raise ValueError('A condition rule needs at least one condition')
+        else:
+            raise ValueError(f"Unsupported rule {field} {operator}")
+        return cls(
+            rule.get('rule_id') or uuid.uuid4().hex,
+            rule['city_name'],
+            rule.get('country_code') or '',
+            field,
+            operator,
+            value,
+            rule['channel'],
+            rule['endpoint']
+        )
+
+    def to_dict(self):
+        rule = self._asdict()
+        if self.operator == IN:
+            rule['value'] = list(self.value)
+        return rule
+
+    def describe(self, value):
+        """
+        Text of the alert sent when the rule fires on `value`
+        """
+        unit = FIELDS[self.field]
+        field = self.field.replace('_', ' ')
+        if self.operator == IN:
+            return f"{field} is now {value}"
+        return f"{field} {self.operator} {self.value:g}{unit}, now {value:g}{unit}"
+
+
+class CityRules:
+    """
+    Rules of one city. The thresholds of each numeric field are sorted per operator, condition rules are
+    grouped by condition.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._thresholds = {}
+        self._conditions = {}
+        for rule in sorted(self.rules, key=lambda rule: (rule.field, rule.operator, rule.value if rule.operator != IN else 0)):
+            if rule.operator == IN:
+                for condition in rule.value:
+                    self._conditions.setdefault(condition, []).append(rule)
+            else:
+                thresholds, ordered = self._thresholds.setdefault((rule.field, rule.operator), ([], []))
+                thresholds.append(rule.value)
+                ordered.append(rule)
+        self.fields = {field for field, _ in self._thresholds}
+        if self._conditions:
+            self.fields.add('condition')
+
+    def __len__(self):
+        return len(self.rules)
+
+    def crossed(self, field, previous, value):
+        """
+        Rules of a field that hold for `value` but did not for `previous`, every rule that holds when
+        there is no previous value
+        """
+        if field == 'condition':
+            return list(self._conditions.get(value, ())) if value != previous else []
+        crossed = []
+        thresholds, rules = self._thresholds.get((field, BELOW), ((), ()))
+        if thresholds:
+            start = bisect.bisect_right(thresholds, value)
+            end = len(thresholds) if previous is None else bisect.bisect_right(thresholds, previous)
+            crossed.extend(rules[start:end])
+        thresholds, rules = self._thresholds.get((field, ABOVE), ((), ()))
+        if thresholds:
+            start = 0 if previous is None else bisect.bisect_left(thresholds, previous)
+            crossed.extend(rules[start:bisect.bisect_left(thresholds, value)])
+        return crossed
+
+
+EMPTY_CITY = CityRules()
+
+
+class RuleIndex:
+    """
+    Alert rules per city, read from a rule store and kept by the warm container for `ttl_seconds`.
+    Rules are edge triggered: the values last observed for each city are kept in `state_store`, shared
+    between containers, and a rule fires on the observation that makes it hold, not again while it keeps
+    holding. State expires after `state_ttl_seconds`, the rules that hold then fire once more.
+    """
+
+    def __init__(self, store=None, state_store=None, ttl_seconds=300, state_ttl_seconds=604800, clock=time.monotonic):
+        self.store = store
+        self.state_store = state_store if state_store is not None else MemoryStore()
+        self.ttl_seconds = ttl_seconds
+        self.state_ttl_seconds = state_ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._cities = {}
+        self.evaluations = 0
+        self.fired = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            store=rule_store_from_url(os.environ.get('ALERT_RULES_STORE')),
+            state_store=store_from_url(os.environ.get('ALERT_STATE_STORE')),
+            ttl_seconds=int(os.environ.get('ALERT_RULES_TTL', '300')),
+            state_ttl_seconds=int(os.environ.get('ALERT_STATE_TTL', '604800'))
+        )
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def rules(self, city_name, country_code):
+        return list(self._city(normalize_city_key(city_name, country_code)).rules)
+
+    def register(self, rule):
+        """
+        Add or replace a rule of its city, returns the rule
+        """
+        city_key = normalize_city_key(rule.city_name, rule.country_code)
+        self._require_store().put(city_key, rule.rule_id, rule.to_dict())
+        self._forget(city_key)
+        return rule
+
+    def unregister(self, city_name, country_code, rule_id):
+        """
+        Remove a rule of a city, returns False when it did not exist
+        """
+        city_key = normalize_city_key(city_name, country_code)
+        removed = self._require_store().delete(city_key, rule_id)
+        self._forget(city_key)
+        return removed
+
+    def evaluate(self, city_name, country_code, data, message_key=None):
+        """
+        Rules of the city that fire on this observation, as (rule, value) pairs. A redelivered message gets
+        the rules it fired the first time, other messages with the same observation or an older one fire nothing.
+        """
+        city_key = normalize_city_key(city_name, country_code)
+        city = self._city(city_key)
+        if not city.rules:
+            return []
+        observed_at = data.get('dt')
+        values = observation_fields(data)
+        state_key = f"alert-state:{city_key}"
+        with self._locks[hash(state_key) % LOCK_STRIPES]:
+            state = self._get_state(state_key)
+            if state is not None and observed_at is not None and state['observed_at'] is not None:
+                if observed_at < state['observed_at']:
+                    return []
+                if observed_at == state['observed_at']:
+                    if message_key is None or message_key != state['message_key']:
+                        return []
+                    rules = {rule.rule_id: rule for rule in city.rules}
+                    return [(rules[rule_id], value) for rule_id, value in state['fired'] if rule_id in rules]
+            previous = state['values'] if state is not None else {}
+            fired = []
+            for field in sorted(city.fields):
+                value = values.get(field)
+                if value is None or (field in previous and previous[field] == value):
+                    continue
+                fired.extend((rule, value) for rule in city.crossed(field, previous.get(field), value))
+            self._put_state(state_key, {
+                'observed_at': observed_at,
+                'values': values,
+                'message_key': message_key,
+                'fired': [[rule.rule_id, value] for rule, value in fired]
+            })
+        with self._lock:
+            self.evaluations += 1
+            self.fired += len(fired)
+        return fired
+
+    def clear(self):
+        # Only process-local state is forgotten, a shared store keeps its state
+        if isinstance(self.state_store, MemoryStore):
+            self.state_store = MemoryStore()
+        with self._lock:
+            self._cities.clear()
+            self.evaluations = 0
+            self.fired = 0
+
+    def stats(self):
+        return {
+            'cities': len(self._cities),
+            'evaluations': self.evaluations,
+            'fired': self.fired
+        }
+
+    def _city(self, city_key):
+        entry = self._cities.get(city_key)
+        if entry is not None and entry[1] > self._clock():
+            return entry[0]
+        city = CityRules(self._read(city_key)) if self.store is not None else EMPTY_CITY
+        with self._lock:
+            self._cities[city_key] = (city, self._clock() + self.ttl_seconds)
+        return city
+
+    def _read(self, city_key):
+        try:
+            return [Rule.from_dict(rule) for rule in self.store.rules(city_key)]
+        except Exception as e:
+            logger.warning(f"Alert rules read failed for {city_key}: {str(e)}")
+            return []
+
+    def _require_store(self):
+        if self.store is None:
+            raise ValueError('No ALERT_RULES_STORE is configured')
+        return self.store
+
+    def _forget(self, city_key):
+        with self._lock:
+            self._cities.pop(city_key, None)
+
+    def _get_state(self, key):
+        try:
+            return self.state_store.get(key)
+        except Exception as e:
+            # Without its state the observation is evaluated as the first one of the city
+            logger.warning(f"Alert state read failed for {key}: {str(e)}")
+            return None
+
+    def _put_state(self, key, state):
+        try:
+            self.state_store.put(key, state, ttl_seconds=self.state_ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Alert state write failed for {key}: {str(e)}")
+
+
+def main(argv=None):
+    """
+    Manage the alert rules of a store, e.g. from src/lambda:
+    python -m weather_processor.rules --store file:///tmp/rules add --city London --country uk \
+        --field temp --operator below --value 0 --channel sms --endpoint +1234567890
+    """
+    parser = argparse.ArgumentParser(description='Manage weather alert rules')
+    parser.add_argument('--store', default=os.environ.get('ALERT_RULES_STORE'), help='store URL, ALERT_RULES_STORE by default')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='register a rule')
+    add.add_argument('--city', required=True)
+    add.add_argument('--country', default='')
+    add.add_argument('--field', required=True, choices=sorted(FIELDS))
+    add.add_argument('--operator', required=True, choices=(BELOW, ABOVE, IN))
+    add.add_argument('--value', required=True, help='threshold, or comma separated conditions')
+    add.add_argument('--channel', required=True, choices=CHANNELS)
+    add.add_argument('--endpoint', required=True)
+    listing = commands.add_parser('list', help='list the rules of a city')
+    listing.add_argument('--city', required=True)
+    listing.add_argument('--country', default='')
+    remove = commands.add_parser('remove', help='remove a rule of a city')
+    remove.add_argument('--city', required=True)
+    remove.add_argument('--country', default='')
+    remove.add_argument('--rule-id', required=True)
+    args = parser.parse_args(argv)
+
+    index = RuleIndex(store=rule_store_from_url(args.store))
+    if not index.enabled:
+        parser.error('--store or ALERT_RULES_STORE is required')
+    if args.command == 'add':
+        rule = index.register(Rule.from_dict({
+            'city_name': args.city,
+            'country_code': args.country,
+            'field': args.field,
+            'operator': args.operator,
+            'value': args.value,
+            'channel': args.channel,
+            'endpoint': args.endpoint
+        }))
+        print(json.dumps(rule.to_dict(), ensure_ascii=False))
+    elif args.command == 'list':
+        for rule in index.rules(args.city, args.country):
+            print(json.dumps(rule.to_dict(), ensure_ascii=False))
+    elif not index.unregister(args.city, args.country, args.rule_id):
+        parser.exit(1, f"No rule {args.rule_id} for {args.city}\n")
+
+
+if __name__ == '__main__':
+    main()
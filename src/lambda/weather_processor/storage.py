@@ -0,0 +1,151 @@
+import gzip
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    from ..common import metrics, tracing
+    from ..common.observations import partition_value
+except ImportError:
+    from common import metrics, tracing
+    from common.observations import partition_value
+
+logger = logging.getLogger()
+
+# Object names are unique per container and sequence number, so concurrent containers never collide
+CONTAINER_ID = uuid.uuid4().hex[:12]
+_sequence = itertools.count()
+
+# S3 user metadata is limited to 2KB, an object lists the trace ids of its first observations only
+MAX_METADATA_TRACE_IDS = 40
+
+CONTENT_ENCODINGS = {
+    'gzip': ('.jsonl.gz', 'gzip'),
+    'zstd': ('.jsonl.zst', 'zstd'),
+    'none': ('.jsonl', None)
+}
+
+
+def partition_key(observation, city_name, country_code=None):
+    """
+    Hive-style partition of an observation: date, hour, country and city of the measurement
+    """
+    measured_at = observation.get('dt') if isinstance(observation, dict) else None
+    if isinstance(measured_at, (int, float)):
+        moment = datetime.fromtimestamp(measured_at, tz=timezone.utc)
+    else:
+        moment = datetime.now(timezone.utc)
+    if not country_code and isinstance(observation, dict):
+        country_code = (observation.get('sys') or {}).get('country')
+    return (
+        f"date={moment.strftime('%Y-%m-%d')}/hour={moment.strftime('%H')}/"
+        f"country={partition_value(country_code or 'unknown')}/city={partition_value(city_name)}"
+    )
+
+
+class ObservationWriter:
+    """
+    Buffers the observations of a batch as newline-delimited JSON per partition and writes one
+    compressed object per partition when a size, count or age threshold is reached or on flush()
+    """
+
+    def __init__(self, s3_client, bucket, prefix='weather-data', compression='gzip',
+                 max_records=1000, max_bytes=5 * 1024 * 1024, max_age_seconds=60, clock=time.monotonic):
+        if compression not in CONTENT_ENCODINGS:
+            raise ValueError(f"Unsupported compression {compression}")
+        if compression == 'zstd':
+            # zstandard is optional, only needed when zstd output is configured
+            import zstandard
+            self._zstd = zstandard.ZstdCompressor()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.compression = compression
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._partitions = {}
+        self._records = 0
+        self._bytes = 0
+        self._started = None
+        self.failures = {}
+        self.objects_written = 0
+
+    def add(self, observation, city_name, country_code=None, message_id=None, trace=None):
+        line = json.dumps(observation, separators=(',', ':')) + '\n'
+        with self._lock:
+            partition = self._partitions.setdefault(
+                partition_key(observation, city_name, country_code), ([], [], {})
+            )
+            partition[0].append(line)
+            partition[1].append(message_id)
+            if trace is not None:
+                partition[2].setdefault(trace.trace_id, trace)
+            self._records += 1
+            self._bytes += len(line)
+            if self._started is None:
+                self._started = self._clock()
+            full = (
+                self._records >= self.max_records
+                or self._bytes >= self.max_bytes
+                or self._clock() - self._started >= self.max_age_seconds
+            )
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every buffered partition, returns {message_id: error} for the observations that could not be stored
+        """
+        with self._lock:
+            partitions = self._partitions
+            self._partitions = {}
+            self._records = 0
+            self._bytes = 0
+            self._started = None
+
+        failed = {}
+        for partition, (lines, message_ids, traces) in partitions.items():
+            extension, content_encoding = CONTENT_ENCODINGS[self.compression]
+            key = f"{self.prefix}/{partition}/{CONTAINER_ID}-{next(_sequence):08d}{extension}"
+            request = {
+                'Bucket': self.bucket,
+                'Key': key,
+                'Body': self._encode(''.join(lines).encode('utf-8')),
+                'ContentType': 'application/x-ndjson'
+            }
+            if content_encoding is not None:
+                request['ContentEncoding'] = content_encoding
+            traces = list(traces.values())
+            if traces:
+                request['Metadata'] = {
+                    'trace-ids': ','.join(trace.trace_id for trace in traces[:MAX_METADATA_TRACE_IDS]),
+                    'trace-count': str(len(traces))
+                }
+            try:
+                # The object belongs to the traces of all its observations, the first one is the parent
+                with metrics.timer('S3Put'), tracing.span(
+                    's3.put_object', parent=traces[0] if traces else None, links=traces[1:], key=key, records=len(lines)
+                ):
+                    self.s3_client.put_object(**request)
+                self.objects_written += 1
+                metrics.count('ObservationsStored', len(lines))
+            except Exception as e:
+                logger.error(f"Error writing {len(lines)} observations to {key}: {str(e)}")
+                failed.update((message_id, str(e)) for message_id in message_ids)
+        with self._lock:
+            self.failures.update(failed)
+        return failed
+
+    def _encode(self, payload):
+        if self.compression == 'gzip':
+            return gzip.compress(payload)
+        if self.compression == 'zstd':
+            return self._zstd.compress(payload)
+        return payload
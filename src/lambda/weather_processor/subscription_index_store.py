@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+try:
+    from ..common import aws_clients
+except ImportError:
+    from common import aws_clients
+
+# Sort key of the item recording that a topic was listed in full
+LISTING = '#listing'
+
+# Maximum number of items accepted by one BatchWriteItem call
+BATCH_WRITE_SIZE = 25
+
+
+class SubscriptionIndexStore:
+    """
+    Subscriptions of SNS topics shared between processor containers, one item per topic, protocol and
+    endpoint, so a new subscription never rewrites the others. The subscriptions of a topic are known
+    once a listing of the topic was recorded, until that listing expires.
+    """
+
+    def subscriptions(self, topic_arn):
+        """
+        Set of (protocol, endpoint) of a topic, None when no listing of the topic is current
+        """
+        raise NotImplementedError
+
+    def record_listing(self, topic_arn, subscriptions, ttl_seconds):
+        """
+        Record every subscription listed from a topic, then the listing itself
+        """
+        raise NotImplementedError
+
+    def add(self, topic_arn, protocol, endpoint, ttl_seconds):
+        raise NotImplementedError
+
+
+class MemorySubscriptionIndexStore(SubscriptionIndexStore):
+    """
+    Process-local subscriptions, used by tests and local runs
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._listed_until = {}
+        self._items = {}
+
+    def subscriptions(self, topic_arn):
+        now = self._clock()
+        with self._lock:
+            if self._listed_until.get(topic_arn, 0) <= now:
+                return None
+            return {
+                subscription for subscription, expires_at in self._items.get(topic_arn, {}).items() if expires_at > now
+            }
+
+    def record_listing(self, topic_arn, subscriptions, ttl_seconds):
+        expires_at = self._clock() + ttl_seconds
+        with self._lock:
+            items = self._items.setdefault(topic_arn, {})
+            for subscription in subscriptions:
+                items[subscription] = expires_at
+            self._listed_until[topic_arn] = expires_at
+
+    def add(self, topic_arn, protocol, endpoint, ttl_seconds):
+        with self._lock:
+            self._items.setdefault(topic_arn, {})[(protocol, endpoint)] = self._clock() + ttl_seconds
+
+
+class FileSubscriptionIndexStore(SubscriptionIndexStore):
+    """
+    Local subscriptions, one directory per topic and one JSON file per subscription
+    """
+
+    def __init__(self, directory, clock=time.time):
+        self.directory = directory
+        self._clock = clock
+
+    def _topic_directory(self, topic_arn):
+        return os.path.join(self.directory, hashlib.sha256(topic_arn.encode('utf-8')).hexdigest())
+
+    def _path(self, topic_arn, name):
+        return os.path.join(self._topic_directory(topic_arn), hashlib.sha256(name.encode('utf-8')).hexdigest() + '.json')
+
+    def subscriptions(self, topic_arn):
+        now = self._clock()
+        listing = self._read(self._path(topic_arn, LISTING))
+        if listing is None or listing['expires_at'] <= now:
+            return None
+        directory = self._topic_directory(topic_arn)
+        subscriptions = set()
+        for name in os.listdir(directory):
+            item = self._read(os.path.join(directory, name)) if name.endswith('.json') else None
+            if item is not None and 'protocol' in item and item['expires_at'] > now:
+                subscriptions.add((item['protocol'], item['endpoint']))
+        return subscriptions
+
+    def record_listing(self, topic_arn, subscriptions, ttl_seconds):
+        expires_at = self._clock() + ttl_seconds
+        for protocol, endpoint in subscriptions:
+            self._write(topic_arn, f"{protocol} {endpoint}", {'protocol': protocol, 'endpoint': endpoint, 'expires_at': expires_at})
+        self._write(topic_arn, LISTING, {'expires_at': expires_at})
+
+    def add(self, topic_arn, protocol, endpoint, ttl_seconds):
+        expires_at = self._clock() + ttl_seconds
+        self._write(topic_arn, f"{protocol} {endpoint}", {'protocol': protocol, 'endpoint': endpoint, 'expires_at': expires_at})
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as item_file:
+                return json.load(item_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, topic_arn, name, item):
+        path = self._path(topic_arn, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as item_file:
+            json.dump(item, item_file)
+        os.replace(temp_path, path)
+
+
+class DynamoDBSubscriptionIndexStore(SubscriptionIndexStore):
+    """
+    Subscriptions in a DynamoDB table with 'topic_arn' as partition key, 'subscription' as sort key and
+    'expires_at' as TTL attribute. The subscriptions of a topic are read with one paginated query.
+    """
+
+    def __init__(self, table_name, clock=time.time):
+        self.table_name = table_name
+        self._clock = clock
+
+    def subscriptions(self, topic_arn):
+        now = self._clock()
+        paginator = aws_clients.client('dynamodb').get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression='topic_arn = :topic',
+            ExpressionAttributeValues={':topic': {'S': topic_arn}}
+        )
+        listed = False
+        subscriptions = set()
+        # DynamoDB deletes expired items lazily, so the expiry is checked on read as well
+        for item in (item for page in pages for item in page.get('Items', [])):
+            if int(item['expires_at']['N']) <= now:
+                continue
+            if item['subscription']['S'] == LISTING:
+                listed = True
+            else:
+                subscriptions.add((item['protocol']['S'], item['endpoint']['S']))
+        return subscriptions if listed else None
+
+    def record_listing(self, topic_arn, subscriptions, ttl_seconds):
+        expires_at = int(self._clock() + ttl_seconds)
+        client = aws_clients.client('dynamodb')
+        requests = [
+            {'PutRequest': {'Item': self._item(topic_arn, protocol, endpoint, expires_at)}}
+            for protocol, endpoint in sorted(subscriptions)
+        ]
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            pending = {self.table_name: requests[start:start + BATCH_WRITE_SIZE]}
+            while pending:
+                pending = client.batch_write_item(RequestItems=pending).get('UnprocessedItems')
+        # Written last, so a listing is only visible once all of its subscriptions are
+        client.put_item(TableName=self.table_name, Item={
+            'topic_arn': {'S': topic_arn},
+            'subscription': {'S': LISTING},
+            'expires_at': {'N': str(expires_at)}
+        })
+
+    def add(self, topic_arn, protocol, endpoint, ttl_seconds):
+        aws_clients.client('dynamodb').put_item(
+            TableName=self.table_name,
+            Item=self._item(topic_arn, protocol, endpoint, int(self._clock() + ttl_seconds))
+        )
+
+    def _item(self, topic_arn, protocol, endpoint, expires_at):
+        return {
+            'topic_arn': {'S': topic_arn},
+            'subscription': {'S': f"{protocol} {endpoint}"},
+            'protocol': {'S': protocol},
+            'endpoint': {'S': endpoint},
+            'expires_at': {'N': str(expires_at)}
+        }
+
+
+def subscription_index_store_from_url(url):
+    """
+    Build a subscription index store from a URL such as memory://, file:///tmp/subscriptions or
+    dynamodb://table-name. Returns None when no URL is configured.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemorySubscriptionIndexStore()
+    if parsed.scheme == 'file':
+        return FileSubscriptionIndexStore(parsed.netloc + parsed.path)
+    if parsed.scheme == 'dynamodb':
+        return DynamoDBSubscriptionIndexStore(parsed.netloc)
+    raise ValueError(f"Unsupported subscription index store URL: {url}")
@@ -0,0 +1,172 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+try:
+    from ..common import aws_clients
+except ImportError:
+    from common import aws_clients
+
+try:
+    from .notifications import email_filter_policy
+    from .subscription_index_store import subscription_index_store_from_url
+except ImportError:
+    from notifications import email_filter_policy
+    from subscription_index_store import subscription_index_store_from_url
+
+logger = logging.getLogger()
+
+
+class SubscriptionIndex:
+    """
+    Set of (protocol, endpoint) subscribed to each SNS topic, kept by the warm container and refreshed
+    after `ttl_seconds`. An optional SubscriptionIndexStore lets new containers skip listing the topic.
+    """
+
+    def __init__(self, ttl_seconds=300, store=None, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._topics = {}
+        self.listings = 0
+        self.subscribes = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            ttl_seconds=int(os.environ.get('SUBSCRIPTION_CACHE_TTL', '300')),
+            store=subscription_index_store_from_url(os.environ.get('SUBSCRIPTION_INDEX_STORE'))
+        )
+
+    def ensure_subscribed(self, sns_client, topic_arn, protocol, endpoint, attributes=None):
+        """
+        Subscribe the endpoint to the topic unless it already is, returns True when a subscription was made.
+        `attributes` are set on a new subscription, e.g. its filter policy.
+        """
+        subscriptions = self._subscriptions(sns_client, topic_arn)
+        if (protocol, endpoint) in subscriptions:
+            return False
+
+        sns_client.subscribe(
+            TopicArn = topic_arn,
+            Protocol = protocol,
+            Endpoint = endpoint,
+            **({'Attributes': attributes} if attributes else {})
+        )
+        # Write through so the next message for this endpoint does not subscribe it again
+        with self._lock:
+            subscriptions.add((protocol, endpoint))
+            self.subscribes += 1
+        self._add(topic_arn, protocol, endpoint)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
+            self.listings = 0
+            self.subscribes = 0
+
+    def stats(self):
+        return {
+            'topics': len(self._topics),
+            'listings': self.listings,
+            'subscribes': self.subscribes
+        }
+
+    def _subscriptions(self, sns_client, topic_arn):
+        entry = self._topics.get(topic_arn)
+        if entry is not None and entry[1] > self._clock():
+            return entry[0]
+
+        with self._lock:
+            entry = self._topics.get(topic_arn)
+            if entry is not None and entry[1] > self._clock():
+                return entry[0]
+            subscriptions = self._load(topic_arn)
+            listed = None
+            if subscriptions is None:
+                subscriptions = self._list(sns_client, topic_arn)
+                self.listings += 1
+                # Snapshot taken before other threads can add to the set
+                listed = set(subscriptions)
+            self._topics[topic_arn] = (subscriptions, self._clock() + self.ttl_seconds)
+        if listed is not None:
+            self._record_listing(topic_arn, listed)
+        return subscriptions
+
+    def _list(self, sns_client, topic_arn):
+        # Walk every page, a topic returns at most 100 subscriptions per call
+        paginator = sns_client.get_paginator('list_subscriptions_by_topic')
+        return {
+            (subscription['Protocol'], subscription['Endpoint'])
+            for page in paginator.paginate(TopicArn=topic_arn)
+            for subscription in page['Subscriptions']
+        }
+
+    def _load(self, topic_arn):
+        if self.store is None:
+            return None
+        try:
+            return self.store.subscriptions(topic_arn)
+        except Exception as e:
+            logger.warning(f"Subscription index read failed: {str(e)}")
+            return None
+
+    def _record_listing(self, topic_arn, subscriptions):
+        if self.store is None:
+            return
+        try:
+            self.store.record_listing(topic_arn, subscriptions, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Subscription index write failed: {str(e)}")
+
+    def _add(self, topic_arn, protocol, endpoint):
+        if self.store is None:
+            return
+        try:
+            self.store.add(topic_arn, protocol, endpoint, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Subscription index write failed: {str(e)}")
+
+
+def add_filter_policies(sns_client, topic_arn):
+    """
+    Set the filter policy on the confirmed email subscriptions of a topic, so subscriptions made before
+    filter policies were introduced stop receiving every email. Returns the number of subscriptions updated.
+    """
+    updated = 0
+    paginator = sns_client.get_paginator('list_subscriptions_by_topic')
+    for page in paginator.paginate(TopicArn=topic_arn):
+        for subscription in page['Subscriptions']:
+            # Attributes of a pending subscription can only be set once it is confirmed
+            if subscription['Protocol'] != 'email' or not subscription['SubscriptionArn'].startswith('arn:'):
+                continue
+            sns_client.set_subscription_attributes(
+                SubscriptionArn = subscription['SubscriptionArn'],
+                AttributeName = 'FilterPolicy',
+                AttributeValue = email_filter_policy(subscription['Endpoint'])
+            )
+            updated += 1
+    return updated
+
+
+def main(argv=None):
+    """
+    Set the filter policy of existing email subscriptions once, e.g. from src/lambda:
+    python -m weather_processor.subscriptions --topic-arn arn:aws:sns:<region>:<account>:<topic>
+    """
+    parser = argparse.ArgumentParser(description='Set the filter policy of the email subscriptions of a topic')
+    parser.add_argument('--topic-arn', default=os.environ.get('SNS_TOPIC_ARN'), help='topic ARN, SNS_TOPIC_ARN by default')
+    args = parser.parse_args(argv)
+
+    if not args.topic_arn:
+        parser.error('--topic-arn or SNS_TOPIC_ARN is required')
+    updated = add_filter_policies(aws_clients.client('sns'), args.topic_arn)
+    print(f"Filter policy set on {updated} email subscriptions")
+
+
+if __name__ == '__main__':
+    main()